@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+import asyncio
+import concurrent.futures
+import logging
+import sample_bus
+import signal
+import time
+
+EXTRA_WORKERS = 1  # for run_blocking() calls, on top of one per periodic
+
+
+class AsyncSubscription:
+  # sample_bus.Subscription for a coroutine, only published to from the event loop thread
+  def __init__(self, topics=None, maxsize=sample_bus.QUEUE_SIZE):
+    self._topics = frozenset(topics) if topics is not None else None
+    self._queue = asyncio.Queue(maxsize)
+    self._dropped = 0
+
+  @property
+  def topics(self):
+    return self._topics
+
+  @property
+  def dropped(self):
+    return self._dropped
+
+  def accepts(self, topic):
+    return self._topics is None or topic in self._topics
+
+  def put(self, sample):
+    if self._queue.full():
+      self._queue.get_nowait()
+      self._dropped += 1
+    self._queue.put_nowait(sample)
+
+  async def get(self):
+    return await self._queue.get()
+
+  async def close(self, stop):
+    # Queued after the samples still waiting, makes room for itself instead of dropping one
+    await self._queue.put(stop)
+
+  def __len__(self):
+    return self._queue.qsize()
+
+
+class AsyncRuntime:
+  # Runs the samplers, stages and periodic services of the monitor as coroutines on one event loop.
+  # Blocking sysfs, GPIO, I2C and database calls run in an executor with a worker for every periodic,
+  # a blocking stage like the multi second e-ink refresh has its own so it never holds up the sensors.
+  # SIGINT or SIGTERM stop it: the samplers and services are cancelled first, then the stages
+  # handle the samples left in their queues, then the executors finish their calls.
+  _STOP = sample_bus.Sample(None, None, None)
+
+  def __init__(self, bus, max_workers=None):
+    self._bus = bus
+    self._max_workers = max_workers
+    self._loop = None
+    self._executor = None
+    self._stop_event = None
+    self._periodics = []
+    self._stages = []
+
+  def add_periodic(self, name, func, period, publish=None):
+    # Calls func() in the executor every period seconds and publish(result) on the event loop.
+    # period may be a function returning the delay before the next call.
+    self._periodics.append((name, func, period, publish))
+
+  def add_stage(self, name, handler, topics=None, maxsize=sample_bus.QUEUE_SIZE, blocking=False):
+    # Same as SampleBus.add_stage, a blocking handler runs in the executor
+    subscription = AsyncSubscription(topics, maxsize)
+    self._stages.append((name, handler, subscription, blocking))
+    return subscription
+
+  def run_blocking(self, func, *args, executor=None):
+    return self._loop.run_in_executor(executor or self._executor, func, *args)
+
+  def stop(self):
+    # Thread safe
+    if self._loop is not None:
+      self._loop.call_soon_threadsafe(self._stop_event.set)
+
+  async def _periodic(self, name, func, period, publish):
+    logging.info(f'{name} started')
+    try:
+      while True:
+        begin = time.monotonic()
+        try:
+          result = await self.run_blocking(func)
+          if publish is not None:
+            publish(result)
+        except Exception:
+          logging.exception(f'{name} failed')
+        delay = period() if callable(period) else period - (time.monotonic() - begin)
+        await asyncio.sleep(max(delay, 0))
+    finally:
+      logging.info(f'{name} stopped')
+
+  async def _stage(self, name, handler, subscription, executor):
+    # executor is the one of a blocking stage, None if the handler runs on the event loop
+    logging.info(f'{name} stage started')
+    while True:
+      sample = await subscription.get()
+      if sample is self._STOP:
+        break
+      try:
+        if executor is not None:
+          await self.run_blocking(handler, sample, executor=executor)
+        else:
+          handler(sample)
+      except Exception:
+        logging.exception(f'{name} stage failed on {sample}')
+    logging.info(f'{name} stage stopped, {subscription.dropped} samples dropped')
+
+  async def _run(self):
+    self._loop = asyncio.get_running_loop()
+    self._stop_event = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+      self._loop.add_signal_handler(signum, self._stop_event.set)
+    max_workers = self._max_workers or len(self._periodics) + EXTRA_WORKERS
+    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='Async Runtime')
+    # A stage handles one sample at a time, one worker is enough
+    stage_executors = {name: concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{name} Stage')
+                       for name, _, _, blocking in self._stages if blocking}
+    try:
+      stages = []
+      for name, handler, subscription, _ in self._stages:
+        self._bus.attach(subscription)
+        stages.append(asyncio.create_task(self._stage(name, handler, subscription, stage_executors.get(name)), name=name))
+      periodics = [asyncio.create_task(self._periodic(*periodic), name=periodic[0]) for periodic in self._periodics]
+      await self._stop_event.wait()
+
+      for task in periodics:
+        task.cancel()
+      await asyncio.gather(*periodics, return_exceptions=True)
+      for _, _, subscription, _ in self._stages:
+        await subscription.close(self._STOP)
+      await asyncio.gather(*stages, return_exceptions=True)
+      for _, _, subscription, _ in self._stages:
+        self._bus.unsubscribe(subscription)
+    finally:
+      for signum in (signal.SIGINT, signal.SIGTERM):
+        self._loop.remove_signal_handler(signum)
+      # Waits for the blocking calls of the cancelled coroutines
+      self._executor.shutdown()
+      for executor in stage_executors.values():
+        executor.shutdown()
+      self._loop = None
+
+  def run(self):
+    # Blocks until stop() or a SIGINT or SIGTERM
+    asyncio.run(self._run())
+
+
+if __name__ == "__main__":
+  import threading
+  import unittest
+
+  class AsyncRuntimeTest(unittest.TestCase):
+    def testRun(self):
+      bus = sample_bus.SampleBus()
+      runtime = AsyncRuntime(bus)
+      counter = iter(range(1000))
+      def publish(value):
+        bus.publish('count', value)
+        if value == 10:
+          runtime.stop()
+      runtime.add_periodic('Counter', lambda: next(counter), 0.01, publish)
+      handled = []
+      blocking = []
+      runtime.add_stage('Handled', lambda sample: handled.append(sample.value))
+      runtime.add_stage('Blocking', lambda sample: blocking.append(threading.current_thread().name), maxsize=1, blocking=True)
+      runtime.run()
+      # Every sample published before the stop is handled, nothing is published after it
+      self.assertEqual(handled, list(range(11)))
+      self.assertEqual(next(counter), 11)
+      self.assertTrue(blocking)
+      self.assertTrue(all(name.startswith('Blocking Stage') for name in blocking))
+      # The stages are unsubscribed
+      bus.publish('count', -1)
+      self.assertEqual(handled, list(range(11)))
+
+    def testSlowStage(self):
+      # A blocking stage does not hold up the periodics
+      bus = sample_bus.SampleBus()
+      runtime = AsyncRuntime(bus)
+      calls = []
+      runtime.add_periodic('Sampler', lambda: calls.append(time.monotonic()), 0.01, lambda _: bus.publish('sample', 1))
+      runtime.add_stage('Slow', lambda sample: time.sleep(0.3), maxsize=1, blocking=True)
+      threading.Timer(0.25, runtime.stop).start()
+      runtime.run()
+      self.assertGreater(len(calls), 10)
+
+    def testFailure(self):
+      bus = sample_bus.SampleBus()
+      runtime = AsyncRuntime(bus)
+      calls = []
+      def fail():
+        calls.append(1)
+        raise OSError('unplugged')
+      runtime.add_periodic('Failing', fail, lambda: 0.01)
+      threading.Timer(0.1, runtime.stop).start()
+      with self.assertLogs(level=logging.ERROR):
+        runtime.run()
+      self.assertGreater(len(calls), 2)
+
+  unittest.main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import array
+import bisect
+import math
+
+# (deadband, tolerance) per column. Values within the deadband of the last passed value
+# are dropped, the swinging door keeps the points needed to rebuild the signal by linear
+# interpolation within the tolerance, plus up to twice the deadband for the dropped values.
+# Matches the resolution of the environment table.
+TOLERANCES = {
+  'air_temp': (0.05, 0.1),
+  'water_temp': (0.05, 0.1),
+  'uva': (1, 2),
+  'uvb': (1, 2),
+  'water_dist': (1, 2),
+}
+MAX_INTERVAL = 900  # 15min, a point is kept at least this often even for a flat signal
+
+
+class SwingingDoor:
+  def __init__(self, deadband=0.0, tolerance=0.0, max_interval=MAX_INTERVAL):
+    self._deadband = deadband
+    self._tolerance = tolerance
+    self._max_interval = max_interval
+    self._archived = None   # last point kept
+    self._snapshot = None   # last point through the door, kept if the next one closes it
+    self._upper = None
+    self._lower = None
+    self._exception = None  # last point passing the deadband
+    self._held = None       # last point dropped by the deadband
+
+  def _overdue(self, ts, point):
+    return self._max_interval is not None and ts - point[0] >= self._max_interval
+
+  def _door(self, ts, value):
+    archived_ts, archived_value = self._archived
+    dt = ts - archived_ts
+    if dt <= 0:
+      return []
+    kept = []
+    upper = (value + self._tolerance - archived_value) / dt
+    lower = (value - self._tolerance - archived_value) / dt
+    if self._snapshot is not None:
+      upper = min(self._upper, upper)
+      lower = max(self._lower, lower)
+      if lower > upper:
+        # The door closed, the snapshot is the last point the line from the archived point can reach
+        kept.append(self._snapshot)
+        archived_ts, archived_value = self._archived = self._snapshot
+        dt = ts - archived_ts
+        upper = (value + self._tolerance - archived_value) / dt
+        lower = (value - self._tolerance - archived_value) / dt
+    self._upper, self._lower = upper, lower
+    self._snapshot = (ts, value)
+    if self._overdue(ts, self._archived):
+      kept.append(self._snapshot)
+      self._archived = self._snapshot
+      self._snapshot = None
+    return kept
+
+  def add(self, ts, value):
+    # Returns the (ts, value) points to keep, they lag behind the added points
+    if value is None or math.isnan(value):
+      return []
+    if self._archived is None:
+      self._archived = self._exception = (ts, value)
+      return [self._archived]
+    if abs(value - self._exception[1]) <= self._deadband and not self._overdue(ts, self._exception):
+      self._held = (ts, value)
+      return []
+    kept = []
+    if self._held is not None:
+      # The end of the flat stretch, the door needs it to start the change at the right time
+      kept += self._door(*self._held)
+      self._held = None
+    self._exception = (ts, value)
+    return kept + self._door(ts, value)
+
+  def flush(self):
+    kept = []
+    if self._held is not None:
+      kept += self._door(*self._held)
+      self._held = None
+    if self._snapshot is not None:
+      kept.append(self._snapshot)
+      self._archived = self._snapshot
+      self._snapshot = None
+    return kept
+
+
+class Compressor:
+  # Compresses (ts, value, ...) rows column by column. A kept row has None for the
+  # columns whose value at that time is not needed.
+  def __init__(self, columns, tolerances=TOLERANCES, max_interval=MAX_INTERVAL):
+    self._doors = [SwingingDoor(*tolerances.get(column, (0.0, 0.0)), max_interval) for column in columns]
+
+  def _rows(self, points):
+    rows = {}
+    for i, column_points in enumerate(points):
+      for ts, value in column_points:
+        row = rows.setdefault(ts, [ts] + [None] * len(self._doors))
+        row[i + 1] = value
+    return [tuple(rows[ts]) for ts in sorted(rows)]
+
+  def add(self, row):
+    return self._rows([door.add(row[0], value) for door, value in zip(self._doors, row[1:])])
+
+  def flush(self):
+    return self._rows([door.flush() for door in self._doors])
+
+
+def interpolate(ts, values, at):
+  # Linear interpolation of the non NaN points of values at the timestamps in at, NaN outside
+  points = [(t, v) for t, v in zip(ts, values) if not math.isnan(v)]
+  times = [t for t, _ in points]
+  result = array.array('d')
+  for t in at:
+    i = bisect.bisect_left(times, t)
+    if i < len(times) and times[i] == t:
+      result.append(points[i][1])
+    elif 0 < i < len(times):
+      (t0, v0), (t1, v1) = points[i - 1], points[i]
+      result.append(v0 + (v1 - v0) * (t - t0) / (t1 - t0))
+    else:
+      result.append(math.nan)
+  return result
+
+def reconstruct(result, at=None):
+  # Rebuilds the columns of a DataStore.query() result of compressed rows at the
+  # timestamps in at, by default the timestamps of the result
+  if at is None:
+    at = result['ts']
+  rebuilt = {'ts': array.array('d', at)}
+  for column, values in result.items():
+    if column != 'ts':
+      rebuilt[column] = interpolate(result['ts'], values, at)
+  return rebuilt
+
+
+if __name__ == "__main__":
+  import random
+  import unittest
+
+  class SwingingDoorTest(unittest.TestCase):
+    def testFlat(self):
+      door = SwingingDoor(0.05, 0.1, max_interval=100)
+      kept = door.add(0, 25.0)
+      for t in range(5, 100, 5):
+        kept += door.add(t, 25.0 + random.uniform(-0.04, 0.04))
+      self.assertEqual(kept, [(0, 25.0)])
+      kept = door.add(100, 25.0)
+      self.assertEqual(len(kept), 1)
+      self.assertEqual(kept[0][0], 100)
+
+    def testLine(self):
+      door = SwingingDoor(0, 0.1)
+      kept = []
+      for t in range(0, 100, 5):
+        kept += door.add(t, 20.0 + t * 0.01)
+      kept += door.add(100, 10.0)
+      kept += door.flush()
+      self.assertEqual([t for t, _ in kept], [0, 95, 100])
+
+    def testTolerance(self):
+      random.seed(1)
+      door = SwingingDoor(0.05, 0.1)
+      ts = [t * 5.0 for t in range(500)]
+      values = [25.0 + 2 * math.sin(t / 300) + random.uniform(-0.04, 0.04) for t in ts]
+      kept = []
+      for t, v in zip(ts, values):
+        kept += door.add(t, v)
+      kept += door.flush()
+      self.assertLess(len(kept), len(ts) / 5)
+      rebuilt = interpolate([t for t, _ in kept], [v for _, v in kept], ts)
+      for v, r in zip(values, rebuilt):
+        self.assertLess(abs(v - r), 0.1 + 2 * 0.05)
+
+  class CompressorTest(unittest.TestCase):
+    def testRows(self):
+      compressor = Compressor(('a', 'b'), {'a': (0.5, 0.5), 'b': (0, 0)})
+      self.assertEqual(compressor.add((0, 1.0, 1.0)), [(0, 1.0, 1.0)])
+      self.assertEqual(compressor.add((5, 1.1, 2.0)), [])
+      self.assertEqual(compressor.add((10, 1.2, 4.0)), [(5, None, 2.0)])
+      self.assertEqual(compressor.flush(), [(10, 1.2, 4.0)])
+
+    def testReconstruct(self):
+      result = {
+        'ts': array.array('d', [0, 5, 10, 20]),
+        'a': array.array('d', [1.0, math.nan, 2.0, math.nan]),
+      }
+      rebuilt = reconstruct(result)
+      self.assertEqual(list(rebuilt['a'][:3]), [1.0, 1.5, 2.0])
+      self.assertTrue(math.isnan(rebuilt['a'][3]))
+
+  unittest.main()
@@ -1,43 +1,370 @@
+import array
 import logging
-import mysql.connector
-
-CREATE_STATEMENT = """
-CREATE TABLE IF NOT EXISTS environment (
-  id INTEGER UNSIGNED NOT NULL AUTO_INCREMENT,
-  ts TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-  air_temp DECIMAL(3,1),
-  water_temp DECIMAL(3,1),
-  uva DECIMAL(4) UNSIGNED,
-  uvb DECIMAL(4) UNSIGNED,
-  water_dist DECIMAL(3) UNSIGNED,
-  PRIMARY KEY (id)
-);
-"""
-
-INSERT_STATEMENT = 'INSERT INTO environment (air_temp, water_temp, uva, uvb, water_dist) VALUES (%s, %s, %s, %s, %s)'
+import math
+import random
+import rollup
+import spool
+import storage_backend
+import threading
+import time
+
+FLUSH_SIZE = 12      # samples, 1 minute at the monitor's 5s cadence
+FLUSH_INTERVAL = 60  # 60s
+RETRY_MIN_INTERVAL = 1    # 1s, doubled after every failed connection attempt
+RETRY_MAX_INTERVAL = 300  # 5min
+PING_INTERVAL = 60        # 60s without database activity before checking the connection
+REPLAY_CHUNK = 500   # entries replayed per transaction
+
+SPOOL_PATH = '/home/pi/turtle_monitor.spool'
+
+SAMPLE_PERIOD = 5     # 5s between entries of the environment table
+QUERY_POINTS = 2000   # automatic resolution picks the finest level returning at most this many points
+QUERY_CHUNK = 1000    # rows fetched and converted at a time
+
+RESOLUTIONS = {
+  'raw': SAMPLE_PERIOD,
+  'minute': 60,
+  'hour': 3600,
+  'day': 86400,
+}
 
 class DataStore:
-  def __init__(self):
-    self._connection = mysql.connector.connect(read_default_file='/home/pi/.my.cnf')
-    self._cursor = self._connection.cursor()
-    self._cursor.execute(CREATE_STATEMENT)
+  def __init__(self, backend=None, buffered=False, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, spool_path=SPOOL_PATH, compressor=None,
+               threaded=True):
+    self._backend = backend if backend is not None else storage_backend.MySQLBackend()
+    # Optional compression.Compressor, only the rows it keeps reach the environment table
+    self._compressor = compressor
+    # Rolled up from every sample, before compression
+    self._rollups = rollup.Accumulator()
+    self._connected = False
+    self._lock = threading.Lock()
+    self._spool = spool.Spool(spool_path)
+    # The rollups of the entries that could not be stored, (level, start, samples, stats...) records
+    self._rollup_spool = spool.Spool(f'{spool_path}.rollups', width=3 + len(storage_backend.ROLLUP_COLUMNS))
+    # Connecting is left to the service thread, it never delays the caller
+    self._retry_interval = RETRY_MIN_INTERVAL
+    self._next_connect = time.monotonic()
+    self._next_ping = None
+    self._buffered = buffered
+    self._flush_size = max(flush_size, 1)
+    self._flush_interval = flush_interval
+    self._pending = []
+    self._pending_samples = 0
+    self._pending_since = None
+    self._condition = threading.Condition()
+    # Without the service thread the caller runs service() every service_timeout seconds
+    self._service_thread = None
+    self._running = False
+    # Until close(), with or without the service thread, the spools are replayed
+    self._closing = False
+    if threaded:
+      self._service_thread = threading.Thread(target=self._service, name='DataStore Service')
+      self._running = True
+      self._service_thread.start()
+
+  @property
+  def backend(self):
+    return self._backend
+
+  @property
+  def buffered(self):
+    return self._buffered
+
+  @property
+  def connected(self):
+    return self._connected
+
+  @property
+  def compressor(self):
+    return self._compressor
+
+  @property
+  def pending(self):
+    with self._condition:
+      return self._pending_samples
+
+  @property
+  def spooled(self):
+    return len(self._spool)
+
+  @property
+  def spooled_rollups(self):
+    return len(self._rollup_spool)
+
+  def _connect(self):
+    # Nobody else uses the backend while it is not connected, connecting can take up to the
+    # connection timeout and does not hold the lock the writers wait for
+    try:
+      self._backend.connect()
+    except storage_backend.StorageError as e:
+      # Exponential backoff with jitter, a restarting database is not hammered
+      delay = self._retry_interval * random.uniform(0.5, 1.0)
+      self._next_connect = time.monotonic() + delay
+      self._retry_interval = min(self._retry_interval * 2, RETRY_MAX_INTERVAL)
+      logging.error(f'Could not connect to {self._backend.name} database, retry in {delay:.1f}s: {e}')
+      return False
+    with self._lock:
+      self._connected = True
+      self._retry_interval = RETRY_MIN_INTERVAL
+      self._next_ping = time.monotonic() + PING_INTERVAL
+      logging.info(f'Connected to {self._backend.name} database')
+      return True
+
+  def _lost_connection(self, e):
+    # Caller holds self._lock
+    logging.error(f'Lost connection to {self._backend.name} database: {e}')
+    self._backend.close()
+    self._connected = False
+    self._next_connect = time.monotonic()
+
+  def _ping(self):
+    with self._lock:
+      if not self._connected:
+        return
+      try:
+        self._backend.ping()
+        self._next_ping = time.monotonic() + PING_INTERVAL
+      except storage_backend.StorageError as e:
+        self._lost_connection(e)
+
+  def _query_plan(self, start, end, columns, resolution):
+    if resolution is None:
+      resolution = 'day'
+      for name, period in RESOLUTIONS.items():
+        if (end - start) / period <= QUERY_POINTS:
+          resolution = name
+          break
+    if resolution not in RESOLUTIONS:
+      raise ValueError(f'Unknown resolution {resolution}, expected one of {", ".join(RESOLUTIONS)}')
+    if columns is None:
+      columns = storage_backend.COLUMNS
+    if resolution == 'raw':
+      table = 'environment'
+      valid = storage_backend.COLUMNS
+      select = list(columns)
+    else:
+      # A plain column name reads the mean of the bucket
+      table = storage_backend.rollup_table(resolution)
+      valid = storage_backend.COLUMNS + storage_backend.ROLLUP_COLUMNS + ('samples',)
+      select = [f'{column}_mean' if column in storage_backend.COLUMNS else column for column in columns]
+    for column in columns:
+      if column not in valid:
+        raise ValueError(f'Unknown column {column} for resolution {resolution}')
+    return table, list(columns), select
+
+  def query_chunks(self, start, end, columns=None, resolution=None, chunk_size=QUERY_CHUNK):
+    # Yields {'ts': array, column: array, ...} for every chunk of rows between start and end,
+    # in epoch seconds. NULL values are NaN. Memory is bounded by chunk_size.
+    table, columns, select = self._query_plan(start, end, columns, resolution)
+    for rows in self._backend.select(table, select, start, end, chunk_size):
+      chunk = {'ts': array.array('d', (float(row[0]) for row in rows))}
+      for i, column in enumerate(columns, 1):
+        chunk[column] = array.array('d', (math.nan if row[i] is None else float(row[i]) for row in rows))
+      yield chunk
+
+  def query(self, start, end, columns=None, resolution=None):
+    # resolution is 'raw', 'minute', 'hour' or 'day', None picks one for the time range
+    _, columns, _ = self._query_plan(start, end, columns, resolution)
+    result = {column: array.array('d') for column in ['ts'] + columns}
+    for chunk in self.query_chunks(start, end, columns, resolution):
+      for column, values in chunk.items():
+        result[column].extend(values)
+    return result
 
-  def add_data(self, air_temp, water_temp, uva, uvb, water_dist):
+  def add_data(self, air_temp, water_temp, uva, uvb, water_dist, timestamp=None):
+    # Timestamp the sample now unless it was taken earlier, it may reach the database much later in buffered mode
+    data = (time.time() if timestamp is None else timestamp, air_temp, water_temp, uva, uvb, water_dist)
+    self._rollups.add(data)
+    rows = self._compressor.add(data) if self._compressor else [data]
+    if not self._buffered:
+      # Never waits for the service thread, the entries are spooled while it holds the connection
+      self._write(rows, blocking=False)
+      return
+    with self._condition:
+      if not self._pending_samples:
+        self._pending_since = time.monotonic()
+      self._pending += rows
+      self._pending_samples += 1
+      if self._pending_samples >= self._flush_size:
+        self._condition.notify()
+
+  def _insert(self, rows, rollups=None, blocking=True):
+    # Returns False if the database could not be reached, or without blocking if the
+    # service thread is connected to it, pinging or replaying
+    if not self._lock.acquire(blocking):
+      logging.debug(f'Database busy, {len(rows)} entries not added')
+      return False
     try:
-      data = (air_temp, water_temp, uva, uvb, water_dist)
-      self._cursor.execute(INSERT_STATEMENT, data)
-      self._connection.commit()
-      logging.debug('Successfully added entry to database')
-    except mysql.connector.Error as e:
-      logging.error(f'Error adding entry to database: {e}')
-      
+      if not self._connected:
+        return False
+      try:
+        self._backend.insert(rows, rollups)
+        self._next_ping = time.monotonic() + PING_INTERVAL
+        logging.debug(f'Successfully added {len(rows)} entries to database')
+      except storage_backend.StorageConnectionError as e:
+        self._lost_connection(e)
+        return False
+      except storage_backend.StorageError as e:
+        # A problem with the entries themselves, retrying would not help
+        logging.error(f'Error adding {len(rows)} entries to database: {e}')
+      return True
+    finally:
+      self._lock.release()
+
+  def _write(self, rows, blocking=True):
+    # The rollups go with the entries of the same time. While the database is unavailable
+    # they are spooled with the entries and replayed before them.
+    rollups = rollup.bucket_rows(self._rollups.take())
+    if not self._insert(rows, rollups, blocking):
+      records = [(level_index,) + row for level_index, level in enumerate(rollup.LEVELS) for row in rollups[level]]
+      if records:
+        self._rollup_spool.append(records)
+      if rows:
+        self._spool.append(rows)
+        logging.warning(f'Spooled {len(rows)} entries, {len(self._spool)} waiting for database')
+      with self._condition:
+        self._condition.notify()
+
+  def _replay(self):
+    levels = list(rollup.LEVELS)
+    while not self._closing and len(self._rollup_spool) > 0:
+      records = self._rollup_spool.peek(REPLAY_CHUNK)
+      rollups = {level: [] for level in levels}
+      for record in records:
+        rollups[levels[int(record[0])]].append(record[1:])
+      if not self._insert([], rollups):
+        return
+      self._rollup_spool.consume(len(records))
+      logging.info(f'Replayed {len(records)} spooled rollups, {len(self._rollup_spool)} remaining')
+    while not self._closing and len(self._spool) > 0:
+      rows = self._spool.peek(REPLAY_CHUNK)
+      if not self._insert(rows):
+        return
+      self._spool.consume(len(rows))
+      logging.info(f'Replayed {len(rows)} spooled entries, {len(self._spool)} remaining')
+
+  def _take_pending(self):
+    with self._condition:
+      rows = self._pending
+      self._pending = []
+      self._pending_samples = 0
+      self._pending_since = None
+    return rows
+
+  def flush(self):
+    rows = self._take_pending()
+    if rows or len(self._rollups) > 0:
+      self._write(rows)
+
+  def _flush_timeout(self):
+    if not self._pending_samples:
+      return None
+    return self._flush_interval - (time.monotonic() - self._pending_since)
+
+  def _service_timeout(self):
+    deadline = self._next_ping if self._connected else self._next_connect
+    timeout = deadline - time.monotonic()
+    flush_timeout = self._flush_timeout()
+    if flush_timeout is not None:
+      timeout = min(timeout, flush_timeout)
+    return timeout
+
+  @property
+  def service_timeout(self):
+    # Seconds before service() has something to do, 0 if it has now
+    with self._condition:
+      if self._pending_samples >= self._flush_size:
+        return 0
+      return max(self._service_timeout(), 0)
+
+  def _service(self):
+    logging.info('DataStore Service started')
+    while self._running:
+      with self._condition:
+        timeout = self._service_timeout()
+        if self._pending_samples < self._flush_size and timeout > 0:
+          self._condition.wait(timeout)
+      if not self._running:
+        break
+      self.service()
+    logging.info('DataStore Service stopped')
+
+  def service(self):
+    # Flushes buffered entries, connects and checks the connection to the database
+    # and replays the spool, so none of this work happens on the thread adding the data.
+    with self._condition:
+      timeout = self._flush_timeout()
+      due = self._pending_samples >= self._flush_size or (timeout is not None and timeout <= 0)
+    now = time.monotonic()
+    if not self._connected and now >= self._next_connect:
+      self._connect()
+    elif self._connected and now >= self._next_ping:
+      self._ping()
+    if due:
+      self.flush()
+    if self._connected:
+      self._replay()
+
   def close(self):
-    self._connection.close()
+    with self._condition:
+      self._closing = True
+    if self._running:
+      with self._condition:
+        self._running = False
+        self._condition.notify()
+      self._service_thread.join()
+      self._service_thread = None
+    if self._compressor:
+      with self._condition:
+        self._pending += self._compressor.flush()
+    # The service may not have connected yet, the last entries are only spooled if the database is unavailable
+    if not self._connected:
+      self._connect()
+    self.flush()
+    with self._lock:
+      if self._connected:
+        self._backend.close()
+        self._connected = False
+    self._spool.close()
+    self._rollup_spool.close()
 
 
 
 if __name__ == "__main__":
   import argparse
+  import compression
+  import os
+  import sys
+  import tempfile
+  import unittest
+
+  class DataStoreTest(unittest.TestCase):
+    def setUp(self):
+      self._dir = tempfile.TemporaryDirectory()
+      self._backend = storage_backend.SQLiteBackend(os.path.join(self._dir.name, 'test.db'))
+      self._spool_path = os.path.join(self._dir.name, 'test.spool')
+
+    def tearDown(self):
+      self._dir.cleanup()
+
+    def _count(self, table):
+      # select() opens a connection of its own
+      return sum(len(rows) for rows in self._backend.select(table, ['ts'], 0, 2 ** 32, QUERY_CHUNK))
+
+    def testServiceReplaysWithoutThread(self):
+      ds = DataStore(self._backend, spool_path=self._spool_path, threaded=False)
+      # Not connected yet, the entry and its rollups are spooled
+      ds.add_data(27.2, 24.9, 100.4, 125.8, 69.7, timestamp=1000)
+      self.assertEqual(ds.spooled, 1)
+      self.assertGreater(ds.spooled_rollups, 0)
+      for _ in range(3):
+        ds.service()
+      self.assertTrue(ds.connected)
+      self.assertEqual(ds.spooled, 0)
+      self.assertEqual(ds.spooled_rollups, 0)
+      ds.close()
+      self.assertEqual(self._count('environment'), 1)
+      self.assertEqual(self._count(storage_backend.rollup_table('minute')), 1)
 
   parser = argparse.ArgumentParser()
   parser.add_argument(
@@ -46,10 +373,58 @@ if __name__ == "__main__":
       type=lambda x: getattr(logging, x),
       help='Configure the logging level. default: INFO'
   )
+  parser.add_argument(
+      '--storage',
+      default=storage_backend.MySQLBackend.name,
+      choices=storage_backend.BACKENDS.keys(),
+      help='Database used to store the entries. default: mysql'
+  )
+  parser.add_argument(
+      '--sqlite-path',
+      default=storage_backend.SQLITE_PATH,
+      help=f'Database file of the sqlite storage. default: {storage_backend.SQLITE_PATH}'
+  )
+  parser.add_argument(
+      '--mysql-pool-size',
+      default=None,
+      type=int,
+      help='Take the MySQL connections from a pool of this size. default: no pool'
+  )
+  parser.add_argument(
+      '--buffered',
+      default=False,
+      type=bool,
+      help='Queue entries in memory and write them in batches'
+  )
+  parser.add_argument(
+      '--compress',
+      default=False,
+      type=bool,
+      help='Only store the entries needed to rebuild the readings within their tolerances'
+  )
+  parser.add_argument(
+      '--spool-path',
+      default=SPOOL_PATH,
+      help=f'File keeping entries while the database is unavailable. default: {SPOOL_PATH}'
+  )
+  parser.add_argument(
+      '--test',
+      action='store_true',
+      help='Run the unit tests of the data store instead of the demo'
+  )
   args = parser.parse_args()
   logging.basicConfig(level=args.log_level)
 
-  ds = DataStore()
+  if args.test:
+    unittest.main(argv=sys.argv[:1])
+
+  backend = storage_backend.create(args.storage, sqlite_path=args.sqlite_path, mysql_pool_size=args.mysql_pool_size)
+  compressor = compression.Compressor(storage_backend.COLUMNS) if args.compress else None
+  ds = DataStore(backend, buffered=args.buffered, spool_path=args.spool_path, compressor=compressor)
+  # The service thread connects lazily, entries added before are spooled until the next run
+  deadline = time.monotonic() + storage_backend.MYSQL_CONNECTION_TIMEOUT
+  while not ds.connected and time.monotonic() < deadline:
+    time.sleep(0.1)
   ds.add_data(27.234, 24.982, 100.4, 125.8, 69.777)
   ds.add_data(26.123, 24.021, 98.4, 120.8, 70.77)
-  ds.close()
\ No newline at end of file
+  ds.close()
@@ -1,22 +1,59 @@
 #!/usr/bin/env python3
 
 from classproperty import classproperty
+import concurrent.futures
 import glob
+import hal
+import inotify
 import logging
+import os
+import queue
+import select
 import threading
 import time
 
+MAX_READ_WORKERS = 8
+SERVICE_PERIOD = 1.0  # 1s between passes over the devices
+QUEUE_SIZE = 16
+
+# sysfs does not always report new or removed devices to inotify, rescan this often anyway
+RESCAN_INTERVAL = 60  # 60s
+
+# Adaptive resolution: 10 bit (0.25℃, ~188ms conversion) while the temperature is stable,
+# 12 bit (0.0625℃, ~750ms conversion) after it changed or when a precise reading is asked for.
+LOW_RESOLUTION = 10
+HIGH_RESOLUTION = 12
+STABLE_THRESHOLD = 0.5  # ℃ from the first stable reading, above the 10 bit quantization noise
+STABLE_COUNT = 5        # readings within the threshold before lowering the resolution
+
 
 class DS18B20:
   _devices = {}
+  _device_list = []
+  _scan_time = None
+  _scan_lock = threading.Lock()
+  _hotplug_thread = None
+  _hotplug_wakeup = None
+  _hotplug_subscribers = []
   _async_mode = False
   _service_thread = None
   _bulk_read = True
+  _read_executor = None
+  _adaptive_resolution = False
+  _period = SERVICE_PERIOD
+  _stop_event = threading.Event()
+  _subscribers = []
+  _subscribers_lock = threading.Lock()
   def __init__(self, device_folder):
     self._device_folder = device_folder
     self._device_id = None
     self._temperature = 0
     self._timestamp = None
+    self._read_time = None
+    self._resolution = None
+    self._stable_count = 0
+    self._stable_temperature = None
+    self._adaptive = True
 
   def read_property(self, filename):
     with open(f'{self._device_folder}/{filename}', 'r') as f:
@@ -43,15 +80,76 @@ class DS18B20:
     return self._temperature
 
   def _read_temperature(self):
-    temp_raw = self.read_property('temperature')
-    if temp_raw:
-      self._temperature = float(temp_raw) / 1000.0
-      self._timestamp = time.time()
+    # Returns True if a new temperature was read, the previous one is kept otherwise
+    begin = time.monotonic()
+    try:
+      temp_raw = self.read_property('temperature')
+    except OSError as ex:
+      # Most likely the device was unplugged, have the registry check
+      logging.warning(f'Could not read {self._device_folder}: {ex}')
+      DS18B20.request_rescan()
+      return False
+    self._read_time = time.monotonic() - begin
+    if not temp_raw:
+      return False
+    temperature = float(temp_raw) / 1000.0
+    if self._adaptive_resolution and self._adaptive and self._timestamp is not None:
+      self._adapt_resolution(temperature)
+    self._temperature = temperature
+    self._timestamp = time.time()
+    return True
+
+  def _set_resolution(self, bits):
+    try:
+      self.resolution = str(bits)
+      self._resolution = bits
+      logging.debug(f'{self} resolution set to {bits} bit, conversion time {self.conv_time}ms')
+      return True
+    except OSError as ex:
+      # Writing the resolution needs write access to the sysfs file
+      self._adaptive = False
+      logging.warning(f'Could not set {self} resolution, adaptive resolution disabled: {ex}')
+      return False
+
+  def _adapt_resolution(self, temperature):
+    if self._resolution is None:
+      try:
+        self._resolution = int(self.resolution)
+      except (OSError, ValueError) as ex:
+        # Older kernels have no resolution attribute
+        self._adaptive = False
+        logging.warning(f'Could not read {self} resolution, adaptive resolution disabled: {ex}')
+        return
+    # Compared with the first reading of the stable run, not the previous one, so a slow drift
+    # goes back to full resolution too
+    if self._stable_temperature is not None and abs(temperature - self._stable_temperature) < STABLE_THRESHOLD:
+      self._stable_count += 1
+      if self._stable_count >= STABLE_COUNT and self._resolution > LOW_RESOLUTION:
+        self._set_resolution(LOW_RESOLUTION)
+    else:
+      self._stable_temperature = temperature
+      self._stable_count = 0
+      if self._resolution < HIGH_RESOLUTION:
+        self._set_resolution(HIGH_RESOLUTION)
+
+  def read_precise(self):
+    # Reads the temperature at full resolution now, the adaptive mode lowers it again once stable
+    if self._resolution is not None and self._resolution < HIGH_RESOLUTION:
+      self._set_resolution(HIGH_RESOLUTION)
+    self._stable_count = 0
+    self._stable_temperature = None
+    self._read_temperature()
+    return self._temperature
 
   @property
   def timestamp(self):
     return self._timestamp
 
+  @property
+  def read_time(self):
+    # Seconds the last temperature read took, including the conversion when not bulk read
+    return self._read_time
+
   @property
   def conv_time(self):
     return self.read_property('conv_time')
@@ -73,42 +171,214 @@ class DS18B20:
 
   @classproperty
   def devices(cls):
-    base_dir = '/sys/bus/w1/devices/'
-    for device_folder in glob.glob(base_dir + '28*'):
-      if not device_folder in cls._devices:
-        cls._devices[device_folder] = DS18B20(device_folder)
-    return list(cls._devices.values())
+    # Scanned once, then kept up to date by the hotplug thread while the service runs,
+    # or rescanned every RESCAN_INTERVAL when it does not.
+    if cls._scan_time is None or (cls._hotplug_thread is None and time.monotonic() - cls._scan_time > RESCAN_INTERVAL):
+      cls._scan()
+    return cls._device_list
+
+  @classmethod
+  def _scan(cls):
+    with cls._scan_lock:
+      folders = set(glob.glob(hal.w1_base_dir() + '28*'))
+      added = [DS18B20(folder) for folder in sorted(folders - cls._devices.keys())]
+      removed = [cls._devices[folder] for folder in cls._devices.keys() - folders]
+      for dev in added:
+        cls._devices[dev.device_folder] = dev
+      for dev in removed:
+        del cls._devices[dev.device_folder]
+      cls._device_list = list(cls._devices.values())
+      cls._scan_time = time.monotonic()
+    for dev in added:
+      logging.info(f'DS18B20 added: {dev.device_folder}')
+      cls._notify_hotplug('added', dev)
+    for dev in removed:
+      logging.info(f'DS18B20 removed: {dev.device_folder}')
+      cls._notify_hotplug('removed', dev)
+
+  @classmethod
+  def subscribe_hotplug(cls, callback):
+    # callback(event, device) with event 'added' or 'removed', the first scan reports every device as added
+    with cls._subscribers_lock:
+      cls._hotplug_subscribers = cls._hotplug_subscribers + [callback]
+
+  @classmethod
+  def unsubscribe_hotplug(cls, callback):
+    with cls._subscribers_lock:
+      cls._hotplug_subscribers = [subscriber for subscriber in cls._hotplug_subscribers if subscriber != callback]
+
+  @classmethod
+  def _notify_hotplug(cls, event, dev):
+    for callback in cls._hotplug_subscribers:
+      try:
+        callback(event, dev)
+      except Exception:
+        logging.exception(f'DS18B20 hotplug subscriber {callback} failed')
+
+  @classmethod
+  def request_rescan(cls):
+    if cls._hotplug_wakeup is not None:
+      os.write(cls._hotplug_wakeup[1], b'r')
+    else:
+      cls._scan_time = None
+
+  @classmethod
+  def hotplug_loop(cls):
+    logging.info('DS18B20 Hotplug Service started')
+    base_dir = hal.w1_base_dir()
+    watcher = None
+    try:
+      watcher = inotify.Inotify()
+      watcher.add_watch(base_dir, inotify.IN_CREATE | inotify.IN_DELETE | inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO | inotify.IN_ONLYDIR)
+    except (OSError, AttributeError) as ex:
+      logging.warning(f'Could not watch {base_dir}, rescan every {RESCAN_INTERVAL}s: {ex}')
+      if watcher is not None:
+        watcher.close()
+        watcher = None
+    wakeup = cls._hotplug_wakeup[0]
+    # Catch up with changes made before the watch was in place
+    cls._scan()
+    while cls._async_mode:
+      readable, _, _ = select.select([wakeup] + ([watcher] if watcher else []), [], [], RESCAN_INTERVAL)
+      if wakeup in readable:
+        os.read(wakeup, 64)
+      if watcher in readable:
+        watcher.read()
+      if cls._async_mode:
+        cls._scan()
+    if watcher is not None:
+      watcher.close()
+    logging.info('DS18B20 Hotplug Service stopped')
 
   @classproperty
   def async_mode(cls):
     return cls._async_mode
 
+  @classproperty
+  def adaptive_resolution(cls):
+    return cls._adaptive_resolution
+
+  @classmethod
+  def set_adaptive_resolution(cls, enabled):
+    cls._adaptive_resolution = enabled
+    if not enabled:
+      # Back to full resolution for every device that was lowered
+      for dev in cls._devices.values():
+        if dev._resolution is not None and dev._resolution < HIGH_RESOLUTION:
+          dev._set_resolution(HIGH_RESOLUTION)
+        dev._stable_count = 0
+        dev._stable_temperature = None
+
   @classmethod
   def _read_temperatures(cls):
-      for dev in cls.devices:
-        dev._read_temperature()
+    # Returns the devices read successfully
+    devices = cls.devices
+    if len(devices) < 2:
+      return [dev for dev in devices if dev._read_temperature()]
+    # A read blocks for the conversion time of the device, read all of them at once
+    # so a pass takes as long as the slowest device instead of the sum of all of them.
+    if cls._read_executor is None:
+      cls._read_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_READ_WORKERS, thread_name_prefix='DS18B20 Read')
+    begin = time.monotonic()
+    read = [dev for dev, success in zip(devices, cls._read_executor.map(DS18B20._read_temperature, devices)) if success]
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+      # read_time stays None until the first successful read of a device
+      logging.debug(f'Read {len(devices)} DS18B20 in {time.monotonic() - begin:.3f}s: '
+                    + ', '.join(f'{dev.device_id} {"failed" if dev.read_time is None else f"{dev.read_time:.3f}s"}'
+                                for dev in devices))
+    return read
+
+  @classproperty
+  def period(cls):
+    return cls._period
+
+  @classmethod
+  def subscribe(cls, callback):
+    # callback(device, temperature, timestamp) is called on the service thread for every new reading
+    with cls._subscribers_lock:
+      cls._subscribers = cls._subscribers + [callback]
+
+  @classmethod
+  def unsubscribe(cls, callback):
+    # callback is a callback passed to subscribe or a queue returned by subscribe_queue
+    with cls._subscribers_lock:
+      cls._subscribers = [subscriber for subscriber in cls._subscribers
+                          if subscriber != callback and getattr(subscriber, 'queue', None) is not callback]
+
+  @classmethod
+  def subscribe_queue(cls, maxsize=QUEUE_SIZE):
+    # Returns a queue receiving (device, temperature, timestamp) for every new reading.
+    # A consumer falling behind loses the oldest readings. Pass the queue to unsubscribe.
+    readings = queue.Queue(maxsize)
+    def put(device, temperature, timestamp):
+      while True:
+        try:
+          readings.put_nowait((device, temperature, timestamp))
+          return
+        except queue.Full:
+          try:
+            readings.get_nowait()
+          except queue.Empty:
+            pass
+    put.queue = readings
+    cls.subscribe(put)
+    return readings
+
+  @classmethod
+  def _notify(cls, readings):
+    for callback in cls._subscribers:
+      for dev, temperature, timestamp in readings:
+        try:
+          callback(dev, temperature, timestamp)
+        except Exception:
+          logging.exception(f'DS18B20 subscriber {callback} failed')
+
+  @classmethod
+  def sample(cls):
+    # One pass over the devices, returns the (device, temperature, timestamp) readings of the devices read
+    # on this pass, a device that could not be read is left out instead of repeating its last reading.
+    # Blocks for the conversion time, the service calls it on its thread, an event loop in an executor.
+    if cls._bulk_read:
+      try:
+        with open(hal.w1_base_dir() + 'w1_bus_master1/therm_bulk_read', 'w') as f:
+          f.write('trigger')
+      except BaseException as ex:
+        cls._bulk_read = False
+        logging.warning(f'Cound not trigger buck read {ex}')
+    return [(dev, dev._temperature, dev._timestamp) for dev in cls._read_temperatures()]
+
+  @classmethod
+  def close(cls):
+    # Releases the read threads of sample() used without the service
+    if cls._read_executor is not None:
+      cls._read_executor.shutdown()
+      cls._read_executor = None
 
   @classmethod
   def service_loop(cls):
     logging.info('DS18B20 Service started')
     while cls._async_mode:
-      if cls._bulk_read:
-        try:
-          with open('/sys/bus/w1/devices/w1_bus_master1/therm_bulk_read', 'w') as f:
-            f.write('trigger')
-        except BaseException as ex:
-          cls._bulk_read = False
-          logging.warning(f'Cound not trigger buck read {ex}')
-      cls._read_temperatures()
+      begin = time.monotonic()
+      cls._notify(cls.sample())
+      elapsed = time.monotonic() - begin
+      logging.debug(f'DS18B20 pass takes {elapsed}s')
+      wait_period = cls._period - elapsed
+      if wait_period > 0:
+        cls._stop_event.wait(wait_period)
     logging.info('DS18B20 Service stopped')
 
   @classmethod
-  def start(cls):
+  def start(cls, period=SERVICE_PERIOD):
     if not cls._async_mode:
-      cls._read_temperatures()
+      cls._period = period
+      cls._stop_event.clear()
+      cls._notify(cls.sample())
       cls._async_mode = True
       cls._service_thread = threading.Thread(target=cls.service_loop, name='DS18B20 Service')
       cls._service_thread.start()
+      cls._hotplug_wakeup = os.pipe()
+      cls._hotplug_thread = threading.Thread(target=cls.hotplug_loop, name='DS18B20 Hotplug Service')
+      cls._hotplug_thread.start()
     else:
       logging.warning('DS18B20 Service already started')
 
@@ -116,7 +386,15 @@ class DS18B20:
   def shutdown(cls):
     if cls._async_mode:
       cls._async_mode = False
+      cls._stop_event.set()
       cls._service_thread.join()
+      os.write(cls._hotplug_wakeup[1], b's')
+      cls._hotplug_thread.join()
+      cls._hotplug_thread = None
+      for fd in cls._hotplug_wakeup:
+        os.close(fd)
+      cls._hotplug_wakeup = None
+      cls.close()
     else:
       logging.warning('DS18B20 Service not started')
 
@@ -126,6 +404,53 @@ fahrenheit = DS18B20.fahrenheit
 
 if __name__ == "__main__":
   import argparse
+  import shutil
+  import simulation
+  import sys
+  import unittest
+
+  class DS18B20Test(unittest.TestCase):
+    def setUp(self):
+      self._bus = simulation.SimulatedW1Bus()
+      self._backend = hal.backend()
+      bus = self._bus
+      class Backend:
+        def w1_base_dir(self):
+          return bus.base_dir
+      hal.use(Backend())
+      DS18B20._devices = {}
+      DS18B20._scan_time = None
+
+    def tearDown(self):
+      DS18B20.close()
+      DS18B20._devices = {}
+      DS18B20._scan_time = None
+      hal.use(self._backend)
+      self._bus.close()
+
+    def _unreadable(self, device_id):
+      # A folder where the temperature file is, reading it fails with an OSError
+      path = os.path.join(self._bus.base_dir, device_id, 'temperature')
+      os.remove(path)
+      os.mkdir(path)
+
+    def testSample(self):
+      readings = DS18B20.sample()
+      self.assertEqual(sorted((dev.device_id, temperature) for dev, temperature, _ in readings),
+                       sorted(simulation.TEMPERATURES.items()))
+
+    def testSampleUnreadable(self):
+      air, water = simulation.TEMPERATURES
+      self._unreadable(air)
+      # Never read, there is no previous reading either
+      readings = DS18B20.sample()
+      self.assertEqual([(dev.device_id, temperature) for dev, temperature, _ in readings], [(water, simulation.TEMPERATURES[water])])
+      self._unreadable(water)
+      shutil.rmtree(os.path.join(self._bus.base_dir, air, 'temperature'))
+      self._bus.set_temperature(air, 30.0)
+      # The last water reading is not reported again
+      readings = DS18B20.sample()
+      self.assertEqual([(dev.device_id, temperature) for dev, temperature, _ in readings], [(air, 30.0)])
 
   parser = argparse.ArgumentParser()
   parser.add_argument(
@@ -140,9 +465,40 @@ if __name__ == "__main__":
       type=bool,
       help='Collect temperature reading in async mode'
   )
+  parser.add_argument(
+      '--period',
+      default=SERVICE_PERIOD,
+      type=float,
+      help=f'Seconds between readings in async mode. default: {SERVICE_PERIOD}'
+  )
+  parser.add_argument(
+      '--adaptive-resolution',
+      default=False,
+      type=bool,
+      help='Lower the resolution while the temperature is stable'
+  )
+  parser.add_argument(
+      '--simulate',
+      default=False,
+      type=bool,
+      help='Read simulated devices instead of the 1-Wire bus'
+  )
+  parser.add_argument(
+      '--test',
+      action='store_true',
+      help='Run the unit tests of the DS18B20 instead of reading the devices'
+  )
   args = parser.parse_args()
   logging.basicConfig(level=args.log_level)
 
+  if args.test:
+    unittest.main(argv=sys.argv[:1])
+
+  if args.simulate:
+    hal.use(simulation.Simulation())
+
+  DS18B20.set_adaptive_resolution(args.adaptive_resolution)
+
   device_names = {
     '28-012115d1f634': 'Air',
     '28-012114259884': 'Water',
@@ -150,21 +506,28 @@ if __name__ == "__main__":
 
   devices = DS18B20.devices
 
+  def print_reading(device, temp_c, timestamp):
+    device_id = device.device_id
+    device_name = device_names[device_id]
+    temp_f = DS18B20.fahrenheit(temp_c)
+    read_time = '?' if device.read_time is None else f'{device.read_time:.3f}'
+    print(f'[{timestamp}] {device_name:>7}({device_id}): {temp_c}℃ {temp_f}℉ in {read_time}s')
+
   if args.async_mode:
-    DS18B20.start()
+    readings = DS18B20.subscribe_queue()
+    DS18B20.start(period=args.period)
 
   try:
     while True:
-      for device in devices:
-        device_id = device.device_id
-        device_name = device_names[device_id]
-        temp_c = device.temperature
-        temp_f = DS18B20.fahrenheit(temp_c)
-        timestamp = device.timestamp
-        print(f'[{timestamp}] {device_name:>7}({device_id}): {temp_c}℃ {temp_f}℉')
-      time.sleep(1)
+      if args.async_mode:
+        print_reading(*readings.get())
+      else:
+        for device in devices:
+          print_reading(device, device.temperature, device.timestamp)
+        time.sleep(1)
   except KeyboardInterrupt:
     pass
 
   if args.async_mode:
     DS18B20.shutdown()
+  hal.backend().close()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import logging
+import mmap
+import os
+import PIL.Image
+import seqlock
+import struct
+
+# File layout: a header followed by one byte per pixel, the palette index of the Inky pHAT.
+#   header: magic, version, width, height, sequence, frame number, frame timestamp
+# The sequence is a seqlock.SeqLock like the one of sample_ring, the writer makes it odd
+# while it updates the frame.
+MAGIC = b'TMFB'
+VERSION = 1
+HEADER_FORMAT = '<4sHHHQQd'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SEQUENCE_OFFSET = struct.calcsize('<4sHHH')
+FRAME_FORMAT = '<Qd'
+FRAME_OFFSET = SEQUENCE_OFFSET + 8
+
+FRAMEBUFFER_PATH = '/dev/shm/InkyDisplay.fb'
+# White, black and red, in the order of inky_display_service.WHITE, BLACK and RED
+PALETTE = [255, 255, 255, 0, 0, 0, 255, 0, 0]
+
+
+class Framebuffer:
+  def __init__(self, path=FRAMEBUFFER_PATH, size=None, writable=False):
+    # size (width, height) is needed to create the framebuffer, readers take it from the file
+    self._path = path
+    if writable:
+      self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+      if not self._valid(size):
+        logging.info(f'Create framebuffer {path} of {size[0]}x{size[1]}')
+        self._file.truncate(0)
+        self._file.truncate(HEADER_SIZE + size[0] * size[1])
+        self._file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, size[0], size[1], 0, 0, 0.0))
+        self._file.flush()
+      self._map = mmap.mmap(self._file.fileno(), 0)
+    else:
+      self._file = open(path, 'rb')
+      if not self._valid(None):
+        raise ValueError(f'{path} is not a version {VERSION} framebuffer')
+      self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    self._seqlock = seqlock.SeqLock(self._map, SEQUENCE_OFFSET, path)
+    if writable and self._seqlock.recover():
+      # The frame number was not increased, the frame may be partly written until the next one
+      logging.warning(f'Framebuffer {path} was left in the middle of a frame')
+    _, _, width, height, _, _, _ = struct.unpack_from(HEADER_FORMAT, self._map)
+    self._size = (width, height)
+    self._pixels = memoryview(self._map)[HEADER_SIZE:HEADER_SIZE + width * height]
+
+  def _valid(self, size):
+    self._file.seek(0)
+    header = self._file.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+      return False
+    magic, version, width, height, _, _, _ = struct.unpack(HEADER_FORMAT, header)
+    if magic != MAGIC or version != VERSION:
+      return False
+    if size is not None and tuple(size) != (width, height):
+      return False
+    return os.fstat(self._file.fileno()).st_size >= HEADER_SIZE + width * height
+
+  @property
+  def path(self):
+    return self._path
+
+  @property
+  def size(self):
+    return self._size
+
+  @property
+  def sequence(self):
+    return self._seqlock.sequence
+
+  @property
+  def frame(self):
+    # Number of frames ever written, 0 before the first one
+    return struct.unpack_from('<Q', self._map, FRAME_OFFSET)[0]
+
+  @property
+  def pixels(self):
+    # Zero copy view of the pixels, it changes under the reader, compare sequence
+    # before and after using it or use read() instead. Release it before closing.
+    return self._pixels[:]
+
+  def write(self, image, timestamp):
+    # image is a 'P' mode image of the framebuffer size
+    frame = self.frame
+    with self._seqlock.write():
+      self._pixels[:] = image.tobytes()
+      struct.pack_into(FRAME_FORMAT, self._map, FRAME_OFFSET, frame + 1, timestamp)
+
+  def read(self):
+    # Consistent copy of the last frame, (frame number, timestamp, pixels)
+    return self._seqlock.read(lambda: struct.unpack_from(FRAME_FORMAT, self._map, FRAME_OFFSET) + (self._pixels.tobytes(),))
+
+  def image(self):
+    _, _, pixels = self.read()
+    image = PIL.Image.frombytes('P', self._size, pixels)
+    image.putpalette(PALETTE)
+    return image
+
+  def close(self):
+    self._pixels.release()
+    self._map.close()
+    self._file.close()
+
+
+if __name__ == "__main__":
+  import tempfile
+  import unittest
+
+  class FramebufferTest(unittest.TestCase):
+    def setUp(self):
+      self._dir = tempfile.TemporaryDirectory()
+      self._path = os.path.join(self._dir.name, 'test.fb')
+
+    def tearDown(self):
+      self._dir.cleanup()
+
+    def testWriteRead(self):
+      fb = Framebuffer(self._path, size=(8, 4), writable=True)
+      self.assertEqual(fb.read(), (0, 0.0, bytes(32)))
+      image = PIL.Image.new('P', (8, 4), 0)
+      image.putpixel((3, 2), 1)
+      fb.write(image, 12.5)
+      reader = Framebuffer(self._path)
+      self.assertEqual(reader.size, (8, 4))
+      frame, timestamp, pixels = reader.read()
+      self.assertEqual((frame, timestamp), (1, 12.5))
+      self.assertEqual(pixels[2 * 8 + 3], 1)
+      self.assertEqual(reader.image().convert('RGB').getpixel((3, 2)), (0, 0, 0))
+      self.assertEqual(reader.sequence, 2)
+      view = reader.pixels
+      self.assertEqual(view[2 * 8 + 3], 1)
+      view.release()
+      reader.close()
+      fb.close()
+
+    def testReopen(self):
+      fb = Framebuffer(self._path, size=(8, 4), writable=True)
+      fb.write(PIL.Image.new('P', (8, 4), 1), 1.0)
+      fb.close()
+      fb = Framebuffer(self._path, size=(8, 4), writable=True)
+      self.assertEqual(fb.frame, 1)
+      fb.close()
+      fb = Framebuffer(self._path, size=(4, 4), writable=True)
+      self.assertEqual(fb.frame, 0)
+      fb.close()
+
+    def testInterruptedWrite(self):
+      fb = Framebuffer(self._path, size=(8, 4), writable=True)
+      fb.write(PIL.Image.new('P', (8, 4), 1), 1.0)
+      fb.close()
+      # The writer stopped after making the sequence odd
+      with open(self._path, 'r+b') as f:
+        f.seek(SEQUENCE_OFFSET)
+        f.write(struct.pack('<Q', 3))
+      fb = Framebuffer(self._path, size=(8, 4), writable=True)
+      self.assertEqual(fb.sequence, 4)
+      self.assertEqual(fb.read(), (1, 1.0, bytes([1]) * 32))
+      fb.write(PIL.Image.new('P', (8, 4), 2), 2.0)
+      self.assertEqual(fb.sequence, 6)
+      reader = Framebuffer(self._path)
+      self.assertEqual(reader.read(), (2, 2.0, bytes([2]) * 32))
+      reader.close()
+      fb.close()
+
+  unittest.main()
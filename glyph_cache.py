@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import collections
+import PIL.Image
+import PIL.ImageDraw
+import threading
+
+CACHE_SIZE = 128
+
+
+def text_size(font, text):
+  # font.getsize was removed from Pillow 10, getbbox gives the same size including the offset of the text
+  if hasattr(font, 'getbbox'):
+    left, top, right, bottom = font.getbbox(text)
+    return right, bottom
+  return font.getsize(text)
+
+
+Sprite = collections.namedtuple('Sprite', ['mask', 'offset', 'size'])
+
+
+class GlyphCache:
+  # Text rasterized once into '1' mode masks, keyed by (font, text) with LRU eviction.
+  # Drawing a cached text is a paste of its mask instead of FreeType rendering it again.
+  # The mask covers the ink of the text, which can go past its size, offset from where the text is drawn.
+  def __init__(self, size=CACHE_SIZE):
+    self._size = max(size, 1)
+    self._sprites = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self._hits = 0
+    self._misses = 0
+
+  @property
+  def hits(self):
+    return self._hits
+
+  @property
+  def misses(self):
+    return self._misses
+
+  def __len__(self):
+    return len(self._sprites)
+
+  def clear(self):
+    with self._lock:
+      self._sprites.clear()
+
+  def sprite(self, font, text):
+    key = (font, text)
+    with self._lock:
+      sprite = self._sprites.get(key)
+      if sprite is not None:
+        self._sprites.move_to_end(key)
+        self._hits += 1
+        return sprite
+      self._misses += 1
+    # The same non antialiased rendering as draw.text on the palette canvas
+    width, height = text_size(font, text)
+    margin = height
+    image = PIL.Image.new('1', (width + 2 * margin, height + 2 * margin), 0)
+    PIL.ImageDraw.Draw(image).text((margin, margin), text, 1, font=font)
+    box = image.getbbox()
+    if box is None:
+      sprite = Sprite(None, (0, 0), (width, height))
+    else:
+      sprite = Sprite(image.crop(box), (box[0] - margin, box[1] - margin), (width, height))
+    with self._lock:
+      self._sprites[key] = sprite
+      while len(self._sprites) > self._size:
+        self._sprites.popitem(last=False)
+    return sprite
+
+  def size(self, font, text):
+    # Same as text_size(font, text)
+    return self.sprite(font, text).size
+
+  def bbox(self, font, text, xy):
+    # Box covering the text drawn at xy, both its size and its ink
+    mask, (dx, dy), (width, height) = self.sprite(font, text)
+    x, y = int(xy[0]), int(xy[1])
+    if mask is None:
+      return (x, y, x + width, y + height)
+    return (min(x, x + dx), min(y, y + dy), max(x + width, x + dx + mask.width), max(y + height, y + dy + mask.height))
+
+  def draw_text(self, image, xy, text, fill, font):
+    # Same as PIL.ImageDraw.Draw(image).text(xy, text, fill, font=font), returns the size of the text
+    mask, (dx, dy), size = self.sprite(font, text)
+    if mask is not None:
+      x, y = int(xy[0]) + dx, int(xy[1]) + dy
+      image.paste(fill, (x, y, x + mask.width, y + mask.height), mask)
+    return size
+
+
+if __name__ == "__main__":
+  import PIL.ImageFont
+  import unittest
+
+  class GlyphCacheTest(unittest.TestCase):
+    def setUp(self):
+      self.font = PIL.ImageFont.load_default()
+
+    def testSameAsDrawText(self):
+      cache = GlyphCache()
+      for text in [': 25℃ 77℉', '~~~~', 'UV', 'ÅjÿQ']:
+        drawn = PIL.Image.new('P', (212, 104), 0)
+        PIL.ImageDraw.Draw(drawn).text((10, 20), text, 1, font=self.font)
+        pasted = PIL.Image.new('P', (212, 104), 0)
+        self.assertEqual(cache.draw_text(pasted, (10, 20), text, 1, self.font), text_size(self.font, text))
+        self.assertEqual(drawn.tobytes(), pasted.tobytes())
+        # All the ink is in the box
+        box = cache.bbox(self.font, text, (10, 20))
+        inside = PIL.Image.new('P', (212, 104), 0)
+        inside.paste(drawn.crop(box), box[:2])
+        self.assertEqual(drawn.tobytes(), inside.tobytes())
+
+    def testLRU(self):
+      cache = GlyphCache(size=2)
+      self.assertIsNone(cache.sprite(self.font, ' ').mask)
+      cache.clear()
+      a = cache.sprite(self.font, 'a')
+      cache.sprite(self.font, 'b')
+      self.assertIs(cache.sprite(self.font, 'a'), a)
+      cache.sprite(self.font, 'c')
+      self.assertEqual(len(cache), 2)
+      self.assertIs(cache.sprite(self.font, 'a'), a)
+      self.assertEqual((cache.hits, cache.misses), (2, 4))
+      cache.sprite(self.font, 'b')
+      self.assertEqual(cache.misses, 5)
+
+  unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# Hardware access of the monitor. The services get their GPIO, 1-Wire, I2C sensor and
+# e-ink display from the current backend, so use() a simulation.Simulation at startup
+# to run them without a Raspberry Pi.
+
+W1_BASE_DIR = '/sys/bus/w1/devices/'
+
+
+class RaspberryPi:
+  # The hardware modules are only imported when used, they are not available elsewhere
+
+  def gpio(self):
+    import RPi.GPIO as GPIO
+    return GPIO
+
+  def w1_base_dir(self):
+    return W1_BASE_DIR
+
+  def uv_sensor(self, integration_time):
+    import adafruit_veml6075
+    import board
+    import busio
+    i2c = busio.I2C(board.SCL, board.SDA)
+    return adafruit_veml6075.VEML6075(i2c, integration_time=integration_time)
+
+  def eink_display(self):
+    import inky.phat
+    return inky.phat.InkyPHAT()
+
+  def close(self):
+    pass
+
+
+_backend = RaspberryPi()
+
+def use(backend):
+  global _backend
+  _backend = backend
+
+def backend():
+  return _backend
+
+def gpio():
+  return _backend.gpio()
+
+def w1_base_dir():
+  return _backend.w1_base_dir()
+
+def uv_sensor(integration_time=100):
+  return _backend.uv_sensor(integration_time)
+
+def eink_display():
+  return _backend.eink_display()
@@ -1,15 +1,12 @@
 #!/usr/bin/env python3
 
-import RPi.GPIO as GPIO
+import hal
 import logging
 import moving_average
+import statistics
 import threading
 import time
 
-# Use BCM GPIO references
-# instead of physical pin numbers
-GPIO.setmode(GPIO.BCM)
-
 # Define GPIO to use on Pi
 GPIO_TRIGGER = 23
 GPIO_ECHO    = 24
@@ -19,11 +16,52 @@ SOUND_SPEED = 343000   # 343000 mm/s
 
 MEASURE_TIMEOUT = 1.0 # 1s
 
+# Waiting for a stuck high echo pin to drop before triggering
+ECHO_POLL_INTERVAL = 0.001  # 1ms
+ECHO_STUCK_TIMEOUT = 0.1    # 100ms, longer than the 38ms no-obstacle pulse
+ECHO_RECOVERY_DELAY = 0.06  # 60ms with the trigger low before rearming the echo detection
+
+# Burst filters combining the measurements of one burst
+MEAN = 'mean'
+MEDIAN = 'median'
+TRIMMED_MEAN = 'trimmed_mean'
+BURST_FILTERS = (MEAN, MEDIAN, TRIMMED_MEAN)
+TRIM_RATIO = 0.2            # fraction cut from each end by the trimmed mean
+OUTLIER_THRESHOLD = 3.0     # median absolute deviations from the median, 0 keeps everything
+OUTLIER_MIN_DEVIATION = 5   # 5mm, measurements this close to the median are never outliers
+
+
+def filter_burst(distances, burst_filter=MEDIAN, trim_ratio=TRIM_RATIO, outlier_threshold=OUTLIER_THRESHOLD):
+  median = statistics.median(distances)
+  if outlier_threshold and len(distances) >= 3:
+    # 1.4826 scales the median absolute deviation to a standard deviation for normal noise
+    limit = max(outlier_threshold * 1.4826 * statistics.median(abs(d - median) for d in distances), OUTLIER_MIN_DEVIATION)
+    kept = [d for d in distances if abs(d - median) <= limit]
+    if len(kept) < len(distances):
+      logging.debug(f'Rejected {len(distances) - len(kept)} outliers of {distances}')
+    distances = kept
+  if burst_filter == MEDIAN:
+    return statistics.median(distances)
+  if burst_filter == TRIMMED_MEAN:
+    trim = int(len(distances) * trim_ratio)
+    distances = sorted(distances)[trim:len(distances) - trim]
+  return statistics.fmean(distances)
+
+
 class UltrasonicSensor:
-  def __init__(self, trigger_pin=GPIO_TRIGGER, echo_pin=GPIO_ECHO, measure_count=3, measure_interval=0.01, measure_period=1, window_size=10):
+  def __init__(self, trigger_pin=GPIO_TRIGGER, echo_pin=GPIO_ECHO, measure_count=3, measure_interval=0.01, measure_period=1, window_size=10,
+               burst_filter=MEDIAN, trim_ratio=TRIM_RATIO, outlier_threshold=OUTLIER_THRESHOLD):
+    if burst_filter not in BURST_FILTERS:
+      raise ValueError(f'Unknown burst filter {burst_filter}, expected one of {", ".join(BURST_FILTERS)}')
+    if not 0 <= trim_ratio < 0.5:
+      # Cutting half from each end would leave nothing to average
+      raise ValueError(f'Trim ratio {trim_ratio} out of [0, 0.5)')
     self._trigger_pin = trigger_pin
     self._echo_pin = echo_pin
     self._measure_count = measure_count
+    self._burst_filter = burst_filter
+    self._trim_ratio = trim_ratio
+    self._outlier_threshold = outlier_threshold
     self._measure_interval = measure_interval
     self._measure_period = measure_period
     self._moving_average = moving_average.MovingAverage(window_size)
@@ -33,37 +71,71 @@ class UltrasonicSensor:
     self._distance = -1
     self._begin = None
     self._elapsed = None
+    self._echo_stuck = False
+    self._subscribers = []
+    self._subscribers_lock = threading.Lock()
+    self._gpio = hal.gpio()
+    # Use BCM GPIO references
+    # instead of physical pin numbers
+    self._gpio.setmode(self._gpio.BCM)
     # Set pins as output and input
-    GPIO.setup(self._trigger_pin, GPIO.OUT)
-    GPIO.setup(self._echo_pin, GPIO.IN)
+    self._gpio.setup(self._trigger_pin, self._gpio.OUT)
+    self._gpio.setup(self._echo_pin, self._gpio.IN)
     # Set trigger to False (Low)
-    GPIO.output(self._trigger_pin, False)
-    GPIO.add_event_detect(self._echo_pin, GPIO.BOTH, callback=self._measure_callback)
+    self._gpio.output(self._trigger_pin, False)
+    self._gpio.add_event_detect(self._echo_pin, self._gpio.BOTH, callback=self._measure_callback)
 
   def _measure_callback(self, channel):
-    now = time.time()
-    echo = GPIO.input(channel)
+    # Monotonic so a clock adjustment never shows up as a distance
+    now = time.monotonic_ns()
+    echo = self._gpio.input(channel)
     if echo:
       self._begin = now
     else:
       if self._begin:
-        self._elapsed = now - self._begin
+        self._elapsed = (now - self._begin) / 1e9
       self._event.set()
 
+  def _wait_echo_low(self, timeout):
+    deadline = time.monotonic() + timeout
+    while self._gpio.input(self._echo_pin) != 0:
+      if time.monotonic() >= deadline:
+        return False
+      time.sleep(ECHO_POLL_INTERVAL)
+    return True
+
+  def _recover_echo(self):
+    # Some modules keep echo high after a lost pulse, hold the trigger low and rearm the detection
+    self._gpio.remove_event_detect(self._echo_pin)
+    self._gpio.output(self._trigger_pin, False)
+    time.sleep(ECHO_RECOVERY_DELAY)
+    self._gpio.add_event_detect(self._echo_pin, self._gpio.BOTH, callback=self._measure_callback)
+
   def _trigger(self):
-    while GPIO.input(self._echo_pin) != 0:
-      logging.error('Wait until ECHO is not 0')
+    if not self._wait_echo_low(ECHO_STUCK_TIMEOUT):
+      if not self._echo_stuck:
+        logging.error(f'ECHO stuck high for {ECHO_STUCK_TIMEOUT}s, resetting')
+      self._recover_echo()
+      if not self._wait_echo_low(ECHO_STUCK_TIMEOUT):
+        # Logged once until the echo recovers, the next measure tries again
+        self._echo_stuck = True
+        return False
+    if self._echo_stuck:
+      logging.info('ECHO recovered')
+      self._echo_stuck = False
 
     self._begin = None
     self._elapsed = None
     self._event.clear()
 
-    GPIO.output(self._trigger_pin, True)
+    self._gpio.output(self._trigger_pin, True)
     time.sleep(TRIGGER_PULSE_WIDTH)
-    GPIO.output(self._trigger_pin, False)
+    self._gpio.output(self._trigger_pin, False)
+    return True
 
   def _measure(self):
-    self._trigger()
+    if not self._trigger():
+      return -1
     if self._event.wait(timeout=MEASURE_TIMEOUT) and self._elapsed:
       distance = (self._elapsed * SOUND_SPEED) / 2
       logging.debug(f'ECHO elapsesd {self._elapsed} seconds, distance={distance}mm')
@@ -76,26 +148,23 @@ class UltrasonicSensor:
     return distance
 
   def _measure_average(self):
-    measure_count = 0
+    distances = []
     error_count = 0
-    total_distance = 0
-    while measure_count < self._measure_count and error_count < self._measure_count:
+    while len(distances) < self._measure_count and error_count < self._measure_count:
       begin = time.time()
       distance = self._measure()
       if distance < 0:
         error_count += 1
       else:
-        total_distance += distance
-        measure_count += 1
+        distances.append(distance)
       end = time.time()
       elapsed = end - begin
       logging.debug(f'measure takes {elapsed}s')
       wait_period = self._measure_interval - elapsed
       if wait_period > 0:
         time.sleep(wait_period)
-    if measure_count > 0:
-      distance = total_distance / measure_count
-      return distance
+    if distances:
+      return filter_burst(distances, self._burst_filter, self._trim_ratio, self._outlier_threshold)
     else:
       logging.error(f'Failed to measure distance after {error_count} trials.')
       return -1
@@ -113,12 +182,34 @@ class UltrasonicSensor:
     return self._moving_average.average
 
 
+  def subscribe(self, callback):
+    # callback(distance, moving_average_distance, timestamp) after every measure of the service
+    with self._subscribers_lock:
+      self._subscribers = self._subscribers + [callback]
+
+  def unsubscribe(self, callback):
+    with self._subscribers_lock:
+      self._subscribers = [subscriber for subscriber in self._subscribers if subscriber != callback]
+
+  def _notify(self, distance, average, timestamp):
+    for callback in self._subscribers:
+      try:
+        callback(distance, average, timestamp)
+      except Exception:
+        logging.exception(f'Ultrasonic Sensor subscriber {callback} failed')
+
+  def sample(self):
+    # One filtered measure added to the moving average, returns (distance, moving_average_distance, timestamp).
+    # Blocks for the burst, the service calls it on its thread, an event loop in an executor.
+    self._distance = self._measure_average()
+    self._moving_average.add(self._distance)
+    return self._distance, self._moving_average.average, time.time()
+
   def _measure_loop(self):
     logging.info('Ultrasonic Sensor measure_loop started')
     while self._async_mode:
       begin = time.time()
-      self._distance = self._measure_average()
-      self._moving_average.add(self._distance)
+      self._notify(*self.sample())
       end = time.time()
       elapsed = end - begin
       logging.debug(f'measure average takes {elapsed}s')
@@ -146,6 +237,35 @@ class UltrasonicSensor:
 
 if __name__ == "__main__":
   import argparse
+  import sys
+  import unittest
+
+  class FilterBurstTest(unittest.TestCase):
+    def testOutlier(self):
+      burst = [100.0, 101.0, 99.0, 100.0, 400.0]
+      self.assertEqual(filter_burst(burst, MEAN), 100.0)
+      self.assertEqual(filter_burst(burst, MEDIAN), 100.0)
+      self.assertEqual(filter_burst(burst, TRIMMED_MEAN), 100.0)
+      # Without the rejection only the trimmed mean and the median ignore the spike
+      self.assertEqual(filter_burst(burst, MEAN, outlier_threshold=0), 160.0)
+      self.assertEqual(filter_burst(burst, MEDIAN, outlier_threshold=0), 100.0)
+      self.assertAlmostEqual(filter_burst(burst, TRIMMED_MEAN, outlier_threshold=0), 301.0 / 3)
+
+    def testAllEqual(self):
+      # A median absolute deviation of 0 still keeps every measurement
+      for burst_filter in BURST_FILTERS:
+        self.assertEqual(filter_burst([80.0] * 5, burst_filter), 80.0)
+      self.assertEqual(filter_burst([80.0, 80.0, 80.0, 83.0], MEAN), 80.75)
+
+    def testSingle(self):
+      for burst_filter in BURST_FILTERS:
+        self.assertEqual(filter_burst([42.0], burst_filter), 42.0)
+        self.assertEqual(filter_burst([42.0], burst_filter, trim_ratio=0.49), 42.0)
+
+    def testTrimRatio(self):
+      for trim_ratio in (-0.1, 0.5, 1.0):
+        with self.assertRaises(ValueError):
+          UltrasonicSensor(trim_ratio=trim_ratio)
 
   parser = argparse.ArgumentParser()
   parser.add_argument(
@@ -160,10 +280,34 @@ if __name__ == "__main__":
       type=bool,
       help='Collect temperature reading in async mode'
   )
+  parser.add_argument(
+      '--burst-filter',
+      default=MEDIAN,
+      choices=BURST_FILTERS,
+      help=f'How the measurements of a burst are combined. default: {MEDIAN}'
+  )
+  parser.add_argument(
+      '--simulate',
+      default=False,
+      type=bool,
+      help='Use a simulated sensor instead of the GPIO pins'
+  )
+  parser.add_argument(
+      '--test',
+      action='store_true',
+      help='Run the unit tests of the burst filters instead of measuring'
+  )
   args = parser.parse_args()
   logging.basicConfig(level=args.log_level)
 
-  distance_sensor = UltrasonicSensor()
+  if args.test:
+    unittest.main(argv=sys.argv[:1])
+
+  if args.simulate:
+    import simulation
+    hal.use(simulation.Simulation())
+
+  distance_sensor = UltrasonicSensor(burst_filter=args.burst_filter)
   if args.async_mode:
     distance_sensor.start()
     time.sleep(1)
@@ -181,5 +325,6 @@ if __name__ == "__main__":
     # User pressed CTRL-C
     # Reset GPIO settings
     distance_sensor.shutdown()
-    GPIO.cleanup()
+    hal.gpio().cleanup()
+    hal.backend().close()
 
@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
 
-import inky.phat
+import framebuffer
+import hal
 import logging
 import PIL.Image
 import PIL.ImageDraw
 import threading
+import time
+
+# Palette indices of the Inky pHAT, the same as inky.WHITE, inky.BLACK and inky.RED
+WHITE = 0
+BLACK = 1
+RED = 2
+
+# PNG snapshots of the display are encoded on the display thread, not by the caller of display()
+SNAPSHOT_PATH = '/dev/shm/InkyDisplay.png'
+SNAPSHOT_INTERVAL = 300  # 300s between snapshots, 0 only saves them on demand
+
+# Free canvases kept for reuse: one being drawn, one waiting for the display and one shown need no allocation
+POOL_CAPACITY = 3
 
 
 class InkyDisplayCanvas:
-  def __init__(self, size, color=inky.WHITE):
+  def __init__(self, size, color=WHITE):
     self._image = PIL.Image.new("P", size, color=color)
     self._image.palette.getcolor((255,255,255))
     self._image.palette.getcolor((0,0,0))
@@ -36,23 +50,104 @@ class InkyDisplayCanvas:
       self._draw = PIL.ImageDraw.Draw(self._image)
     return self._draw
 
-  def clear(self, color=inky.WHITE):
+  def clear(self, color=WHITE):
     self._image.paste(color, (0, 0, self._image.width, self._image.height))
 
   def save(self, path):
     self._image.save(path)
 
 
+class CanvasPool:
+  # Thread safe pool of canvases of one size. A canvas keeps its image and ImageDraw,
+  # once the pool holds enough of them drawing frames allocates nothing.
+  def __init__(self, size, capacity=POOL_CAPACITY):
+    self._size = size
+    self._capacity = max(capacity, 1)
+    self._free = []
+    self._lock = threading.Lock()
+    self._hits = 0
+    self._misses = 0
+    self._dropped = 0
+    self._discarded = 0
+
+  @property
+  def capacity(self):
+    return self._capacity
+
+  @property
+  def hits(self):
+    # Canvases reused from the pool
+    return self._hits
+
+  @property
+  def misses(self):
+    # Canvases allocated because the pool was empty
+    return self._misses
+
+  @property
+  def dropped(self):
+    # Frames replaced by a newer one before they were shown
+    return self._dropped
+
+  @property
+  def discarded(self):
+    # Canvases released to a full pool and left to the garbage collector
+    return self._discarded
+
+  def __len__(self):
+    return len(self._free)
+
+  def acquire(self, color=WHITE):
+    with self._lock:
+      canvas = self._free.pop() if self._free else None
+      if canvas is not None:
+        self._hits += 1
+      else:
+        self._misses += 1
+    if canvas is None:
+      return InkyDisplayCanvas(self._size, color=color)
+    canvas.clear(color=color)
+    return canvas
+
+  def release(self, canvas, dropped=False):
+    with self._lock:
+      if dropped:
+        self._dropped += 1
+      if len(self._free) < self._capacity:
+        self._free.append(canvas)
+      else:
+        self._discarded += 1
+
+  def __str__(self):
+    return (f'{self._hits} hits, {self._misses} misses, {self._dropped} dropped, {self._discarded} discarded, '
+            f'{len(self._free)}/{self._capacity} free')
+
+
 class InkyDisplayService:
-  def __init__(self):
+  def __init__(self, inky_display=None, framebuffer_path=framebuffer.FRAMEBUFFER_PATH, snapshot_path=SNAPSHOT_PATH,
+               snapshot_interval=SNAPSHOT_INTERVAL, pool_capacity=POOL_CAPACITY):
     self._running = None
-    self._inky_display = inky.phat.InkyPHAT()
+    self._inky_display = inky_display if inky_display is not None else hal.eink_display()
     self._inky_display.h_flip = True
     self._inky_display.v_flip = True
+    # Every shown frame goes to a shared memory framebuffer other processes can map, see framebuffer.Framebuffer
+    self._framebuffer = None
+    if framebuffer_path:
+      try:
+        self._framebuffer = framebuffer.Framebuffer(framebuffer_path, (self._inky_display.WIDTH, self._inky_display.HEIGHT),
+                                                    writable=True)
+      except OSError as ex:
+        logging.warning(f'Could not create the framebuffer {framebuffer_path}: {ex}')
+    self._snapshot_path = snapshot_path
+    self._snapshot_interval = snapshot_interval
+    self._next_snapshot = 0
     self._display_condition = threading.Condition()
     self._display_thread = threading.Thread(target=self._display_service, name='Turtle Display Service')
     self._display_canvas = None
-    self._free_canvases = []
+    # Boxes changed since the frame on the display, None when the whole frame may have changed
+    self._display_damage = None
+    self._last_damage = None
+    self._pool = CanvasPool((self._inky_display.WIDTH, self._inky_display.HEIGHT), pool_capacity)
     
   @property
   def running(self):
@@ -74,37 +169,97 @@ class InkyDisplayService:
       self._display_thread.join()
     else:
       logging.warning('Inky Display Service not started')
+    self.close()
+
+  def close(self):
+    # Called by shutdown, or directly when the service was not started
+    if self._framebuffer is not None:
+      self._framebuffer.close()
+      self._framebuffer = None
+
+  @property
+  def framebuffer(self):
+    return self._framebuffer
+
+  def save_snapshot(self, path=None):
+    # PNG of the last shown frame, on the caller thread
+    if self._framebuffer is None or self._framebuffer.frame == 0:
+      return False
+    self._framebuffer.image().save(path or self._snapshot_path)
+    return True
     
-  def get_canvas(self, color=inky.WHITE):
-    if self._free_canvases:
-      canvas = self._free_canvases.pop()
-      canvas.clear(color=color)
-    else:
-      canvas = InkyDisplayCanvas((self._inky_display.WIDTH, self._inky_display.HEIGHT), color=color)
-    return canvas
+  @property
+  def pool(self):
+    return self._pool
+
+  def get_canvas(self, color=WHITE):
+    return self._pool.acquire(color)
   
-  def display(self, canvas):
-    canvas.save('/dev/shm/InkyDisplay.png')
+  @property
+  def size(self):
+    return (self._inky_display.WIDTH, self._inky_display.HEIGHT)
+
+  @property
+  def last_damage(self):
+    # Boxes the last shown frame changed, None for a full frame, for displays able to refresh a part of the panel
+    return self._last_damage
+
+  def display(self, canvas, damage=None):
+    # damage is the list of (left, top, right, bottom) boxes changed since the previous frame, None if unknown
     with self._display_condition:
       if self._display_canvas:
-        self._free_canvases.append(self._display_canvas)
+        # Coalesced, the display only shows the latest frame, with the damage of both
+        self._pool.release(self._display_canvas, dropped=True)
+        if damage is not None and self._display_damage is not None:
+          damage = self._display_damage + list(damage)
+        else:
+          damage = None
       self._display_canvas = canvas
+      self._display_damage = list(damage) if damage is not None else None
       self._display_condition.notify()
     
+  def _show(self, canvas, damage):
+    self._last_damage = damage
+    if damage is not None:
+      logging.debug(f'Refresh display, damaged {damage}')
+    self._inky_display.set_image(canvas.image)
+    self._inky_display.show()
+    if self._framebuffer is not None:
+      self._framebuffer.write(canvas.image, time.time())
+    if self._snapshot_interval and self._snapshot_path and time.monotonic() >= self._next_snapshot:
+      self._next_snapshot = time.monotonic() + self._snapshot_interval
+      try:
+        canvas.save(self._snapshot_path)
+      except OSError as ex:
+        logging.warning(f'Could not save the display snapshot {self._snapshot_path}: {ex}')
+    self._pool.release(canvas)
+
+  def refresh(self):
+    # Shows the last canvas passed to display() on the caller thread, for callers not starting the service.
+    # Blocks for the e-ink refresh, returns False if there was nothing new to show.
+    with self._display_condition:
+      display_image = self._display_canvas
+      damage = self._display_damage
+      self._display_canvas = None
+    if display_image:
+      self._show(display_image, damage)
+    return display_image is not None
+
   def _display_service(self):
     logging.info('Inky Display Service started')
     while self._running:
       display_image = None
       with self._display_condition:
-        self._display_condition.wait()
+        # A frame handed over while the last one was being shown is already waiting
+        if self._display_canvas is None and self._running:
+          self._display_condition.wait()
         if self._display_canvas:
           display_image = self._display_canvas
+          damage = self._display_damage
           self._display_canvas = None
       if display_image:
-          self._inky_display.set_image(display_image.image)
-          self._inky_display.show()
-          self._free_canvases.append(display_image)
-    logging.info('Inky Display Service stopped')
+          self._show(display_image, damage)
+    logging.info(f'Inky Display Service stopped, canvas pool: {self._pool}')
 
 
 if __name__ == "__main__":
@@ -120,9 +275,19 @@ if __name__ == "__main__":
       type=lambda x: getattr(logging, x),
       help='Configure the logging level. default: INFO'
   )
+  parser.add_argument(
+      '--simulate',
+      default=False,
+      type=bool,
+      help='Draw to an in-memory display instead of the Inky pHAT'
+  )
   args = parser.parse_args()
   logging.basicConfig(level=args.log_level)
 
+  if args.simulate:
+    import simulation
+    hal.use(simulation.Simulation())
+
   inky_display_service = InkyDisplayService()
   inky_display_service.start()
 
@@ -134,13 +299,13 @@ if __name__ == "__main__":
       canvas = inky_display_service.get_canvas()
       text = f'Hello {count}'
       print(text)
-      canvas.draw.text((40, 40), text, inky.BLACK, font=font)
+      canvas.draw.text((40, 40), text, BLACK, font=font)
       inky_display_service.display(canvas)
       time.sleep(1)
       canvas = inky_display_service.get_canvas()
       text = f'World {count}'
       print(text)
-      canvas.draw.text((40, 40), text, inky.BLACK, font=font)
+      canvas.draw.text((40, 40), text, BLACK, font=font)
       inky_display_service.display(canvas)
       time.sleep(1)
       count += 1
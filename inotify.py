@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import ctypes
+import ctypes.util
+import os
+import struct
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+EVENT_FORMAT = 'iIII'
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+READ_SIZE = 4096
+
+_libc = None
+
+def _load_libc():
+  global _libc
+  if _libc is None:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+  return _libc
+
+
+class Inotify:
+  def __init__(self):
+    libc = _load_libc()
+    self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self._fd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno))
+
+  def fileno(self):
+    return self._fd
+
+  def add_watch(self, path, mask):
+    wd = _load_libc().inotify_add_watch(self._fd, os.fsencode(path), mask)
+    if wd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno), path)
+    return wd
+
+  def read(self):
+    # Returns the pending (wd, mask, cookie, name) events, an empty list if there are none
+    try:
+      data = os.read(self._fd, READ_SIZE)
+    except BlockingIOError:
+      return []
+    events = []
+    offset = 0
+    while offset + EVENT_SIZE <= len(data):
+      wd, mask, cookie, length = struct.unpack_from(EVENT_FORMAT, data, offset)
+      offset += EVENT_SIZE
+      name = data[offset:offset + length].rstrip(b'\0')
+      offset += length
+      events.append((wd, mask, cookie, os.fsdecode(name)))
+    return events
+
+  def close(self):
+    if self._fd >= 0:
+      os.close(self._fd)
+      self._fd = -1
+
+
+if __name__ == "__main__":
+  import tempfile
+  import unittest
+
+  class InotifyTest(unittest.TestCase):
+    def testCreateDelete(self):
+      with tempfile.TemporaryDirectory() as path:
+        inotify = Inotify()
+        wd = inotify.add_watch(path, IN_CREATE | IN_DELETE | IN_ONLYDIR)
+        self.assertEqual(inotify.read(), [])
+        os.mkdir(os.path.join(path, '28-0001'))
+        os.rmdir(os.path.join(path, '28-0001'))
+        events = inotify.read()
+        self.assertEqual([(e[0], e[1] & (IN_CREATE | IN_DELETE), e[3]) for e in events],
+                         [(wd, IN_CREATE, '28-0001'), (wd, IN_DELETE, '28-0001')])
+        inotify.close()
+
+  unittest.main()
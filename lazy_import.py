@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+  # Returns the module, only executed when one of its attributes is first used.
+  # An import statement of name uses the module and executes it, import it lazily everywhere it should wait.
+  module = sys.modules.get(name)
+  if module is not None:
+    return module
+  spec = importlib.util.find_spec(name)
+  if spec is None:
+    raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+  loader = importlib.util.LazyLoader(spec.loader)
+  spec.loader = loader
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  loader.exec_module(module)
+  parent, _, child = name.rpartition('.')
+  if parent:
+    setattr(sys.modules[parent], child, module)
+  return module
+
+
+if __name__ == "__main__":
+  import os
+  import tempfile
+  import unittest
+
+  class LazyImportTest(unittest.TestCase):
+    def testLazy(self):
+      with tempfile.TemporaryDirectory() as path:
+        with open(os.path.join(path, 'lazy_import_probe.py'), 'w') as f:
+          f.write('import sys\nsys.lazy_import_probe_loaded = True\nVALUE = 42\n')
+        sys.path.insert(0, path)
+        try:
+          module = lazy_import('lazy_import_probe')
+          self.assertFalse(hasattr(sys, 'lazy_import_probe_loaded'))
+          self.assertIs(lazy_import('lazy_import_probe'), module)
+          self.assertFalse(hasattr(sys, 'lazy_import_probe_loaded'))
+          self.assertEqual(module.VALUE, 42)
+          self.assertTrue(sys.lazy_import_probe_loaded)
+        finally:
+          sys.path.remove(path)
+          sys.modules.pop('lazy_import_probe', None)
+
+    def testSubmodule(self):
+      module = lazy_import('xml.dom.minidom')
+      import xml.dom
+      self.assertIs(xml.dom.minidom, module)
+      self.assertTrue(callable(module.parseString))
+
+    def testMissing(self):
+      self.assertRaises(ModuleNotFoundError, lazy_import, 'no_such_module_here')
+
+  unittest.main()
@@ -1,34 +1,28 @@
 #!/usr/bin/env python3
-import array
+import rolling_stats
 
 class MovingAverage:
   def __init__(self, window_size=1):
-    self._window_size = max(window_size, 1)
-    self._values = array.array('d', [0 for _ in range(self._window_size)])
-    self._count = 0
-    self._sum = 0
+    self._stats = rolling_stats.RollingStats(1, window_size, extrema=False, median=False)
   
   @property
   def window_size(self):
-    return self._window_size
+    return self._stats.window_size
   
   @property
   def average(self):
-    return self._sum / max(min(self._count, self._window_size), 1)
+    return self._stats.mean() if self._stats.count else 0
 
   @property
   def count(self):
-    return self._count
+    return self._stats.count
 
   @property
   def filled(self):
-    return self._count >= self._window_size
+    return self._stats.filled
 
   def add(self, value):
-    index = self._count % self._window_size
-    self._sum += value - self._values[index]
-    self._values[index] = value
-    self._count += 1
+    self._stats.add((value,))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+import time
+
+# A field has to move this far from the value on the display before it is shown again,
+# so a reading flickering around a rounding boundary does not refresh the panel
+HYSTERESIS = {
+  'air_temp': 0.75,   # ℃, shown rounded to 1℃
+  'water_temp': 0.75,
+  'uva': 2,
+  'uvb': 2,
+  'water_distance': 4,  # mm, a water level step is 2.4mm
+}
+MIN_INTERVAL = 60   # 60s between refreshes, the Inky pHAT takes seconds to refresh and wears out
+COALESCE_DELAY = 10 # 10s waiting for the other fields to change after the first one did
+
+
+class RefreshPolicy:
+  # Decides when the values of a display are worth a refresh. update() returns the values
+  # to show, None to keep the display as it is. Fields that did not move past their hysteresis
+  # keep the value shown before, so the display only changes where it has to.
+  def __init__(self, hysteresis=HYSTERESIS, min_interval=MIN_INTERVAL, coalesce_delay=COALESCE_DELAY, clock=time.monotonic):
+    self._hysteresis = dict(hysteresis)
+    self._min_interval = min_interval
+    self._coalesce_delay = coalesce_delay
+    self._clock = clock
+    self._shown = {}
+    self._latest = {}
+    self._pending_since = None
+    self._last_refresh = None
+    self._previous_refresh = None
+    self._refreshes = 0
+    self._suppressed = 0
+
+  @property
+  def refreshes(self):
+    return self._refreshes
+
+  @property
+  def suppressed(self):
+    # Updates with a change worth showing that were held back by the coalescing or the minimum interval
+    return self._suppressed
+
+  @property
+  def shown(self):
+    return dict(self._shown)
+
+  def _significant(self, field, value):
+    if field not in self._shown:
+      return True
+    hysteresis = self._hysteresis.get(field, 0)
+    delta = abs(value - self._shown[field])
+    return delta >= hysteresis if hysteresis else delta > 0
+
+  def _changed(self):
+    return [field for field, value in self._latest.items() if self._significant(field, value)]
+
+  def update(self, values=None):
+    # values is {field: number}, None only checks whether a held back change is due now
+    if values:
+      self._latest.update(values)
+    changed = self._changed()
+    if not changed:
+      self._pending_since = None
+      return None
+    now = self._clock()
+    if self._pending_since is None:
+      self._pending_since = now
+    # The first refresh shows the values right away
+    if self._last_refresh is not None and (now - self._pending_since < self._coalesce_delay
+                                           or now - self._last_refresh < self._min_interval):
+      if values:
+        self._suppressed += 1
+      return None
+    for field in changed:
+      self._shown[field] = self._latest[field]
+    self._pending_since = None
+    self._previous_refresh = self._last_refresh
+    self._last_refresh = now
+    self._refreshes += 1
+    return dict(self._shown)
+
+  def discard(self):
+    # The values returned by the last update() did not change the display, e.g. the same texts were
+    # drawn again. They stay shown, but the update does not count as a refresh nor delays the next one.
+    self._last_refresh = self._previous_refresh
+    self._refreshes -= 1
+
+  def reset(self):
+    # Shows the next values whatever they are, e.g. after the display was cleared
+    self._shown = {}
+    self._pending_since = None
+    self._last_refresh = None
+
+
+if __name__ == "__main__":
+  import unittest
+
+  class Clock:
+    def __init__(self):
+      self.now = 0.0
+
+    def __call__(self):
+      return self.now
+
+  class RefreshPolicyTest(unittest.TestCase):
+    def setUp(self):
+      self.clock = Clock()
+      self.policy = RefreshPolicy({'temp': 0.75, 'level': 0}, min_interval=60, coalesce_delay=10, clock=self.clock)
+
+    def testFirstRefresh(self):
+      self.assertEqual(self.policy.update({'temp': 24.4, 'level': 3}), {'temp': 24.4, 'level': 3})
+      self.assertEqual(self.policy.refreshes, 1)
+
+    def testHysteresis(self):
+      self.policy.update({'temp': 24.4, 'level': 3})
+      for temp in [24.6, 24.4, 24.6, 25.1, 23.7]:
+        self.clock.now += 100
+        self.assertIsNone(self.policy.update({'temp': temp}))
+      self.assertEqual(self.policy.suppressed, 0)
+      self.clock.now += 100
+      self.policy.update({'temp': 25.2})
+      self.clock.now += 10
+      self.assertEqual(self.policy.update({'temp': 25.3}), {'temp': 25.3, 'level': 3})
+
+    def testCoalescing(self):
+      self.policy.update({'temp': 24.4, 'level': 3})
+      self.clock.now = 100
+      self.assertIsNone(self.policy.update({'level': 4}))
+      self.clock.now = 105
+      self.assertIsNone(self.policy.update({'temp': 26}))
+      self.clock.now = 110
+      # Only level changed on this update, the temperature change is still shown with it
+      self.assertEqual(self.policy.update({'level': 5}), {'temp': 26, 'level': 5})
+      self.assertEqual((self.policy.refreshes, self.policy.suppressed), (2, 2))
+
+    def testMinInterval(self):
+      self.policy.update({'temp': 24.4, 'level': 3})
+      self.clock.now = 20
+      self.assertIsNone(self.policy.update({'level': 4}))
+      self.clock.now = 40
+      self.assertIsNone(self.policy.update({'level': 4}))
+      self.clock.now = 60
+      self.assertEqual(self.policy.update(), {'temp': 24.4, 'level': 4})
+      self.assertEqual(self.policy.suppressed, 2)
+
+    def testChangeReverted(self):
+      self.policy.update({'temp': 24.4, 'level': 3})
+      self.clock.now = 100
+      self.assertIsNone(self.policy.update({'level': 4}))
+      self.assertIsNone(self.policy.update({'level': 3}))
+      self.clock.now = 200
+      self.assertIsNone(self.policy.update())
+
+    def testDiscard(self):
+      self.policy.update({'temp': 24.4, 'level': 3})
+      self.clock.now = 100
+      self.assertIsNone(self.policy.update({'temp': 24.2, 'level': 4}))
+      self.clock.now = 110
+      self.assertEqual(self.policy.update(), {'temp': 24.4, 'level': 4})
+      self.policy.discard()
+      self.assertEqual(self.policy.refreshes, 1)
+      self.assertEqual(self.policy.shown, {'temp': 24.4, 'level': 4})
+      # The minimum interval runs from the first refresh, not from the discarded one
+      self.clock.now = 120
+      self.assertIsNone(self.policy.update({'level': 5}))
+      self.clock.now = 130
+      self.assertEqual(self.policy.update(), {'temp': 24.4, 'level': 5})
+      self.assertEqual(self.policy.refreshes, 2)
+
+  unittest.main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+import glob
+import inky_display_service
+import itertools
+import logging
+import os
+import PIL.Image
+import PIL.ImageChops
+import random
+import refresh_policy
+import resource
+import simulation
+import statistics
+import time
+import tracemalloc
+import turtle_monitor
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), 'render_golden')
+SEED = 3
+TEMPERATURES = (-3.2, 18.6, 24.4, 31.5, 42.0)
+UV_VALUES = ((0, 0), (12.4, 3.6), (230.7, 480.2), (1024.0, 2048.0))
+
+
+def water_distances():
+  # The distance of every one of the 18 water levels, from the highest to the lowest,
+  # with one distance above the high level and one below the low level
+  step = (turtle_monitor.WATER_HIGH_LEVEL - turtle_monitor.WATER_LOW_LEVEL) / 17
+  depths = [turtle_monitor.WATER_HIGH_LEVEL + step] + [turtle_monitor.WATER_LOW_LEVEL + level * step for level in range(17, -1, -1)]
+  return [turtle_monitor.WATER_MAX_DISTANCE - depth for depth in depths + [turtle_monitor.WATER_LOW_LEVEL - step]]
+
+
+def sweep():
+  # (air_temp, water_temp, uva, uvb, water_distance) of every frame, the water level changes the most often
+  # like it does on the real display, the temperatures and the UV the least often
+  temperatures = zip(TEMPERATURES, reversed(TEMPERATURES))
+  for (uva, uvb), (air_temp, water_temp), water_distance in itertools.product(UV_VALUES, temperatures, water_distances()):
+    yield air_temp, water_temp, uva, uvb, water_distance
+
+
+class RenderBenchmark:
+  # Drives a TurtleDisplay on an in-memory display, the turtle and the snail are placed by a seeded rng
+  # and every frame is shown, so the same sweep always gives the same images
+  def __init__(self, seed=SEED):
+    self._display = simulation.MemoryInkyDisplay()
+    self._inky_service = inky_display_service.InkyDisplayService(self._display, framebuffer_path=None, snapshot_path=None)
+    policy = refresh_policy.RefreshPolicy(hysteresis={}, min_interval=0, coalesce_delay=0)
+    # The glyphs are rasterized again, the first frame is a cold start
+    turtle_monitor.TurtleDisplay.glyphs.clear()
+    self._turtle_display = turtle_monitor.TurtleDisplay(self._inky_service, rng=random.Random(seed), policy=policy)
+
+  def render(self, values):
+    self._turtle_display.display(*values)
+    self._inky_service.refresh()
+    return self._display.image
+
+  def time_frames(self, frames):
+    # Seconds to render and show every frame, with the images shown
+    times = []
+    images = []
+    for values in frames:
+      begin = time.perf_counter()
+      image = self.render(values)
+      times.append(time.perf_counter() - begin)
+      images.append(image)
+    return times, images
+
+  def trace_frames(self, frames):
+    # (bytes still allocated after, peak bytes allocated during, resident bytes gained) every frame,
+    # in a pass of its own because tracing slows the rendering down. tracemalloc only sees the Python
+    # heap, not the pixel buffers Pillow allocates in C, the resident set size does.
+    usage = []
+    tracemalloc.start()
+    try:
+      for values in frames:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        rss_before = rss()
+        self.render(values)
+        after, peak = tracemalloc.get_traced_memory()
+        rss_after = rss()
+        usage.append((after - before, peak - before, None if rss_before is None else rss_after - rss_before))
+    finally:
+      tracemalloc.stop()
+    return usage
+
+  def close(self):
+    self._inky_service.close()
+
+
+def rss():
+  # Resident set size in bytes, None where /proc is not available
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * resource.getpagesize()
+  except OSError:
+    return None
+
+
+def max_rss():
+  # Peak resident set size of the process in bytes, Linux reports it in KiB
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def golden_path(golden_dir, index):
+  return os.path.join(golden_dir, f'frame_{index:03d}.png')
+
+
+def _levels(image):
+  # The palette indices of a 'P' image as gray levels, two palette entries may have the same color
+  if image.mode == 'P':
+    return PIL.Image.frombytes('L', image.size, image.tobytes())
+  return image.convert('L')
+
+
+def compare(images, golden_dir):
+  # {frame index: bounding box of the difference, None if the golden image is missing} of the frames
+  # differing from their golden image
+  mismatches = {}
+  for index, image in enumerate(images):
+    path = golden_path(golden_dir, index)
+    if not os.path.exists(path):
+      mismatches[index] = None
+      continue
+    with PIL.Image.open(path) as golden:
+      golden = golden.convert(image.mode)
+    if golden.size != image.size:
+      mismatches[index] = (0, 0) + image.size
+    elif golden.tobytes() != image.tobytes():
+      mismatches[index] = PIL.ImageChops.difference(_levels(golden), _levels(image)).getbbox()
+  return mismatches
+
+
+def update_golden(images, golden_dir):
+  os.makedirs(golden_dir, exist_ok=True)
+  for path in glob.glob(os.path.join(golden_dir, 'frame_*.png')):
+    os.remove(path)
+  for index, image in enumerate(images):
+    image.save(golden_path(golden_dir, index))
+
+
+def summarize(name, values, scale, unit):
+  values = sorted(values)
+  p95 = values[min(len(values) - 1, round(0.95 * (len(values) - 1)))]
+  return (f'{name:>10}: mean {statistics.fmean(values) * scale:8.2f}{unit} median {statistics.median(values) * scale:8.2f}{unit} '
+          f'p95 {p95 * scale:8.2f}{unit} max {values[-1] * scale:8.2f}{unit}')
+
+
+def main(golden_dir=GOLDEN_DIR, update=False, repeat=3, seed=SEED, trace=True):
+  frames = list(sweep())
+  max_rss_before = max_rss()
+  benchmark = RenderBenchmark(seed)
+  try:
+    # The first pass starts with an empty glyph cache and scene, the next ones only draw what changed
+    cold_times, images = benchmark.time_frames(frames)
+    warm_times = []
+    for _ in range(repeat - 1):
+      times, repeated = benchmark.time_frames(frames)
+      warm_times.extend(times)
+      # The retained scene has to give the same images as the first pass
+      for index, (image, other) in enumerate(zip(images, repeated)):
+        if image.tobytes() != other.tobytes():
+          logging.error(f'Frame {index} differs from the first pass when drawn again')
+    usage = benchmark.trace_frames(frames) if trace else None
+  finally:
+    benchmark.close()
+
+  logging.info(f'{len(frames)} frames, {repeat} passes, seed {seed}')
+  logging.info(f'first frame: {cold_times[0] * 1000:.2f}ms')
+  logging.info(summarize('cold', cold_times[1:], 1000, 'ms'))
+  if warm_times:
+    logging.info(summarize('warm', warm_times, 1000, 'ms'))
+  if usage:
+    # The Python heap only, Pillow's pixel buffers are not traced, the resident set size includes them
+    logging.info(summarize('heap kept', [retained for retained, _, _ in usage], 1 / 1024, 'KiB'))
+    logging.info(summarize('heap peak', [peak for _, peak, _ in usage], 1 / 1024, 'KiB'))
+    if usage[0][2] is not None:
+      logging.info(summarize('rss gained', [gained for _, _, gained in usage], 1 / 1024, 'KiB'))
+  logging.info(f'max rss: {max_rss() / 1024 / 1024:.1f}MiB, {(max_rss() - max_rss_before) / 1024:.0f}KiB more than before the benchmark')
+
+  if update:
+    update_golden(images, golden_dir)
+    logging.info(f'Saved {len(images)} golden images to {golden_dir}')
+    return True
+  if not glob.glob(os.path.join(golden_dir, 'frame_*.png')):
+    logging.error(f'No golden images in {golden_dir}, save them with --update-golden')
+    return False
+  mismatches = compare(images, golden_dir)
+  for index, box in sorted(mismatches.items()):
+    if box is None:
+      logging.error(f'Frame {index}: no golden image {golden_path(golden_dir, index)}')
+    else:
+      logging.error(f'Frame {index}: differs from its golden image in {box}, values {frames[index]}')
+  if not mismatches:
+    logging.info(f'All {len(images)} frames match their golden images')
+  return not mismatches
+
+
+if __name__ == "__main__":
+  import argparse
+  import sys
+  import tempfile
+  import unittest
+
+  class RenderBenchmarkTest(unittest.TestCase):
+    def setUp(self):
+      self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+      self._dir.cleanup()
+
+    def testSweep(self):
+      levels = set()
+      for distance in water_distances():
+        depth = turtle_monitor.WATER_MAX_DISTANCE - distance
+        levels.add(round((depth - turtle_monitor.WATER_LOW_LEVEL) * 17 / (turtle_monitor.WATER_HIGH_LEVEL - turtle_monitor.WATER_LOW_LEVEL)))
+      self.assertTrue(set(range(18)) < levels)
+
+    def testSameSeed(self):
+      frames = list(sweep())[:20]
+      images = []
+      for _ in range(2):
+        benchmark = RenderBenchmark(SEED)
+        images.append(benchmark.time_frames(frames)[1])
+        benchmark.close()
+      self.assertEqual([image.tobytes() for image in images[0]], [image.tobytes() for image in images[1]])
+
+    def testCompare(self):
+      images = [PIL.Image.new('P', (212, 104), 0) for _ in range(3)]
+      update_golden(images + [images[0]], self._dir.name)
+      update_golden(images, self._dir.name)
+      # The frames of an older and longer sweep are removed
+      self.assertFalse(os.path.exists(golden_path(self._dir.name, 3)))
+      self.assertEqual(compare(images, self._dir.name), {})
+      images[1].putpixel((20, 30), 1)
+      images.append(images[0])
+      self.assertEqual(compare(images, self._dir.name), {1: (20, 30, 21, 31), 3: None})
+
+    def testSummarize(self):
+      summary = summarize('time', [0.004, 0.001, 0.002, 0.003], 1000, 'ms')
+      self.assertIn('mean     2.50ms', summary)
+      self.assertIn('median     2.50ms', summary)
+      self.assertIn('max     4.00ms', summary)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--log-level',
+      default=logging.INFO,
+      type=lambda x: getattr(logging, x),
+      help='Configure the logging level. default: INFO'
+  )
+  parser.add_argument(
+      '--golden-dir',
+      default=GOLDEN_DIR,
+      help=f'Directory of the expected frames. default: {GOLDEN_DIR}'
+  )
+  parser.add_argument(
+      '--update-golden',
+      action='store_true',
+      help='Save the rendered frames as the new golden images instead of comparing them'
+  )
+  parser.add_argument(
+      '--repeat',
+      default=3,
+      type=int,
+      help='Number of passes over the sweep, the first one is cold. default: 3'
+  )
+  parser.add_argument(
+      '--seed',
+      default=SEED,
+      type=int,
+      help=f'Seed placing the turtle and the snail, golden images are only valid for their seed. default: {SEED}'
+  )
+  parser.add_argument(
+      '--skip-memory',
+      action='store_true',
+      help='Do not trace the memory allocated by every frame, it takes an extra pass'
+  )
+  parser.add_argument(
+      '--symbola-path',
+      default=turtle_monitor.SYMBOLA_PATH,
+      help=f'Symbola font drawing the icons, golden images are only valid for their fonts. default: {turtle_monitor.SYMBOLA_PATH}'
+  )
+  parser.add_argument(
+      '--test',
+      action='store_true',
+      help='Run the unit tests of the benchmark instead of the benchmark'
+  )
+  args = parser.parse_args()
+  logging.basicConfig(level=args.log_level)
+
+  turtle_monitor.SYMBOLA_PATH = args.symbola_path
+  if args.test:
+    unittest.main(argv=sys.argv[:1])
+  sys.exit(0 if main(golden_dir=args.golden_dir, update=args.update_golden, repeat=args.repeat, seed=args.seed,
+                     trace=not args.skip_memory) else 1)
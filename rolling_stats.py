@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+import array
+import bisect
+import collections
+import math
+
+
+class RollingStats:
+  # Mean, variance, min, max and median over the last window_size samples of several channels.
+  # The samples of all channels share one contiguous buffer, sample by sample. An update is
+  # O(1) for mean and variance, amortized O(1) for min and max (monotonic deques) and a
+  # binary search plus a memmove of the sorted window for the median.
+  def __init__(self, channels, window_size=1, extrema=True, median=True):
+    if isinstance(channels, int):
+      self._names = {}
+      self._channels = channels
+    else:
+      self._names = {name: i for i, name in enumerate(channels)}
+      self._channels = len(self._names)
+    self._window_size = max(window_size, 1)
+    self._values = array.array('d', bytes(8 * self._channels * self._window_size))
+    self._count = 0
+    # Kahan compensated sums of the values, and of the squared distances to a shift close
+    # to the mean, which keeps the variance from cancelling out
+    self._sum = array.array('d', bytes(8 * self._channels))
+    self._sum_c = array.array('d', bytes(8 * self._channels))
+    self._sumsq = array.array('d', bytes(8 * self._channels))
+    self._sumsq_c = array.array('d', bytes(8 * self._channels))
+    self._shift = array.array('d', bytes(8 * self._channels))
+    self._min = [collections.deque() for _ in range(self._channels)] if extrema else None
+    self._max = [collections.deque() for _ in range(self._channels)] if extrema else None
+    self._sorted = [[] for _ in range(self._channels)] if median else None
+
+  @property
+  def channels(self):
+    return self._channels
+
+  @property
+  def window_size(self):
+    return self._window_size
+
+  @property
+  def count(self):
+    return self._count
+
+  @property
+  def filled(self):
+    return self._count >= self._window_size
+
+  def __len__(self):
+    return min(self._count, self._window_size)
+
+  def _channel(self, channel):
+    return self._names[channel] if isinstance(channel, str) else channel
+
+  @staticmethod
+  def _kahan(sums, compensations, c, value):
+    y = value - compensations[c]
+    t = sums[c] + y
+    compensations[c] = (t - sums[c]) - y
+    sums[c] = t
+
+  def add(self, values):
+    n = self._channels
+    window_size = self._window_size
+    seq = self._count
+    base = (seq % window_size) * n
+    replace = seq >= window_size
+    for c in range(n):
+      value = float(values[c])
+      if seq == 0:
+        self._shift[c] = value
+      shift = self._shift[c]
+      if replace:
+        old = self._values[base + c]
+        self._kahan(self._sum, self._sum_c, c, -old)
+        self._kahan(self._sumsq, self._sumsq_c, c, -(old - shift) ** 2)
+      self._values[base + c] = value
+      self._kahan(self._sum, self._sum_c, c, value)
+      self._kahan(self._sumsq, self._sumsq_c, c, (value - shift) ** 2)
+      if self._min is not None:
+        low = self._min[c]
+        while low and low[-1][1] >= value:
+          low.pop()
+        low.append((seq, value))
+        if low[0][0] <= seq - window_size:
+          low.popleft()
+        high = self._max[c]
+        while high and high[-1][1] <= value:
+          high.pop()
+        high.append((seq, value))
+        if high[0][0] <= seq - window_size:
+          high.popleft()
+      if self._sorted is not None:
+        ordered = self._sorted[c]
+        if replace:
+          del ordered[bisect.bisect_left(ordered, old)]
+        bisect.insort(ordered, value)
+    self._count = seq + 1
+    if self._count % window_size == 0:
+      self._resync()
+
+  def add_many(self, rows):
+    # Batch path, a batch covering the whole window only keeps its last window_size rows
+    # and rebuilds the statistics once instead of updating them row by row
+    if len(rows) < self._window_size:
+      for row in rows:
+        self.add(row)
+      return
+    n = self._channels
+    window_size = self._window_size
+    first = self._count + len(rows) - window_size
+    for seq, row in enumerate(rows[len(rows) - window_size:], first):
+      base = (seq % window_size) * n
+      for c in range(n):
+        self._values[base + c] = float(row[c])
+    self._count = first + window_size
+    if self._min is not None:
+      for c in range(n):
+        self._min[c].clear()
+        self._max[c].clear()
+      for seq in range(first, self._count):
+        base = (seq % window_size) * n
+        for c in range(n):
+          value = self._values[base + c]
+          low = self._min[c]
+          while low and low[-1][1] >= value:
+            low.pop()
+          low.append((seq, value))
+          high = self._max[c]
+          while high and high[-1][1] <= value:
+            high.pop()
+          high.append((seq, value))
+    if self._sorted is not None:
+      for c in range(n):
+        self._sorted[c] = sorted(self._values[c::n])
+    self._resync()
+
+  def _resync(self):
+    # Recomputes the sums exactly every window_size samples, rounding errors never accumulate
+    n = self._channels
+    size = len(self)
+    for c in range(n):
+      window = self._values[c:size * n:n]
+      total = math.fsum(window)
+      shift = total / size
+      self._shift[c] = shift
+      self._sum[c] = total
+      self._sum_c[c] = 0.0
+      self._sumsq[c] = math.fsum((value - shift) ** 2 for value in window)
+      self._sumsq_c[c] = 0.0
+
+  def mean(self, channel=0):
+    size = len(self)
+    if size == 0:
+      return math.nan
+    return self._sum[self._channel(channel)] / size
+
+  def variance(self, channel=0):
+    # Sample variance of the window
+    size = len(self)
+    if size < 2:
+      return 0.0 if size else math.nan
+    c = self._channel(channel)
+    offset = self._sum[c] - size * self._shift[c]
+    return max((self._sumsq[c] - offset * offset / size) / (size - 1), 0.0)
+
+  def stddev(self, channel=0):
+    return math.sqrt(self.variance(channel))
+
+  def min(self, channel=0):
+    low = self._min[self._channel(channel)]
+    return low[0][1] if low else math.nan
+
+  def max(self, channel=0):
+    high = self._max[self._channel(channel)]
+    return high[0][1] if high else math.nan
+
+  def median(self, channel=0):
+    ordered = self._sorted[self._channel(channel)]
+    size = len(ordered)
+    if size == 0:
+      return math.nan
+    middle = size // 2
+    return ordered[middle] if size % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+  def values(self, channel=0):
+    # The window of a channel, oldest first
+    c = self._channel(channel)
+    n = self._channels
+    first = max(self._count - self._window_size, 0)
+    return [self._values[(seq % self._window_size) * n + c] for seq in range(first, self._count)]
+
+
+if __name__ == "__main__":
+  import random
+  import statistics
+  import unittest
+
+  class RollingStatsTest(unittest.TestCase):
+    def check(self, stats, rows, window_size):
+      for c in range(stats.channels):
+        window = [row[c] for row in rows[-window_size:]]
+        self.assertEqual(stats.values(c), window)
+        self.assertAlmostEqual(stats.mean(c), statistics.fmean(window))
+        if len(window) > 1:
+          self.assertAlmostEqual(stats.variance(c), statistics.variance(window))
+        self.assertEqual(stats.min(c), min(window))
+        self.assertEqual(stats.max(c), max(window))
+        self.assertEqual(stats.median(c), statistics.median(window))
+
+    def testEmpty(self):
+      stats = RollingStats(['air', 'water'], 4)
+      self.assertEqual(len(stats), 0)
+      self.assertTrue(math.isnan(stats.mean('air')))
+      self.assertTrue(math.isnan(stats.min('water')))
+      self.assertTrue(math.isnan(stats.median(1)))
+
+    def testAdd(self):
+      stats = RollingStats(3, 7)
+      rows = []
+      for _ in range(50):
+        rows.append([random.uniform(-10, 10), random.gauss(25, 0.1), random.choice([1.0, 2.0, 3.0])])
+        stats.add(rows[-1])
+        self.check(stats, rows, 7)
+
+    def testAddMany(self):
+      stats = RollingStats(['a', 'b'], 5)
+      rows = [[random.random(), random.random()] for _ in range(23)]
+      stats.add_many(rows[:3])
+      self.check(stats, rows[:3], 5)
+      stats.add_many(rows[3:20])
+      self.check(stats, rows[:20], 5)
+      for row in rows[20:]:
+        stats.add(row)
+      self.check(stats, rows, 5)
+
+    def testNoDrift(self):
+      stats = RollingStats(1, 10)
+      for _ in range(100000):
+        stats.add([1e6 + random.random()])
+      for _ in range(10):
+        stats.add([0.1])
+      self.assertEqual(stats.mean(), math.fsum([0.1] * 10) / 10)
+      self.assertAlmostEqual(stats.variance(), 0.0)
+
+  unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import datetime
+import threading
+
+# Aggregation levels, each maps a timestamp to the start of its bucket in local time
+LEVELS = {
+  'minute': lambda t: t.replace(second=0, microsecond=0),
+  'hour': lambda t: t.replace(minute=0, second=0, microsecond=0),
+  'day': lambda t: t.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+# Statistics kept for every value column of a rollup row, count is the number of non NULL values the mean is over
+STATS = ('min', 'max', 'mean', 'count')
+
+
+class Bucket:
+  def __init__(self, start, width):
+    self._start = start
+    self._samples = 0
+    self._count = [0] * width
+    self._min = [None] * width
+    self._max = [None] * width
+    self._sum = [0.0] * width
+
+  def add(self, values):
+    self._samples += 1
+    for i, value in enumerate(values):
+      if value is None:
+        continue
+      if self._count[i] == 0:
+        self._min[i] = self._max[i] = value
+      else:
+        self._min[i] = min(self._min[i], value)
+        self._max[i] = max(self._max[i], value)
+      self._sum[i] += value
+      self._count[i] += 1
+
+  @property
+  def row(self):
+    # (start, samples, min, max, mean, count of the first column, min, max, mean, count of the second column, ...)
+    row = [self._start, self._samples]
+    for i, count in enumerate(self._count):
+      mean = self._sum[i] / count if count else None
+      row += [self._min[i], self._max[i], mean, count]
+    return tuple(row)
+
+
+class Accumulator:
+  # Open buckets of every level. take() hands the partial buckets to the storage, which merges
+  # them into the stored rows, and starts over. Thread safe, samples may be added while taking.
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._buckets = {level: {} for level in LEVELS}
+
+  def __len__(self):
+    with self._lock:
+      return sum(len(level_buckets) for level_buckets in self._buckets.values())
+
+  def add(self, row):
+    # row is a (timestamp, value, ...) tuple
+    ts = datetime.datetime.fromtimestamp(row[0])
+    values = row[1:]
+    with self._lock:
+      for level, floor in LEVELS.items():
+        start = floor(ts).timestamp()
+        bucket = self._buckets[level].get(start)
+        if bucket is None:
+          bucket = self._buckets[level][start] = Bucket(start, len(values))
+        bucket.add(values)
+
+  def take(self):
+    with self._lock:
+      buckets = self._buckets
+      self._buckets = {level: {} for level in LEVELS}
+    return buckets
+
+
+def bucket_rows(buckets):
+  # The partial rollup rows of every level for buckets from Accumulator.take()
+  return {level: [bucket.row for bucket in level_buckets.values()]
+          for level, level_buckets in buckets.items()}
+
+def aggregate(rows):
+  accumulator = Accumulator()
+  for row in rows:
+    accumulator.add(row)
+  return bucket_rows(accumulator.take())
+
+
+if __name__ == "__main__":
+  import unittest
+
+  class RollupTest(unittest.TestCase):
+    def testAggregate(self):
+      start = datetime.datetime(2021, 6, 1, 12, 30).timestamp()
+      rows = [
+        (start, 25.0, 1.0),
+        (start + 5, 26.0, None),
+        (start + 10, 24.0, 3.0),
+        (start + 60, 30.0, 4.0),
+      ]
+      rollups = aggregate(rows)
+      self.assertEqual(rollups['minute'], [
+        (start, 3, 24.0, 26.0, 25.0, 3, 1.0, 3.0, 2.0, 2),
+        (start + 60, 1, 30.0, 30.0, 30.0, 1, 4.0, 4.0, 4.0, 1),
+      ])
+      self.assertEqual(rollups['hour'], [
+        (start - 30 * 60, 4, 24.0, 30.0, 26.25, 4, 1.0, 4.0, 8.0 / 3, 3),
+      ])
+      self.assertEqual(rollups['day'][0][1], 4)
+      self.assertEqual(rollups['day'][0][0], datetime.datetime(2021, 6, 1).timestamp())
+
+    def testEmpty(self):
+      self.assertEqual(aggregate([]), {'minute': [], 'hour': [], 'day': []})
+
+    def testTake(self):
+      start = datetime.datetime(2021, 6, 1, 12, 30).timestamp()
+      accumulator = Accumulator()
+      accumulator.add((start, 25.0))
+      buckets = accumulator.take()
+      self.assertEqual(len(accumulator), 0)
+      accumulator.add((start + 5, 27.0))
+      self.assertEqual(bucket_rows(buckets)['minute'], [(start, 1, 25.0, 25.0, 25.0, 1)])
+      self.assertEqual(bucket_rows(accumulator.take())['minute'], [(start, 1, 27.0, 27.0, 27.0, 1)])
+
+  unittest.main()
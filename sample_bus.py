@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+import collections
+import logging
+import queue
+import threading
+import time
+
+QUEUE_SIZE = 64
+
+Sample = collections.namedtuple('Sample', ['topic', 'value', 'timestamp'])
+
+
+class Subscription:
+  # Bounded queue of the samples of some topics, every topic if topics is None.
+  # A consumer falling behind loses the oldest samples, publishers never wait for it.
+  def __init__(self, topics=None, maxsize=QUEUE_SIZE):
+    self._topics = frozenset(topics) if topics is not None else None
+    self._queue = queue.Queue(maxsize)
+    self._dropped = 0
+
+  @property
+  def topics(self):
+    return self._topics
+
+  @property
+  def dropped(self):
+    return self._dropped
+
+  def accepts(self, topic):
+    return self._topics is None or topic in self._topics
+
+  def put(self, sample, block=False):
+    if block:
+      self._queue.put(sample)
+      return
+    while True:
+      try:
+        self._queue.put_nowait(sample)
+        return
+      except queue.Full:
+        try:
+          self._queue.get_nowait()
+          self._dropped += 1
+        except queue.Empty:
+          pass
+
+  def get(self, timeout=None):
+    # Returns None after timeout seconds without a sample
+    try:
+      return self._queue.get(timeout=timeout)
+    except queue.Empty:
+      return None
+
+  def __len__(self):
+    return self._queue.qsize()
+
+
+class Stage:
+  # Pipeline stage calling handler(sample) on its own thread for every sample it subscribed to
+  _STOP = Sample(None, None, None)
+
+  def __init__(self, name, handler, subscription):
+    self._name = name
+    self._handler = handler
+    self._subscription = subscription
+    self._service_thread = None
+
+  @property
+  def name(self):
+    return self._name
+
+  @property
+  def subscription(self):
+    return self._subscription
+
+  @property
+  def running(self):
+    return self._service_thread is not None
+
+  def _stage_loop(self):
+    logging.info(f'{self._name} stage started')
+    while True:
+      sample = self._subscription.get()
+      if sample is self._STOP:
+        break
+      try:
+        self._handler(sample)
+      except Exception:
+        logging.exception(f'{self._name} stage failed on {sample}')
+    logging.info(f'{self._name} stage stopped, {self._subscription.dropped} samples dropped')
+
+  def start(self):
+    if self._service_thread is None:
+      self._service_thread = threading.Thread(target=self._stage_loop, name=f'{self._name} Stage')
+      self._service_thread.start()
+    else:
+      logging.warning(f'{self._name} stage already started')
+
+  def shutdown(self):
+    # The samples queued before the shutdown are still handled
+    if self._service_thread is not None:
+      self._subscription.put(self._STOP, block=True)
+      self._service_thread.join()
+      self._service_thread = None
+    else:
+      logging.warning(f'{self._name} stage not started')
+
+
+class SampleBus:
+  def __init__(self):
+    self._subscriptions = []
+    self._lock = threading.Lock()
+    self._latest = {}
+    self._stages = []
+    self._running = False
+
+  def publish(self, topic, value, timestamp=None):
+    sample = Sample(topic, value, time.time() if timestamp is None else timestamp)
+    self._latest[topic] = sample
+    for subscription in self._subscriptions:
+      if subscription.accepts(topic):
+        subscription.put(sample)
+    return sample
+
+  def latest(self, topic):
+    # The last sample published on topic, None if there was none yet
+    return self._latest.get(topic)
+
+  def subscribe(self, topics=None, maxsize=QUEUE_SIZE):
+    return self.attach(Subscription(topics, maxsize))
+
+  def attach(self, subscription):
+    # Any object with accepts(topic) and put(sample) receives the samples
+    with self._lock:
+      self._subscriptions = self._subscriptions + [subscription]
+    return subscription
+
+  def unsubscribe(self, subscription):
+    with self._lock:
+      self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+  def add_stage(self, name, handler, topics=None, maxsize=QUEUE_SIZE):
+    # A maxsize of 1 makes a stage only see the latest sample when it falls behind
+    stage = Stage(name, handler, self.subscribe(topics, maxsize))
+    self._stages.append(stage)
+    if self._running:
+      stage.start()
+    return stage
+
+  @property
+  def stages(self):
+    return list(self._stages)
+
+  def start(self):
+    self._running = True
+    for stage in self._stages:
+      if not stage.running:
+        stage.start()
+
+  def shutdown(self):
+    self._running = False
+    for stage in self._stages:
+      if stage.running:
+        stage.shutdown()
+      self.unsubscribe(stage.subscription)
+    self._stages = []
+
+
+class Snapshot:
+  # Combines the latest samples of several topics into (timestamp, value per topic) rows.
+  # update() returns a row once every topic has a value, at most one row every period seconds.
+  def __init__(self, topics, period=0):
+    self._topics = tuple(topics)
+    self._values = {}
+    self._period = period
+    self._timestamp = None
+
+  def update(self, sample):
+    if sample.topic not in self._topics:
+      return None
+    self._values[sample.topic] = sample.value
+    if len(self._values) < len(self._topics):
+      return None
+    if self._timestamp is not None and sample.timestamp - self._timestamp < self._period:
+      return None
+    self._timestamp = sample.timestamp
+    return (sample.timestamp,) + tuple(self._values[topic] for topic in self._topics)
+
+
+if __name__ == "__main__":
+  import unittest
+
+  class SampleBusTest(unittest.TestCase):
+    def testSubscription(self):
+      bus = SampleBus()
+      everything = bus.subscribe()
+      temperatures = bus.subscribe(['air_temp', 'water_temp'], maxsize=2)
+      for i in range(3):
+        bus.publish('air_temp', 20 + i, timestamp=i)
+      bus.publish('uva', 5, timestamp=3)
+      self.assertEqual(len(everything), 4)
+      self.assertEqual(temperatures.dropped, 1)
+      self.assertEqual(temperatures.get(), Sample('air_temp', 21, 1))
+      self.assertEqual(temperatures.get(), Sample('air_temp', 22, 2))
+      self.assertIsNone(temperatures.get(timeout=0.01))
+      self.assertEqual(bus.latest('uva'), Sample('uva', 5, 3))
+      self.assertIsNone(bus.latest('uvb'))
+      bus.unsubscribe(everything)
+      bus.publish('uvb', 1)
+      self.assertEqual(len(everything), 4)
+
+    def testStage(self):
+      bus = SampleBus()
+      handled = []
+      gate = threading.Event()
+      def slow(sample):
+        gate.wait()
+        handled.append(sample.value)
+      bus.add_stage('Slow', slow, maxsize=4)
+      fast = []
+      bus.add_stage('Fast', lambda sample: fast.append(sample.value))
+      bus.start()
+      for i in range(10):
+        bus.publish('water_dist', i)
+      gate.set()
+      bus.shutdown()
+      self.assertEqual(fast, list(range(10)))
+      # The slow stage lost the oldest samples but still handled the last ones
+      self.assertEqual(handled[-4:], [6, 7, 8, 9])
+      self.assertLess(len(handled), 10)
+
+    def testSnapshot(self):
+      snapshot = Snapshot(['air_temp', 'water_temp'], period=5)
+      self.assertIsNone(snapshot.update(Sample('air_temp', 20, 0)))
+      self.assertIsNone(snapshot.update(Sample('uva', 1, 0)))
+      self.assertEqual(snapshot.update(Sample('water_temp', 25, 1)), (1, 20, 25))
+      self.assertIsNone(snapshot.update(Sample('air_temp', 21, 3)))
+      self.assertEqual(snapshot.update(Sample('water_temp', 26, 6)), (6, 21, 26))
+
+  unittest.main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import bisect
+import logging
+import mmap
+import os
+import seqlock
+import struct
+
+# File layout: a header followed by a fixed number of fixed size records.
+#   header: magic, version, record size, capacity, sequence, number of records ever written
+#   record: timestamp, air temperature, water temperature, uva, uvb, water distance
+# The sequence is a seqlock.SeqLock, the writer makes it odd while it updates a record.
+MAGIC = b'TMRB'
+VERSION = 1
+HEADER_FORMAT = '<4sHHIQQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SEQUENCE_OFFSET = struct.calcsize('<4sHHI')
+COUNT_OFFSET = SEQUENCE_OFFSET + 8
+RECORD_FORMAT = '<6d'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+FIELDS = ('ts', 'air_temp', 'water_temp', 'uva', 'uvb', 'water_dist')
+
+RING_PATH = '/home/pi/turtle_monitor.ring'
+CAPACITY = 48 * 3600 // 5   # 48 hours of samples at the monitor's 5s cadence
+
+
+def _offsets(views):
+  # Index of the first row of every view in the rows of all of them
+  offset = 0
+  for view in views:
+    yield offset
+    offset += len(view)
+
+
+class _Timestamps:
+  # The timestamp column of views as one sequence, for bisect
+  def __init__(self, views):
+    self._views = views
+    self._offsets = list(_offsets(views))
+    self._len = sum(len(view) for view in views)
+
+  def __len__(self):
+    return self._len
+
+  def __getitem__(self, index):
+    i = bisect.bisect_right(self._offsets, index) - 1
+    return self._views[i][index - self._offsets[i], 0]
+
+
+class SampleRing:
+  def __init__(self, path=RING_PATH, capacity=CAPACITY, writable=False):
+    self._path = path
+    self._writable = writable
+    if writable:
+      self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+      if not self._valid(capacity):
+        logging.info(f'Create sample ring {path} for {capacity} samples')
+        self._file.truncate(0)
+        self._file.truncate(HEADER_SIZE + capacity * RECORD_SIZE)
+        self._file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, RECORD_SIZE, capacity, 0, 0))
+        self._file.flush()
+      self._map = mmap.mmap(self._file.fileno(), 0)
+    else:
+      self._file = open(path, 'rb')
+      if not self._valid(None):
+        raise ValueError(f'{path} is not a version {VERSION} sample ring')
+      self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    self._seqlock = seqlock.SeqLock(self._map, SEQUENCE_OFFSET, path)
+    if writable and self._seqlock.recover():
+      # The count was not increased, the record being written is not part of the ring
+      logging.warning(f'Sample ring {path} was left in the middle of an append')
+    _, _, _, self._capacity, _, _ = struct.unpack_from(HEADER_FORMAT, self._map)
+    self._records = memoryview(self._map)[HEADER_SIZE:HEADER_SIZE + self._capacity * RECORD_SIZE]
+
+  def _valid(self, capacity):
+    self._file.seek(0)
+    header = self._file.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+      return False
+    magic, version, record_size, file_capacity, _, _ = struct.unpack(HEADER_FORMAT, header)
+    if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+      return False
+    if capacity is not None and capacity != file_capacity:
+      return False
+    return os.fstat(self._file.fileno()).st_size >= HEADER_SIZE + file_capacity * RECORD_SIZE
+
+  @property
+  def path(self):
+    return self._path
+
+  @property
+  def capacity(self):
+    return self._capacity
+
+  @property
+  def sequence(self):
+    return self._seqlock.sequence
+
+  @property
+  def count(self):
+    # Number of samples ever appended, the ring keeps the last capacity of them
+    return struct.unpack_from('<Q', self._map, COUNT_OFFSET)[0]
+
+  def __len__(self):
+    return min(self.count, self._capacity)
+
+  def append(self, ts, air_temp, water_temp, uva, uvb, water_dist):
+    count = self.count
+    with self._seqlock.write():
+      struct.pack_into(RECORD_FORMAT, self._records, (count % self._capacity) * RECORD_SIZE,
+                       ts, air_temp, water_temp, uva, uvb, water_dist)
+      struct.pack_into('<Q', self._map, COUNT_OFFSET, count + 1)
+
+  def views(self, n):
+    # Zero copy access to the last n records, oldest first, as (rows, 6) memoryviews of doubles.
+    # The ring wraps around so there may be two views. They change under the reader,
+    # compare sequence before and after using them or use last() instead.
+    # Release the views before closing the ring.
+    count = self.count
+    n = min(n, count, self._capacity)
+    begin = (count - n) % self._capacity
+    end = begin + n
+    if end <= self._capacity:
+      segments = [(begin, end)]
+    else:
+      segments = [(begin, self._capacity), (0, end - self._capacity)]
+    return [self._records[b * RECORD_SIZE:e * RECORD_SIZE].cast('d', (e - b, len(FIELDS)))
+            for b, e in segments if e > b]
+
+  def last(self, n):
+    # Consistent copy of the last n records, oldest first, as tuples of FIELDS
+    data = self._seqlock.read(lambda: b''.join(view.tobytes() for view in self.views(n)))
+    return list(struct.iter_unpack(RECORD_FORMAT, data))
+
+  def since(self, ts):
+    # Records with a timestamp at or after ts, e.g. since(time.time() - hours * 3600).
+    # Bisects the timestamps in place and only copies the matching records.
+    def copy():
+      views = self.views(self._capacity)
+      begin = bisect.bisect_left(_Timestamps(views), ts)
+      return b''.join(view[max(begin - offset, 0):].tobytes() for view, offset in zip(views, _offsets(views)))
+    return list(struct.iter_unpack(RECORD_FORMAT, self._seqlock.read(copy)))
+
+  def close(self):
+    self._records.release()
+    self._map.close()
+    self._file.close()
+
+
+if __name__ == "__main__":
+  import tempfile
+  import unittest
+
+  class SampleRingTest(unittest.TestCase):
+    def setUp(self):
+      self._dir = tempfile.TemporaryDirectory()
+      self._path = os.path.join(self._dir.name, 'test.ring')
+
+    def tearDown(self):
+      self._dir.cleanup()
+
+    def testWrapAround(self):
+      ring = SampleRing(self._path, capacity=4, writable=True)
+      self.assertEqual(len(ring), 0)
+      self.assertEqual(ring.last(10), [])
+      for i in range(6):
+        ring.append(float(i), 20.0 + i, 24.0, 1.0, 2.0, 70.0)
+      self.assertEqual(ring.count, 6)
+      self.assertEqual(len(ring), 4)
+      self.assertEqual(ring.sequence, 12)
+      self.assertEqual([r[0] for r in ring.last(10)], [2.0, 3.0, 4.0, 5.0])
+      self.assertEqual(ring.last(1), [(5.0, 25.0, 24.0, 1.0, 2.0, 70.0)])
+      self.assertEqual([r[0] for r in ring.since(3.5)], [4.0, 5.0])
+      self.assertEqual([r[0] for r in ring.since(1.0)], [2.0, 3.0, 4.0, 5.0])
+      self.assertEqual([r[0] for r in ring.since(3.0)], [3.0, 4.0, 5.0])
+      self.assertEqual(ring.since(1.0), ring.last(4))
+      self.assertEqual(ring.since(6.0), [])
+      views = ring.views(3)
+      self.assertEqual(len(views), 2)
+      self.assertEqual([row[0] for view in views for row in view.tolist()], [3.0, 4.0, 5.0])
+      for view in views:
+        view.release()
+      ring.close()
+
+    def testReopen(self):
+      ring = SampleRing(self._path, capacity=4, writable=True)
+      ring.append(1.0, 20.0, 24.0, 1.0, 2.0, 70.0)
+      reader = SampleRing(self._path)
+      self.assertEqual(reader.capacity, 4)
+      ring.append(2.0, 21.0, 24.0, 1.0, 2.0, 70.0)
+      self.assertEqual([r[0] for r in reader.last(4)], [1.0, 2.0])
+      reader.close()
+      ring.close()
+      ring = SampleRing(self._path, capacity=4, writable=True)
+      self.assertEqual(ring.count, 2)
+      ring.close()
+      ring = SampleRing(self._path, capacity=8, writable=True)
+      self.assertEqual(ring.count, 0)
+      ring.close()
+
+    def testInterruptedAppend(self):
+      ring = SampleRing(self._path, capacity=4, writable=True)
+      ring.append(1.0, 20.0, 24.0, 1.0, 2.0, 70.0)
+      ring.close()
+      # The writer stopped after making the sequence odd
+      with open(self._path, 'r+b') as f:
+        f.seek(SEQUENCE_OFFSET)
+        f.write(struct.pack('<Q', 3))
+      ring = SampleRing(self._path, capacity=4, writable=True)
+      self.assertEqual(ring.sequence, 4)
+      self.assertEqual([r[0] for r in ring.last(4)], [1.0])
+      ring.append(2.0, 21.0, 24.0, 1.0, 2.0, 70.0)
+      self.assertEqual(ring.sequence, 6)
+      reader = SampleRing(self._path)
+      self.assertEqual([r[0] for r in reader.last(4)], [1.0, 2.0])
+      reader.close()
+      ring.close()
+
+  unittest.main()
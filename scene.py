@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+from inky_display_service import BLACK, WHITE
+import PIL.Image
+
+
+def union(a, b):
+  return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def intersects(a, b):
+  return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def merge_boxes(boxes):
+  # Overlapping boxes merged into one, so no pixel is redrawn twice
+  merged = []
+  for box in boxes:
+    while True:
+      overlapping = [other for other in merged if intersects(box, other)]
+      if not overlapping:
+        break
+      for other in overlapping:
+        merged.remove(other)
+        box = union(box, other)
+    merged.append(box)
+  return merged
+
+
+class Scene:
+  # Retained image of named elements. An element is a tuple of drawing operations, (x, y, text, font)
+  # for a text drawn from the glyph cache or (x, y, image) for an icon pasted as it is.
+  # update() only redraws the elements that changed and the ones overlapping them,
+  # and returns the damaged boxes, empty when nothing changed.
+  def __init__(self, size, glyphs, background=WHITE, color=BLACK):
+    self._glyphs = glyphs
+    self._background = background
+    self._color = color
+    self._image = PIL.Image.new('P', size, background)
+    self._elements = {}
+    self._boxes = {}
+
+  @property
+  def image(self):
+    return self._image
+
+  @property
+  def size(self):
+    return self._image.size
+
+  def _bbox(self, operations):
+    box = None
+    for operation in operations:
+      if len(operation) == 4:
+        x, y, text, font = operation
+        op_box = self._glyphs.bbox(font, text, (x, y))
+      else:
+        x, y, image = operation
+        op_box = (x, y, x + image.width, y + image.height)
+      box = op_box if box is None else union(box, op_box)
+    if box is None:
+      return None
+    # Clipped to the image, nothing outside of it can be damaged
+    box = (max(box[0], 0), max(box[1], 0), min(box[2], self._image.width), min(box[3], self._image.height))
+    return box if box[0] < box[2] and box[1] < box[3] else None
+
+  def _has_icon(self, name):
+    return any(len(operation) == 3 for operation in self._elements[name])
+
+  def _draw(self, operations):
+    for operation in operations:
+      if len(operation) == 4:
+        x, y, text, font = operation
+        self._glyphs.draw_text(self._image, (x, y), text, self._color, font)
+      else:
+        x, y, image = operation
+        self._image.paste(image, (x, y))
+
+  def update(self, elements):
+    # elements is {name: operations}, in drawing order
+    damage = []
+    for name in self._elements.keys() - elements.keys():
+      if self._boxes[name] is not None:
+        damage.append(self._boxes[name])
+      del self._elements[name]
+      del self._boxes[name]
+    for name, operations in elements.items():
+      operations = tuple(operations)
+      if self._elements.get(name) == operations:
+        continue
+      old_box = self._boxes.get(name)
+      box = self._bbox(operations)
+      damage += [b for b in (old_box, box) if b is not None]
+      self._elements[name] = operations
+      self._boxes[name] = box
+    if not damage:
+      return []
+    damage = merge_boxes(damage)
+    # An icon is pasted with its background, the whole icon is damaged when a part of it is
+    while True:
+      icons = [box for name, box in self._boxes.items()
+               if box is not None and self._has_icon(name) and any(intersects(box, d) for d in damage)]
+      grown = merge_boxes(damage + icons)
+      if set(grown) == set(damage):
+        break
+      damage = grown
+    for box in damage:
+      self._image.paste(self._background, box)
+    # Drawing is idempotent, an element overlapping a damaged box is simply drawn again whole
+    for name in elements:
+      box = self._boxes[name]
+      if box is not None and any(intersects(box, d) for d in damage):
+        self._draw(self._elements[name])
+    return damage
+
+  def clear(self):
+    # The next update() redraws everything
+    self._image.paste(self._background, (0, 0) + self._image.size)
+    self._elements = {}
+    self._boxes = {}
+
+
+if __name__ == "__main__":
+  import glyph_cache
+  import PIL.ImageDraw
+  import PIL.ImageFont
+  import unittest
+
+  class SceneTest(unittest.TestCase):
+    def setUp(self):
+      self.font = PIL.ImageFont.load_default()
+      self.glyphs = glyph_cache.GlyphCache()
+      self.icon = PIL.Image.new('P', (4, 4), BLACK)
+
+    def render(self, elements):
+      # Whole frame drawn from scratch
+      image = PIL.Image.new('P', (100, 50), WHITE)
+      draw = PIL.ImageDraw.Draw(image)
+      for operations in elements.values():
+        for operation in operations:
+          if len(operation) == 4:
+            x, y, text, font = operation
+            draw.text((x, y), text, BLACK, font=font)
+          else:
+            x, y, icon = operation
+            image.paste(icon, (x, y))
+      return image
+
+    def testDamage(self):
+      scene = Scene((100, 50), self.glyphs)
+      elements = {
+        'icon': [(0, 0, self.icon)],
+        'temp': [(10, 0, '24C', self.font)],
+        'band': [(0, 20, '~~~~~~~~', self.font), (0, 30, '~~~~', self.font)],
+      }
+      self.assertEqual(len(scene.update(elements)), 3)
+      self.assertEqual(scene.image.tobytes(), self.render(elements).tobytes())
+      self.assertEqual(scene.update(elements), [])
+
+      elements['temp'] = [(10, 0, '25C', self.font)]
+      damage = scene.update(elements)
+      self.assertEqual(damage, [self.glyphs.bbox(self.font, '25C', (10, 0))])
+      self.assertEqual(scene.image.tobytes(), self.render(elements).tobytes())
+
+      # The band overlaps the text, both are drawn again
+      elements['band'] = [(0, 5, '~~~~~~~~~~~~', self.font)]
+      elements['temp'] = [(10, 0, '26C', self.font)]
+      self.assertTrue(scene.update(elements))
+      self.assertEqual(scene.image.tobytes(), self.render(elements).tobytes())
+
+      # Pasting the icon again would erase the text under it outside of the damaged box
+      elements['icon'] = [(0, 0, PIL.Image.new('P', (20, 12), WHITE))]
+      scene.update(elements)
+      self.assertEqual(scene.image.tobytes(), self.render(elements).tobytes())
+      elements['band'] = [(0, 5, '~~~~~~~~~~~', self.font)]
+      scene.update(elements)
+      self.assertEqual(scene.image.tobytes(), self.render(elements).tobytes())
+
+      del elements['icon']
+      self.assertEqual(scene.update(elements)[0][:2], (0, 0))
+      self.assertEqual(scene.image.tobytes(), self.render(elements).tobytes())
+
+    def testMergeBoxes(self):
+      self.assertEqual(merge_boxes([(0, 0, 10, 10), (20, 0, 30, 10), (5, 5, 25, 8)]), [(0, 0, 30, 10)])
+      self.assertEqual(merge_boxes([(0, 0, 10, 10), (10, 0, 20, 10)]), [(0, 0, 10, 10), (10, 0, 20, 10)])
+
+  unittest.main()
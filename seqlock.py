@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import contextlib
+import struct
+
+# The sequence of a memory mapped file with one writer and any number of readers.
+# The writer makes the sequence odd while it updates the data, readers retry until they
+# see the same even sequence before and after copying the data.
+SEQUENCE_FORMAT = '<Q'
+SEQUENCE_SIZE = struct.calcsize(SEQUENCE_FORMAT)
+READ_RETRIES = 100
+
+
+class SeqLock:
+  def __init__(self, buffer, offset, path):
+    # The sequence is at offset in buffer, path only names the file in errors
+    self._buffer = buffer
+    self._offset = offset
+    self._path = path
+
+  @property
+  def sequence(self):
+    return struct.unpack_from(SEQUENCE_FORMAT, self._buffer, self._offset)[0]
+
+  def _set(self, sequence):
+    struct.pack_into(SEQUENCE_FORMAT, self._buffer, self._offset, sequence)
+
+  def recover(self):
+    # A writer stopping in the middle of an update leaves the sequence odd, the writer opening
+    # the file makes it even again, or readers would take the data at rest for being written
+    # and the other way around. Returns True if the sequence was odd.
+    sequence = self.sequence
+    if not sequence & 1:
+      return False
+    self._set(sequence + 1)
+    return True
+
+  @contextlib.contextmanager
+  def write(self):
+    sequence = self.sequence
+    self._set(sequence + 1)
+    yield
+    self._set(sequence + 2)
+
+  def read(self, copy):
+    # Returns copy() of a consistent snapshot, copy must not return views of the data
+    for _ in range(READ_RETRIES):
+      sequence = self.sequence
+      if sequence & 1:
+        continue
+      data = copy()
+      if self.sequence == sequence:
+        return data
+    raise RuntimeError(f'Could not read a consistent snapshot of {self._path}')
+
+
+if __name__ == "__main__":
+  import unittest
+
+  class SeqLockTest(unittest.TestCase):
+    def setUp(self):
+      self._buffer = bytearray(4 + SEQUENCE_SIZE + 4)
+      self._lock = SeqLock(self._buffer, 4, 'test')
+
+    def testWrite(self):
+      with self._lock.write():
+        self.assertEqual(self._lock.sequence, 1)
+        self._buffer[-4:] = b'data'
+      self.assertEqual(self._lock.sequence, 2)
+      self.assertEqual(self._lock.read(lambda: bytes(self._buffer[-4:])), b'data')
+      self.assertEqual(self._buffer[:4], bytes(4))
+
+    def testWriting(self):
+      with self._lock.write():
+        with self.assertRaises(RuntimeError):
+          self._lock.read(lambda: bytes(self._buffer[-4:]))
+
+    def testChanged(self):
+      copies = []
+      def copy():
+        # The writer changes the data during the first copy
+        copies.append(len(copies))
+        if len(copies) == 1:
+          with self._lock.write():
+            pass
+        return copies[-1]
+      self.assertEqual(self._lock.read(copy), 1)
+
+    def testRecover(self):
+      self.assertFalse(self._lock.recover())
+      struct.pack_into(SEQUENCE_FORMAT, self._buffer, 4, 5)
+      self.assertTrue(self._lock.recover())
+      self.assertEqual(self._lock.sequence, 6)
+      with self._lock.write():
+        self.assertEqual(self._lock.sequence, 7)
+      self.assertEqual(self._lock.sequence, 8)
+
+  unittest.main()
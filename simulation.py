@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import datetime
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+SOUND_SPEED = 343000  # 343000 mm/s
+
+# Probes named like the ones of the monitor, so its device names apply
+TEMPERATURES = {
+  '28-012115d1f634': 27.0,  # Air
+  '28-012114259884': 24.5,  # Water
+}
+DISTANCE = 80          # mm from the sensor to the water
+ECHO_LATENCY = 0.0005  # 500us from the trigger to the rising edge of the echo
+ECHO_JITTER = 0.0001   # 100us standard deviation of the latency
+LAMP_HOURS = (8, 20)   # UV lamp on from 8:00 to 20:00
+
+
+class SimulatedW1Bus:
+  # A sysfs like tree of DS18B20 devices in a temporary folder, the temperatures drift
+  # randomly every period seconds
+  def __init__(self, temperatures=TEMPERATURES, period=1.0, drift=0.05):
+    self._dir = tempfile.mkdtemp(prefix='w1_devices_')
+    self._period = period
+    self._drift = drift
+    self._temperatures = {}
+    self._lock = threading.Lock()
+    self._stop_event = threading.Event()
+    self._thread = None
+    os.mkdir(os.path.join(self._dir, 'w1_bus_master1'))
+    self._write(os.path.join(self._dir, 'w1_bus_master1', 'therm_bulk_read'), '0')
+    for device_id, temperature in temperatures.items():
+      self.add_device(device_id, temperature)
+
+  @property
+  def base_dir(self):
+    return self._dir + '/'
+
+  def _write(self, path, data):
+    # Replaced at once, a reader never sees a partial value
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      f.write(f'{data}\n')
+    os.replace(tmp_path, path)
+
+  def add_device(self, device_id, temperature):
+    folder = os.path.join(self._dir, device_id)
+    os.mkdir(folder)
+    self._write(os.path.join(folder, 'name'), device_id)
+    self._write(os.path.join(folder, 'resolution'), '12')
+    self._write(os.path.join(folder, 'conv_time'), '750')
+    self.set_temperature(device_id, temperature)
+
+  def remove_device(self, device_id):
+    with self._lock:
+      self._temperatures.pop(device_id, None)
+    shutil.rmtree(os.path.join(self._dir, device_id), ignore_errors=True)
+
+  def set_temperature(self, device_id, temperature):
+    with self._lock:
+      self._temperatures[device_id] = temperature
+      self._write(os.path.join(self._dir, device_id, 'temperature'), round(temperature * 1000))
+
+  def _drift_loop(self):
+    while not self._stop_event.wait(self._period):
+      for device_id, temperature in list(self._temperatures.items()):
+        self.set_temperature(device_id, temperature + random.uniform(-self._drift, self._drift))
+
+  def start(self):
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._drift_loop, name='Simulated 1-Wire Bus', daemon=True)
+      self._thread.start()
+
+  def close(self):
+    if self._thread is not None:
+      self._stop_event.set()
+      self._thread.join()
+      self._thread = None
+    shutil.rmtree(self._dir, ignore_errors=True)
+
+
+class SimulatedGPIO:
+  # The subset of RPi.GPIO used by hc_sr04. A falling edge on the trigger pin produces
+  # an echo pulse on the echo pin as long as the sound takes to the water and back.
+  BCM = 11
+  BOARD = 10
+  OUT = 0
+  IN = 1
+  LOW = 0
+  HIGH = 1
+  RISING = 31
+  FALLING = 32
+  BOTH = 33
+
+  def __init__(self, trigger_pin=23, echo_pin=24, distance=DISTANCE, latency=ECHO_LATENCY, jitter=ECHO_JITTER, stray_rate=0.0):
+    self.trigger_pin = trigger_pin
+    self.echo_pin = echo_pin
+    self.distance = distance
+    self.latency = latency
+    self.jitter = jitter
+    self.stray_rate = stray_rate  # fraction of echoes returning from a random distance
+    self.mode = None
+    self._levels = {}
+    self._callbacks = {}
+
+  def setmode(self, mode):
+    self.mode = mode
+
+  def setup(self, pin, direction):
+    self._levels.setdefault(pin, self.LOW)
+
+  def output(self, pin, value):
+    previous = self._levels.get(pin, self.LOW)
+    self._levels[pin] = self.HIGH if value else self.LOW
+    if pin == self.trigger_pin and previous and not value:
+      self._echo()
+
+  def input(self, pin):
+    return self._levels.get(pin, self.LOW)
+
+  def add_event_detect(self, pin, edge, callback=None):
+    self._callbacks[pin] = callback
+
+  def remove_event_detect(self, pin):
+    self._callbacks.pop(pin, None)
+
+  def cleanup(self):
+    self._callbacks.clear()
+    self._levels.clear()
+
+  def _edge(self, level):
+    self._levels[self.echo_pin] = level
+    callback = self._callbacks.get(self.echo_pin)
+    if callback:
+      callback(self.echo_pin)
+
+  def _pulse(self, width):
+    # Spin instead of sleeping, the echo is shorter than the scheduling latency of a sleep
+    end = time.perf_counter() + width
+    self._edge(self.HIGH)
+    while time.perf_counter() < end:
+      pass
+    self._edge(self.LOW)
+
+  def _echo(self):
+    distance = self.distance
+    if random.random() < self.stray_rate:
+      distance = random.uniform(20, 4000)
+    delay = max(0.0, random.gauss(self.latency, self.jitter))
+    timer = threading.Timer(delay, self._pulse, (distance * 2 / SOUND_SPEED,))
+    timer.daemon = True
+    timer.start()
+
+
+class SimulatedUVSensor:
+  # Stands in for adafruit_veml6075.VEML6075, bright while the lamp is on
+  def __init__(self, integration_time=100, lamp_hours=LAMP_HOURS, uva=300.0, uvb=400.0, read_latency=0.002):
+    self.integration_time = integration_time
+    self.lamp_hours = lamp_hours
+    self.uva = uva
+    self.uvb = uvb
+    self.read_latency = read_latency
+
+  @property
+  def lamp_on(self):
+    on, off = self.lamp_hours
+    return on <= datetime.datetime.now().hour < off
+
+  @property
+  def uv_data(self):
+    time.sleep(self.read_latency)
+    # The counts grow with the integration time like the real sensor
+    scale = self.integration_time / 100 if self.lamp_on else 0.0
+    uva = max(0.0, random.gauss(self.uva, self.uva * 0.02) * scale)
+    uvb = max(0.0, random.gauss(self.uvb, self.uvb * 0.02) * scale)
+    uv_index = (uva * 0.001461 + uvb * 0.002591) / 2
+    return uva, uvb, uv_index
+
+  @property
+  def uv_index(self):
+    return self.uv_data[2]
+
+
+class MemoryInkyDisplay:
+  # Stands in for inky.phat.InkyPHAT, keeps the last shown image in memory
+  WIDTH = 212
+  HEIGHT = 104
+
+  def __init__(self, refresh_time=0.0):
+    self.h_flip = False
+    self.v_flip = False
+    self.refresh_time = refresh_time  # the real panel takes seconds
+    self.image = None
+    self.refreshes = 0
+    self._pending = None
+
+  def set_image(self, image):
+    self._pending = image.copy()
+
+  def show(self):
+    if self.refresh_time:
+      time.sleep(self.refresh_time)
+    self.image = self._pending
+    self.refreshes += 1
+
+
+class Simulation:
+  # hal backend with every device simulated
+  def __init__(self, temperatures=TEMPERATURES, distance=DISTANCE, echo_latency=ECHO_LATENCY, echo_jitter=ECHO_JITTER,
+               display_refresh_time=0.0):
+    self.w1_bus = SimulatedW1Bus(temperatures)
+    self.gpio_module = SimulatedGPIO(distance=distance, latency=echo_latency, jitter=echo_jitter)
+    self.display = MemoryInkyDisplay(display_refresh_time)
+    logging.info(f'Simulated 1-Wire devices in {self.w1_bus.base_dir}')
+
+  def gpio(self):
+    return self.gpio_module
+
+  def w1_base_dir(self):
+    self.w1_bus.start()
+    return self.w1_bus.base_dir
+
+  def uv_sensor(self, integration_time):
+    return SimulatedUVSensor(integration_time)
+
+  def eink_display(self):
+    return self.display
+
+  def close(self):
+    self.w1_bus.close()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import logging
+import math
+import os
+import struct
+import threading
+
+# File layout: a fixed header followed by fixed size records appended at the end.
+#   header: magic, version, record size, offset of the first record not yet replayed
+#   record: width doubles, a timestamp followed by one double per value by default, NaN stands for NULL
+MAGIC = b'TMSP'
+VERSION = 1
+HEADER_FORMAT = '<4sHHQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_WIDTH = 6
+
+
+class Spool:
+  def __init__(self, path, width=RECORD_WIDTH):
+    self._path = path
+    self._lock = threading.Lock()
+    self._record_format = f'<{width}d'
+    self._record_size = struct.calcsize(self._record_format)
+    new = not os.path.exists(path) or os.path.getsize(path) < HEADER_SIZE
+    self._file = open(path, 'w+b' if new else 'r+b')
+    if new:
+      self._read_offset = HEADER_SIZE
+      self._write_header()
+    else:
+      magic, version, record_size, self._read_offset = struct.unpack(HEADER_FORMAT, self._file.read(HEADER_SIZE))
+      if magic != MAGIC or version != VERSION or record_size != self._record_size:
+        raise ValueError(f'{path} is not a version {VERSION} spool file of {width} values')
+    self._end = self._record_end()
+    if self._end > self._read_offset:
+      logging.info(f'Spool {path} has {len(self)} entries to replay')
+
+  @property
+  def path(self):
+    return self._path
+
+  def __len__(self):
+    return (self._end - self._read_offset) // self._record_size
+
+  def _record_end(self):
+    # Ignore a partial record left behind by an interrupted append
+    size = self._file.seek(0, os.SEEK_END)
+    return HEADER_SIZE + (size - HEADER_SIZE) // self._record_size * self._record_size
+
+  def _write_header(self):
+    self._file.seek(0)
+    self._file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, self._record_size, self._read_offset))
+    self._file.flush()
+
+  def append(self, rows):
+    data = b''.join(
+        struct.pack(self._record_format, *(math.nan if value is None else value for value in row))
+        for row in rows)
+    with self._lock:
+      self._file.seek(self._end)
+      self._file.write(data)
+      self._file.flush()
+      os.fsync(self._file.fileno())
+      self._end += len(data)
+
+  def peek(self, count):
+    with self._lock:
+      self._file.seek(self._read_offset)
+      data = self._file.read(min(count, len(self)) * self._record_size)
+    return [tuple(None if math.isnan(value) else value for value in record)
+            for record in struct.iter_unpack(self._record_format, data)]
+
+  def consume(self, count):
+    with self._lock:
+      self._read_offset = min(self._read_offset + count * self._record_size, self._end)
+      if self._read_offset == self._end:
+        # Everything has been replayed, start over with an empty file
+        self._file.truncate(HEADER_SIZE)
+        self._read_offset = self._end = HEADER_SIZE
+      self._write_header()
+
+  def close(self):
+    with self._lock:
+      self._file.close()
+
+
+if __name__ == "__main__":
+  import tempfile
+  import unittest
+
+  class SpoolTest(unittest.TestCase):
+    def setUp(self):
+      self._dir = tempfile.TemporaryDirectory()
+      self._path = os.path.join(self._dir.name, 'test.spool')
+
+    def tearDown(self):
+      self._dir.cleanup()
+
+    def testAppendConsume(self):
+      spool = Spool(self._path)
+      self.assertEqual(len(spool), 0)
+      spool.append([(1.0, 27.5, 24.0, 100.0, 125.0, 70.0), (2.0, None, 24.5, 0.0, 0.0, 71.0)])
+      self.assertEqual(len(spool), 2)
+      self.assertEqual(spool.peek(10), [(1.0, 27.5, 24.0, 100.0, 125.0, 70.0), (2.0, None, 24.5, 0.0, 0.0, 71.0)])
+      spool.consume(1)
+      self.assertEqual(len(spool), 1)
+      self.assertEqual(spool.peek(10), [(2.0, None, 24.5, 0.0, 0.0, 71.0)])
+      spool.consume(1)
+      self.assertEqual(len(spool), 0)
+      self.assertEqual(os.path.getsize(self._path), HEADER_SIZE)
+      spool.close()
+
+    def testReopen(self):
+      spool = Spool(self._path)
+      spool.append([(float(i), 1.0, 2.0, 3.0, 4.0, 5.0) for i in range(5)])
+      spool.consume(2)
+      spool.close()
+      with open(self._path, 'ab') as f:
+        f.write(b'torn')
+      spool = Spool(self._path)
+      self.assertEqual(len(spool), 3)
+      self.assertEqual(spool.peek(1), [(2.0, 1.0, 2.0, 3.0, 4.0, 5.0)])
+      spool.append([(5.0, 1.0, 2.0, 3.0, 4.0, 5.0)])
+      self.assertEqual(spool.peek(10)[-1], (5.0, 1.0, 2.0, 3.0, 4.0, 5.0))
+      spool.close()
+
+    def testWidth(self):
+      spool = Spool(self._path, width=3)
+      spool.append([(1.0, None, 3.0)])
+      spool.close()
+      self.assertRaises(ValueError, Spool, self._path)
+      spool = Spool(self._path, width=3)
+      self.assertEqual(spool.peek(10), [(1.0, None, 3.0)])
+      spool.close()
+
+  unittest.main()
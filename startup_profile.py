@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+import contextlib
+import sys
+import time
+
+FLAG = '--profile-startup'
+REPORT_IMPORTS = 15
+
+
+class _TimingLoader:
+  # Wraps the loader of a module to time its execution, nested imports included
+  def __init__(self, profile, loader):
+    self._profile = profile
+    self._loader = loader
+
+  def __getattr__(self, name):
+    return getattr(self._loader, name)
+
+  def create_module(self, spec):
+    return self._loader.create_module(spec)
+
+  def exec_module(self, module):
+    profile = self._profile
+    begin = time.perf_counter()
+    profile._stack.append(0.0)
+    try:
+      self._loader.exec_module(module)
+    finally:
+      elapsed = time.perf_counter() - begin
+      nested = profile._stack.pop()
+      if profile._stack:
+        profile._stack[-1] += elapsed
+      profile._imports.append((module.__name__, elapsed, elapsed - nested, len(profile._stack)))
+
+
+class _TimingFinder:
+  # First of sys.meta_path, finds the module with the other finders and wraps its loader
+  def __init__(self, profile):
+    self._profile = profile
+
+  def find_spec(self, fullname, path=None, target=None):
+    for finder in sys.meta_path:
+      if finder is self or not hasattr(finder, 'find_spec'):
+        continue
+      spec = finder.find_spec(fullname, path, target)
+      if spec is not None:
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+          spec.loader = _TimingLoader(self._profile, spec.loader)
+        return spec
+    return None
+
+
+class StartupProfile:
+  # Time spent in every import and init step from the creation of the profile,
+  # and when milestones like the first sample are reached
+  def __init__(self):
+    self._begin = time.perf_counter()
+    self._finder = None
+    self._stack = []
+    self._imports = []
+    self._steps = []
+    self._marks = []
+
+  def install(self):
+    if self._finder is None:
+      self._finder = _TimingFinder(self)
+      sys.meta_path.insert(0, self._finder)
+
+  def uninstall(self):
+    if self._finder is not None:
+      sys.meta_path.remove(self._finder)
+      self._finder = None
+
+  @property
+  def elapsed(self):
+    return time.perf_counter() - self._begin
+
+  @contextlib.contextmanager
+  def step(self, name):
+    begin = time.perf_counter()
+    try:
+      yield
+    finally:
+      self._steps.append((name, time.perf_counter() - begin))
+
+  def mark(self, name):
+    self._marks.append((name, self.elapsed))
+
+  def report(self, imports=REPORT_IMPORTS):
+    lines = [f'Startup profile, {self.elapsed:.3f}s since start']
+    top_level = [entry for entry in self._imports if entry[3] == 0]
+    lines.append(f'  imports: {sum(entry[1] for entry in top_level):.3f}s for {len(self._imports)} modules, slowest by own time:')
+    for name, elapsed, own, _ in sorted(self._imports, key=lambda entry: entry[2], reverse=True)[:imports]:
+      lines.append(f'    {own:7.3f}s own {elapsed:7.3f}s total  {name}')
+    lines.append('  steps:')
+    for name, elapsed in self._steps:
+      lines.append(f'    {elapsed:7.3f}s  {name}')
+    lines.append('  milestones:')
+    for name, elapsed in self._marks:
+      lines.append(f'    {elapsed:7.3f}s  {name}')
+    return '\n'.join(lines)
+
+
+_profile = None
+
+
+def profile():
+  # The profile started by start(), None if the startup is not profiled
+  return _profile
+
+
+def start(argv=None):
+  # Starts profiling if FLAG is on the command line. Called before the other imports of
+  # the main module so they are profiled too.
+  global _profile
+  # FLAG takes no value, it is a store_true argument of the main module
+  if _profile is None and FLAG in (sys.argv if argv is None else argv):
+    _profile = StartupProfile()
+    _profile.install()
+  return _profile
+
+
+if __name__ == "__main__":
+  import unittest
+
+  class StartupProfileTest(unittest.TestCase):
+    def testProfile(self):
+      profile = StartupProfile()
+      profile.install()
+      try:
+        sys.modules.pop('json', None)
+        sys.modules.pop('json.decoder', None)
+        sys.modules.pop('json.scanner', None)
+        sys.modules.pop('json.encoder', None)
+        import json
+      finally:
+        profile.uninstall()
+      self.assertNotIn(profile._finder, sys.meta_path)
+      with profile.step('sleep'):
+        time.sleep(0.01)
+      profile.mark('done')
+      names = {entry[0]: entry for entry in profile._imports}
+      self.assertIn('json', names)
+      self.assertIn('json.decoder', names)
+      self.assertEqual(names['json'][3], 0)
+      self.assertGreater(names['json.decoder'][3], 0)
+      self.assertGreaterEqual(names['json'][1], names['json.decoder'][1])
+      report = profile.report()
+      self.assertIn('json', report)
+      self.assertIn('sleep', report)
+      self.assertIn('done', report)
+
+    def testStart(self):
+      self.assertIsNone(start(['turtle_monitor.py', '--profile-startupx']))
+      self.assertIsNone(profile())
+
+  unittest.main()
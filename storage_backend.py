@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+
+import logging
+import rollup
+
+MYSQL_OPTION_FILE = '/home/pi/.my.cnf'
+SQLITE_PATH = '/home/pi/turtle_monitor.db'
+MYSQL_POOL_NAME = 'turtle_monitor'
+MYSQL_CONNECTION_TIMEOUT = 10  # 10s
+
+
+# Value columns of the environment table, in the order DataStore passes them
+COLUMNS = ('air_temp', 'water_temp', 'uva', 'uvb', 'water_dist')
+
+ROLLUP_COLUMNS = tuple(f'{column}_{stat}' for column in COLUMNS for stat in rollup.STATS)
+
+
+def rollup_table(level):
+  return f'environment_{level}'
+
+def _rollup_column_type(column, value_type):
+  return 'INTEGER' if column.endswith('_count') else value_type
+
+def _rollup_create_statement(level, ts_type, value_type, primary_key):
+  columns = ',\n'.join(f'  {column} {_rollup_column_type(column, value_type)}' for column in ROLLUP_COLUMNS)
+  return f"""
+CREATE TABLE IF NOT EXISTS {rollup_table(level)} (
+  ts {ts_type} NOT NULL,
+  samples INTEGER NOT NULL,
+{columns},
+  {primary_key}
+);
+"""
+
+def _rollup_migration(level, existing, value_type):
+  # Statements adding the rollup columns missing from a table created by an older version. The rows
+  # already stored did not count their values, a mean is taken as over all the samples of its row.
+  statements = []
+  for column in ROLLUP_COLUMNS:
+    if column in existing:
+      continue
+    statements.append(f'ALTER TABLE {rollup_table(level)} ADD COLUMN {column} {_rollup_column_type(column, value_type)}')
+    if column.endswith('_count'):
+      mean = column[:-len('_count')] + '_mean'
+      statements.append(f'UPDATE {rollup_table(level)} SET {column} = CASE WHEN {mean} IS NULL THEN 0 ELSE samples END')
+  return statements
+
+def _rollup_merge(column, old, new, least, greatest):
+  # Merge a partial rollup row into the stored one, a NULL on either side keeps the other side
+  if column.endswith('_min'):
+    return f'{column} = {least}(COALESCE({old(column)}, {new(column)}), COALESCE({new(column)}, {old(column)}))'
+  if column.endswith('_max'):
+    return f'{column} = {greatest}(COALESCE({old(column)}, {new(column)}), COALESCE({new(column)}, {old(column)}))'
+  if column.endswith('_count'):
+    return f'{column} = COALESCE({old(column)}, 0) + COALESCE({new(column)}, 0)'
+  # Each mean is weighted by the number of values it is over, not by the samples of its row
+  count = column[:-len('_mean')] + '_count'
+  return (f'{column} = COALESCE(({old(column)} * {old(count)} + {new(column)} * {new(count)})'
+          f' / ({old(count)} + {new(count)}), {old(column)}, {new(column)})')
+
+
+class StorageError(Exception):
+  pass
+
+
+class StorageConnectionError(StorageError):
+  # The database can not be reached, retrying later may succeed
+  pass
+
+
+class MySQLBackend:
+  name = 'mysql'
+
+  CREATE_STATEMENT = """
+CREATE TABLE IF NOT EXISTS environment (
+  id INTEGER UNSIGNED NOT NULL AUTO_INCREMENT,
+  ts TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  air_temp DECIMAL(3,1),
+  water_temp DECIMAL(3,1),
+  uva DECIMAL(4) UNSIGNED,
+  uvb DECIMAL(4) UNSIGNED,
+  water_dist DECIMAL(3) UNSIGNED,
+  PRIMARY KEY (id)
+);
+"""
+
+  INDEX_STATEMENT = 'CREATE INDEX IF NOT EXISTS environment_ts ON environment (ts)'
+
+  INSERT_STATEMENT = 'INSERT INTO environment (ts, air_temp, water_temp, uva, uvb, water_dist) VALUES (FROM_UNIXTIME(%s), %s, %s, %s, %s, %s)'
+
+  SELECT_STATEMENT = 'SELECT UNIX_TIMESTAMP(ts), {columns} FROM {table} WHERE ts >= FROM_UNIXTIME(%s) AND ts < FROM_UNIXTIME(%s) ORDER BY ts'
+
+  # DATETIME, a TIMESTAMP column may be silently updated to the current time by the upsert
+  ROLLUP_CREATE_STATEMENTS = {
+    level: _rollup_create_statement(level, 'DATETIME', 'FLOAT', 'PRIMARY KEY (ts)')
+    for level in rollup.LEVELS
+  }
+
+  # MySQL assigns the columns from left to right, the means have to be merged before their counts
+  ROLLUP_UPSERT_STATEMENTS = {
+    level: (f'INSERT INTO {rollup_table(level)} (ts, samples, {", ".join(ROLLUP_COLUMNS)}) '
+            f'VALUES (FROM_UNIXTIME(%s), %s{", %s" * len(ROLLUP_COLUMNS)}) ON DUPLICATE KEY UPDATE '
+            + ', '.join(_rollup_merge(column, lambda c: c, lambda c: f'VALUES({c})', 'LEAST', 'GREATEST')
+                        for column in ROLLUP_COLUMNS)
+            + ', samples = samples + VALUES(samples)')
+    for level in rollup.LEVELS
+  }
+
+  def __init__(self, option_file=MYSQL_OPTION_FILE, pool_size=None):
+    # Imported here so the other backends work without the MySQL connector installed
+    import mysql.connector
+    self._mysql = mysql.connector
+    self._connect_args = {
+      'read_default_file': option_file,
+      'connection_timeout': MYSQL_CONNECTION_TIMEOUT,
+    }
+    if pool_size:
+      # Closing a pooled connection hands it back to the pool, the pool checks it on reuse
+      self._connect_args.update(pool_name=MYSQL_POOL_NAME, pool_size=pool_size)
+    self._connection = None
+    self._cursor = None
+
+  def _translate(self, e):
+    if isinstance(e, (self._mysql.InterfaceError, self._mysql.OperationalError)):
+      return StorageConnectionError(str(e))
+    return StorageError(str(e))
+
+  def connect(self):
+    try:
+      self._connection = self._mysql.connect(**self._connect_args)
+      self._cursor = self._connection.cursor()
+      self._cursor.execute(self.CREATE_STATEMENT)
+      self._cursor.execute(self.INDEX_STATEMENT)
+      for level, statement in self.ROLLUP_CREATE_STATEMENTS.items():
+        self._cursor.execute(statement)
+        self._cursor.execute(f'SHOW COLUMNS FROM {rollup_table(level)}')
+        existing = {row[0] for row in self._cursor.fetchall()}
+        for migration in _rollup_migration(level, existing, 'FLOAT'):
+          self._cursor.execute(migration)
+      self._connection.commit()
+    except self._mysql.Error as e:
+      self._connection = None
+      raise self._translate(e) from e
+
+  def insert(self, rows, rollups=None):
+    # rollups are partial rollup rows per level, merged into the rollup tables in the same transaction
+    try:
+      self._cursor.executemany(self.INSERT_STATEMENT, rows)
+      for level, rollup_rows in (rollups or {}).items():
+        for row in rollup_rows:
+          self._cursor.execute(self.ROLLUP_UPSERT_STATEMENTS[level], row)
+      self._connection.commit()
+    except self._mysql.Error as e:
+      try:
+        self._connection.rollback()
+      except self._mysql.Error:
+        pass
+      raise self._translate(e) from e
+
+  def ping(self):
+    try:
+      self._connection.ping(reconnect=False)
+    except self._mysql.Error as e:
+      raise self._translate(e) from e
+
+  def select(self, table, columns, start, end, chunk_size):
+    # Streams the rows in chunks over a dedicated connection. The cursor is unbuffered,
+    # the server sends the rows as they are fetched instead of all at once.
+    try:
+      connection = self._mysql.connect(**self._connect_args)
+    except self._mysql.Error as e:
+      raise self._translate(e) from e
+    try:
+      cursor = connection.cursor(buffered=False)
+      cursor.execute(self.SELECT_STATEMENT.format(table=table, columns=', '.join(columns)), (start, end))
+      while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+          break
+        yield rows
+    except self._mysql.Error as e:
+      raise self._translate(e) from e
+    finally:
+      connection.close()
+
+  def close(self):
+    try:
+      self._connection.close()
+    except self._mysql.Error:
+      pass
+    self._connection = None
+    self._cursor = None
+
+
+class SQLiteBackend:
+  name = 'sqlite'
+
+  CREATE_STATEMENT = """
+CREATE TABLE IF NOT EXISTS environment (
+  id INTEGER PRIMARY KEY,
+  ts REAL NOT NULL,
+  air_temp REAL,
+  water_temp REAL,
+  uva REAL,
+  uvb REAL,
+  water_dist REAL
+);
+CREATE INDEX IF NOT EXISTS environment_ts ON environment (ts);
+"""
+
+  INSERT_STATEMENT = 'INSERT INTO environment (ts, air_temp, water_temp, uva, uvb, water_dist) VALUES (?, ?, ?, ?, ?, ?)'
+
+  SELECT_STATEMENT = 'SELECT ts, {columns} FROM {table} WHERE ts >= ? AND ts < ? ORDER BY ts'
+
+  ROLLUP_CREATE_STATEMENTS = {
+    level: _rollup_create_statement(level, 'REAL', 'REAL', 'PRIMARY KEY (ts)')
+    for level in rollup.LEVELS
+  }
+
+  # SQLite evaluates every assignment against the stored row
+  ROLLUP_UPSERT_STATEMENTS = {
+    level: (f'INSERT INTO {rollup_table(level)} (ts, samples, {", ".join(ROLLUP_COLUMNS)}) '
+            f'VALUES (?, ?{", ?" * len(ROLLUP_COLUMNS)}) ON CONFLICT (ts) DO UPDATE SET '
+            + ', '.join(_rollup_merge(column, lambda c: c, lambda c: f'excluded.{c}', 'MIN', 'MAX')
+                        for column in ROLLUP_COLUMNS)
+            + ', samples = samples + excluded.samples')
+    for level in rollup.LEVELS
+  }
+
+  def __init__(self, path=SQLITE_PATH):
+    import sqlite3
+    self._sqlite3 = sqlite3
+    self._path = path
+    self._connection = None
+
+  def _translate(self, e):
+    # OperationalError covers a locked database or an unavailable file
+    if isinstance(e, self._sqlite3.OperationalError):
+      return StorageConnectionError(str(e))
+    return StorageError(str(e))
+
+  def connect(self):
+    try:
+      # DataStore serializes access, the connection is shared with its service thread
+      self._connection = self._sqlite3.connect(self._path, check_same_thread=False)
+      journal_mode, = self._connection.execute('PRAGMA journal_mode=WAL').fetchone()
+      if journal_mode != 'wal':
+        logging.warning(f'SQLite database {self._path} is not in WAL mode: {journal_mode}')
+      # With WAL, NORMAL only syncs at checkpoints and is still safe from corruption
+      self._connection.execute('PRAGMA synchronous=NORMAL')
+      self._connection.executescript(self.CREATE_STATEMENT)
+      for level, statement in self.ROLLUP_CREATE_STATEMENTS.items():
+        self._connection.executescript(statement)
+        existing = {row[1] for row in self._connection.execute(f'PRAGMA table_info({rollup_table(level)})')}
+        with self._connection:
+          for migration in _rollup_migration(level, existing, 'REAL'):
+            self._connection.execute(migration)
+    except self._sqlite3.Error as e:
+      self._connection = None
+      raise self._translate(e) from e
+
+  def insert(self, rows, rollups=None):
+    # executemany reuses the single prepared statement for the whole batch
+    try:
+      with self._connection:
+        self._connection.executemany(self.INSERT_STATEMENT, rows)
+        for level, rollup_rows in (rollups or {}).items():
+          self._connection.executemany(self.ROLLUP_UPSERT_STATEMENTS[level], rollup_rows)
+    except self._sqlite3.Error as e:
+      raise self._translate(e) from e
+
+  def ping(self):
+    try:
+      self._connection.execute('SELECT 1').fetchone()
+    except self._sqlite3.Error as e:
+      raise self._translate(e) from e
+
+  def select(self, table, columns, start, end, chunk_size):
+    # A dedicated connection, with WAL readers do not block the writer
+    try:
+      connection = self._sqlite3.connect(self._path)
+    except self._sqlite3.Error as e:
+      raise self._translate(e) from e
+    try:
+      cursor = connection.execute(self.SELECT_STATEMENT.format(table=table, columns=', '.join(columns)), (start, end))
+      while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+          break
+        yield rows
+    except self._sqlite3.Error as e:
+      raise self._translate(e) from e
+    finally:
+      connection.close()
+
+  def close(self):
+    try:
+      self._connection.close()
+    except self._sqlite3.Error:
+      pass
+    self._connection = None
+
+
+BACKENDS = {
+  MySQLBackend.name: MySQLBackend,
+  SQLiteBackend.name: SQLiteBackend,
+}
+
+def create(name, mysql_option_file=MYSQL_OPTION_FILE, mysql_pool_size=None, sqlite_path=SQLITE_PATH):
+  if name == MySQLBackend.name:
+    return MySQLBackend(mysql_option_file, mysql_pool_size)
+  if name == SQLiteBackend.name:
+    return SQLiteBackend(sqlite_path)
+  raise ValueError(f'Unknown storage backend {name}, expected one of {", ".join(BACKENDS)}')
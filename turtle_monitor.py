@@ -1,45 +1,82 @@
 #!/usr/bin/env python3
 
-import adafruit_veml6075 as veml6075
-import board
-import busio
+# Started first so the imports below are profiled too
+import startup_profile
+startup_profile.start()
+
+from classproperty import classproperty
 import data_store
 from ds18b20 import fahrenheit, DS18B20
-import fonts.ttf
+import functools
 import glob
+import hal
 from hc_sr04 import UltrasonicSensor
-import inky.phat
+from lazy_import import lazy_import
 import logging
 import math
 import os
-import PIL.Image
-import PIL.ImageDraw
-import PIL.ImageFont
 import random
+import refresh_policy
+import sample_bus
+import sample_ring
+import storage_backend
 import threading
 import time
-from inky_display_service import InkyDisplayService
+from veml6075 import parse_hours, UVSensor
+
+# Only loaded once used, the sensors are sampling before PIL and the display are
+async_runtime = lazy_import('async_runtime')
+compression = lazy_import('compression')
+fonts = lazy_import('fonts')
+lazy_import('fonts.ttf')
+glyph_cache = lazy_import('glyph_cache')
+inky_display_service = lazy_import('inky_display_service')
+PIL = lazy_import('PIL')
+lazy_import('PIL.Image')
+lazy_import('PIL.ImageFont')
+scene = lazy_import('scene')
 
 
 WATER_HIGH_LEVEL = 240
 WATER_LOW_LEVEL = 200
 WATER_MAX_DISTANCE = 300
+SYMBOLA_PATH = '/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf'
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(path, size):
+  return PIL.ImageFont.truetype(path, size)
+
+
+@functools.lru_cache(maxsize=None)
+def load_image(name):
+  # Get the current path
+  PATH = os.path.dirname(__file__)
+  return PIL.Image.open(os.path.join(PATH, f'{name}.png')).resize((24, 24))
 
-random.seed()
 
 class TurtleDisplay:
-  def load_image(name):
-    # Get the current path
-    PATH = os.path.dirname(__file__)
-    return PIL.Image.open(os.path.join(PATH, f'{name}.png')).resize((24, 24))
-
-    # Load the font
-  font = PIL.ImageFont.truetype(fonts.ttf.RobotoMedium, 20)
-  symbola20_font = PIL.ImageFont.truetype('/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf', 20)
-  symbola30_font = PIL.ImageFont.truetype('/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf', 20)
-  symbola40_font = PIL.ImageFont.truetype('/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf', 35)
-  # Load images and icons
-  uv_icon = load_image('UV')
+  # Fonts and icons are loaded by the first display, not when the module is imported
+  @classproperty
+  def font(cls):
+    return load_font(fonts.ttf.RobotoMedium, 20)
+
+  @classproperty
+  def symbola20_font(cls):
+    return load_font(SYMBOLA_PATH, 20)
+
+  @classproperty
+  def symbola30_font(cls):
+    return load_font(SYMBOLA_PATH, 20)
+
+  @classproperty
+  def symbola40_font(cls):
+    return load_font(SYMBOLA_PATH, 35)
+
+  @classproperty
+  def uv_icon(cls):
+    return load_image('UV')
+
   air_icon = '🌡'
   water_wave_icon = '🌊'
   fill_water_icon = '🚰'
@@ -48,19 +85,41 @@ class TurtleDisplay:
   water_tilde_symbols = ' ∼≈≋'
   water_tilde_offsets = [0, 6, 3, 0]
   caption_width_ratio = 0.35
-  water_icon_w, water_icon_h = symbola20_font.getsize(water_tilde_symbols[3])
-  fill_water_w, fill_water_h = symbola20_font.getsize(fill_water_icon)
-  turtle_icon_w, turtle_icon_h = symbola40_font.getsize(turtle_icon)
-  snail_icon_w, snail_icon_h = symbola30_font.getsize(snail_icon)
+  _glyphs = None
 
-  def __init__(self, inky_service):
+  @classproperty
+  def glyphs(cls):
+    # Every text is rasterized once and pasted from then on
+    if TurtleDisplay._glyphs is None:
+      TurtleDisplay._glyphs = glyph_cache.GlyphCache()
+    return TurtleDisplay._glyphs
+
+  def __init__(self, inky_service, rng=None, policy=None):
     self._inky_service = inky_service
-    self._air_temp_str = ''
-    self._water_temp_str = ''
-    self._uv_str = ''
-    self._water_level = -1
+    self._policy = policy if policy is not None else refresh_policy.RefreshPolicy()
+    size = inky_service.size
+    self._scene = scene.Scene(size, self.glyphs)
+    self.water_icon_w, self.water_icon_h = self.glyphs.size(self.symbola20_font, self.water_tilde_symbols[3])
+    self.fill_water_w, self.fill_water_h = self.glyphs.size(self.symbola20_font, self.fill_water_icon)
+    self.turtle_icon_w, self.turtle_icon_h = self.glyphs.size(self.symbola40_font, self.turtle_icon)
+    self.snail_icon_w, self.snail_icon_h = self.glyphs.size(self.symbola30_font, self.snail_icon)
+    # Picked once so the turtle and the snail stay in place from one frame to the next, pass a seeded rng to reproduce them
+    rng = rng if rng is not None else random.Random()
+    self._turtle_offset = rng.randrange(0, 3 * self.turtle_icon_w)
+    snail_space = math.ceil(self.snail_icon_w / self.water_icon_w) * self.water_icon_w
+    self._snail_offset = rng.randrange(self.snail_icon_w, max(snail_space, self.snail_icon_w + 1))
+
+  @property
+  def policy(self):
+    return self._policy
 
   def display(self, air_temp, water_temp, uva, uvb, water_distance):
+    values = self._policy.update({'air_temp': air_temp, 'water_temp': water_temp, 'uva': uva, 'uvb': uvb,
+                                  'water_distance': water_distance})
+    if values is None:
+      return
+    air_temp, water_temp, uva, uvb, water_distance = (values['air_temp'], values['water_temp'], values['uva'], values['uvb'],
+                                                      values['water_distance'])
     water_depth = WATER_MAX_DISTANCE - water_distance
     water_level = max(min(17, round((water_depth - WATER_LOW_LEVEL) * 17/(WATER_HIGH_LEVEL - WATER_LOW_LEVEL))), 0)
 
@@ -69,145 +128,233 @@ class TurtleDisplay:
     uv_str = f': {round(uva)}(A) {round(uvb)}(B)'
     logging.debug(f'uv: {uv_str}; air: {air_temp_str}; water: {water_temp_str}; water_level: {water_level}')
 
-    if (air_temp_str != self._air_temp_str or water_temp_str != self._water_temp_str
-        or uv_str != self._uv_str or water_level != self._water_level):
-      self._air_temp_str = air_temp_str
-      self._water_temp_str = water_temp_str
-      self._uv_str = uv_str
-      self._water_level = water_level
-
+    # Only the elements whose text or position changed are drawn again
+    damage = self._scene.update(self._elements(air_temp_str, water_temp_str, uv_str, water_level))
+    if damage:
       canvas = self._inky_service.get_canvas()
-      img = canvas.image
-      draw = canvas.draw
-
-      icon_w, icon_h = self.uv_icon.size
-      w, h = self.font.getsize('UV')
-      x = int(canvas.width * self.caption_width_ratio - w)
-      x = 28
-      y = 4
-      img.paste(self.uv_icon, (x - icon_w - 2, y))
-      draw.text((x, y), uv_str, inky.BLACK, font=self.font)
-      w, h = self.font.getsize(uv_str)
-      uv_right, uv_bottom = x + w, y + h
-
-      icon_w, icon_h = self.symbola20_font.getsize(self.air_icon)
-      w, h = self.font.getsize('Air')
-      x = int(canvas.width * self.caption_width_ratio - w)
-      x = 28
-      y = int(canvas.height / 2 - h - 5)
-      draw.text((x, y), air_temp_str, inky.BLACK, font=self.font)
-      draw.text((x - icon_w - 2, y), self.air_icon, inky.BLACK, font=self.symbola20_font)
-
-      icon_w, icon_h = self.symbola20_font.getsize(self.water_wave_icon)
-      w, h = self.font.getsize('Water')
-      x = int(canvas.width * self.caption_width_ratio - w)
-      x = 28
-      y = int(canvas.height / 2 + 5)
-      draw.text((x, y), water_temp_str, inky.BLACK, font=self.font)
-      draw.text((x - icon_w - 2, y), self.water_wave_icon, inky.BLACK, font=self.symbola20_font)
-      w, h = self.font.getsize(water_temp_str)
-      wt_right, wt_bottom = x + w, y + h
-
-      y += h + 2
-      x = 0
-
-      left = x
-      draw_turtle = True
-      draw_snail = True
-      while water_level >= 0:
-        water_tilde_symbol = self.water_tilde_symbols[min(3, water_level)]
-        water_tilde_offset = self.water_tilde_offsets[min(3, water_level)]
-        if draw_turtle:
-          turtle_offset = random.randrange(0, 3 * self.turtle_icon_w)
-          turtle_x = canvas.width / 2 - turtle_offset
-          turtle_y = canvas.height - self.turtle_icon_h
-          water_str = water_tilde_symbol * math.floor(turtle_x / self.water_icon_w)
-          draw.text((x, y + water_tilde_offset), water_str, inky.BLACK, font=self.symbola20_font)
-          draw.text((turtle_x, turtle_y), self.turtle_icon, inky.BLACK, font=self.symbola40_font)
-          left = max(left, turtle_x + self.turtle_icon_w)
-          draw_turtle = False
-
-        if (y < wt_bottom):
-          left = max(left, wt_right)
-        if (y < uv_bottom):
-          left = max(left, uv_right)
-        num = math.ceil((left - x)/self.water_icon_w)
-        remain = 13 - num
-        if draw_snail:
-          reduce = math.ceil(self.snail_icon_w/self.water_icon_w)
-          remain -= reduce
-          space = reduce * self.water_icon_w
-          offset = random.randrange(self.snail_icon_w, space)
-          draw.text((canvas.width - offset, canvas.height - self.snail_icon_h), self.snail_icon, inky.BLACK, font=self.symbola30_font)
-          draw_snail = False
-        draw.text((x + self.water_icon_w * num, y + water_tilde_offset), water_tilde_symbol * remain, inky.BLACK, font=self.symbola20_font)
-        water_level -= 3
-        y -= (self.water_icon_h - 4)
-
-      logging.debug(f'Update display')
-      self._inky_service.display(canvas)
-
-
-def main():
-  device_names = {
-    '28-012115d1f634': 'Air',
-    '28-012114259884': 'Water',
+      canvas.image.paste(self._scene.image)
+      logging.debug(f'Update display, damaged {damage}, {self._policy.suppressed} refreshes held back so far')
+      self._inky_service.display(canvas, damage)
+    else:
+      # The rounded texts and the water level are the same, the panel is not refreshed
+      self._policy.discard()
+
+  def _elements(self, air_temp_str, water_temp_str, uv_str, water_level):
+    # {name: drawing operations} of the scene, see scene.Scene
+    width, height = self._scene.size
+    elements = {}
+
+    icon_w, icon_h = self.uv_icon.size
+    x = 28
+    y = 4
+    elements['uv_icon'] = [(x - icon_w - 2, y, self.uv_icon)]
+    elements['uv'] = [(x, y, uv_str, self.font)]
+    w, h = self.glyphs.size(self.font, uv_str)
+    uv_right, uv_bottom = x + w, y + h
+
+    icon_w, icon_h = self.glyphs.size(self.symbola20_font, self.air_icon)
+    w, h = self.glyphs.size(self.font, 'Air')
+    y = int(height / 2 - h - 5)
+    elements['air'] = [(x, y, air_temp_str, self.font)]
+    elements['air_icon'] = [(x - icon_w - 2, y, self.air_icon, self.symbola20_font)]
+
+    icon_w, icon_h = self.glyphs.size(self.symbola20_font, self.water_wave_icon)
+    w, h = self.glyphs.size(self.font, 'Water')
+    y = int(height / 2 + 5)
+    elements['water'] = [(x, y, water_temp_str, self.font)]
+    elements['water_icon'] = [(x - icon_w - 2, y, self.water_wave_icon, self.symbola20_font)]
+    w, h = self.glyphs.size(self.font, water_temp_str)
+    wt_right, wt_bottom = x + w, y + h
+
+    y += h + 2
+    x = 0
+
+    # The water band goes around the texts, the turtle and the snail, in rows from the bottom up
+    band = []
+    left = x
+    draw_turtle = True
+    draw_snail = True
+    while water_level >= 0:
+      water_tilde_symbol = self.water_tilde_symbols[min(3, water_level)]
+      water_tilde_offset = self.water_tilde_offsets[min(3, water_level)]
+      if draw_turtle:
+        turtle_x = width / 2 - self._turtle_offset
+        turtle_y = height - self.turtle_icon_h
+        water_str = water_tilde_symbol * math.floor(turtle_x / self.water_icon_w)
+        band.append((x, y + water_tilde_offset, water_str, self.symbola20_font))
+        elements['turtle'] = [(int(turtle_x), turtle_y, self.turtle_icon, self.symbola40_font)]
+        left = max(left, turtle_x + self.turtle_icon_w)
+        draw_turtle = False
+
+      if (y < wt_bottom):
+        left = max(left, wt_right)
+      if (y < uv_bottom):
+        left = max(left, uv_right)
+      num = math.ceil((left - x)/self.water_icon_w)
+      remain = 13 - num
+      if draw_snail:
+        reduce = math.ceil(self.snail_icon_w/self.water_icon_w)
+        remain -= reduce
+        elements['snail'] = [(width - self._snail_offset, height - self.snail_icon_h, self.snail_icon, self.symbola30_font)]
+        draw_snail = False
+      band.append((x + self.water_icon_w * num, y + water_tilde_offset, water_tilde_symbol * remain, self.symbola20_font))
+      water_level -= 3
+      y -= (self.water_icon_h - 4)
+    elements['water_band'] = band
+    return elements
+
+
+DISPLAY_TOPICS = ('air_temp', 'water_temp', 'uva', 'uvb', 'water_dist_average')
+
+THREADS = 'threads'
+ASYNCIO = 'asyncio'
+RUNTIMES = (THREADS, ASYNCIO)
+
+
+def main(storage=storage_backend.MySQLBackend.name, sqlite_path=storage_backend.SQLITE_PATH, compress=False,
+         adaptive_resolution=False, spool_path=data_store.SPOOL_PATH, ring_path=sample_ring.RING_PATH, runtime=THREADS,
+         lamp_hours=None, min_refresh_interval=refresh_policy.MIN_INTERVAL, profile=None):
+  # profile is a startup_profile.StartupProfile to report after the first display refresh, or at
+  # shutdown if there was none
+  device_topics = {
+    '28-012115d1f634': 'air_temp',
+    '28-012114259884': 'water_temp',
   }
 
-  temperatures = {
-  }
-
-  DS18B20.start()
-
-  devices = DS18B20.devices
-
-  inky_service = InkyDisplayService()
-  inky_service.start()
-  turtle_display = TurtleDisplay(inky_service)
-  logging.info('Turtle Monitor started')
-
-  i2c = busio.I2C(board.SCL, board.SDA)
-  
-  ds = data_store.DataStore()
-
-  # Create VEML6075 object using the I2C bus
-  veml = veml6075.VEML6075(i2c, integration_time=100)
-
-  distance_sensor = UltrasonicSensor(measure_period=5)
-  distance_sensor.start()
-  time.sleep(1)
-  
-  try:
-    while True:
-      for dev in devices:
-        device_id = dev.device_id
-        device_name = device_names[device_id]
-        temp_c = dev.temperature
-        temp_f = dev.fahrenheit(temp_c)
-
-        logging.info(f'{device_name:>7}({device_id}): {temp_c}℃ {temp_f}℉')
-        temperatures[device_name] = temp_c
-
-      air_temp = temperatures['Air']
-      water_temp = temperatures['Water']
-
-      uva, uvb, uv_index = veml.uv_data
-      logging.info(f'uva={uva}, uvb={uvb}, uv_index={uv_index}')
-
-      distance = distance_sensor.distance
-      average_distance = distance_sensor.moving_average_distance
-      logging.info("distance: {:>5.0f}mm; moving_average: {:>5.0f}mm".format(distance, average_distance))
-      ds.add_data(air_temp, water_temp, uva, uvb, distance)
-      turtle_display.display(air_temp, water_temp, uva, uvb, average_distance)
-      time.sleep(5)
-  except KeyboardInterrupt:
-    pass
+  # Every sensor publishes at its own rate, storage, display and logging are stages with their own
+  # bounded queue so a slow database or e-ink refresh never delays the acquisition
+  bus = sample_bus.SampleBus()
+  # In the asyncio runtime the sensors, stages and storage flushes are coroutines on one event loop
+  # instead of threads, the inky and database services do not start their own threads either
+  async_mode = runtime == ASYNCIO
+  profile_report = [profile] if profile is not None else []
+  profile = profile or startup_profile.StartupProfile()
+  def log_profile():
+    if profile_report:
+      profile_report.pop().uninstall()
+      logging.info(profile.report())
+  with profile.step('runtime'):
+    rt = async_runtime.AsyncRuntime(bus) if async_mode else None
+
+  with profile.step('storage'):
+    compressor = compression.Compressor(storage_backend.COLUMNS) if compress else None
+    ds = data_store.DataStore(storage_backend.create(storage, sqlite_path=sqlite_path), buffered=True, compressor=compressor,
+                              spool_path=spool_path, threaded=not async_mode)
+    ring = sample_ring.SampleRing(ring_path, writable=True)
+
+  first_sample = []
+  def log_sample(sample):
+    if not first_sample:
+      first_sample.append(sample)
+      profile.mark('first sample')
+    if sample.topic in device_topics.values():
+      logging.info(f'{sample.topic:>18}: {sample.value}℃ {fahrenheit(sample.value)}℉')
+    else:
+      logging.info(f'{sample.topic:>18}: {sample.value}')
+
+  storage_snapshot = sample_bus.Snapshot(storage_backend.COLUMNS, period=data_store.SAMPLE_PERIOD)
+  def store_sample(sample):
+    row = storage_snapshot.update(sample)
+    if row:
+      ring.append(*row)
+      ds.add_data(*row[1:], timestamp=row[0])
+
+  policy = refresh_policy.RefreshPolicy(min_interval=min_refresh_interval)
+  turtle_display = []
+  def display_sample(sample):
+    # Queue of one, a refresh always shows the latest value of every topic
+    latest = [bus.latest(topic) for topic in DISPLAY_TOPICS]
+    if all(latest):
+      # The fonts and icons are loaded by the first refresh
+      first = not turtle_display
+      if first:
+        with profile.step('display fonts and icons'):
+          turtle_display.append(TurtleDisplay(inky_service, policy=policy))
+      turtle_display[0].display(*(s.value for s in latest))
+      if async_mode:
+        inky_service.refresh()
+      if first:
+        profile.mark('first display')
+        log_profile()
+
+  add_stage = rt.add_stage if async_mode else bus.add_stage
+  add_stage('Logging', log_sample)
+  add_stage('Storage', store_sample, topics=storage_backend.COLUMNS)
+  if not async_mode:
+    bus.start()
+
+  def publish_temperature(dev, temp_c, timestamp):
+    topic = device_topics.get(dev.device_id)
+    if topic:
+      bus.publish(topic, temp_c, timestamp)
+    else:
+      logging.debug(f'Ignoring unknown DS18B20 {dev.device_id}')
+
+  def publish_temperatures(readings):
+    for reading in readings:
+      publish_temperature(*reading)
+
+  def publish_distance(distance, average, timestamp):
+    bus.publish('water_dist', distance, timestamp)
+    bus.publish('water_dist_average', average, timestamp)
+
+  def publish_uv(uva, uvb, uv_index, timestamp):
+    bus.publish('uva', uva, timestamp)
+    bus.publish('uvb', uvb, timestamp)
+    bus.publish('uv_index', uv_index, timestamp)
+
+  with profile.step('sensors'):
+    DS18B20.set_adaptive_resolution(adaptive_resolution)
+    uv_sensor = UVSensor(measure_period=5, lamp_hours=lamp_hours)
+    distance_sensor = UltrasonicSensor(measure_period=5)
+
+  if async_mode:
+    with profile.step('display'):
+      inky_service = inky_display_service.InkyDisplayService()
+      rt.add_stage('Display', display_sample, topics=DISPLAY_TOPICS, maxsize=1, blocking=True)
+    rt.add_periodic('DS18B20 Sampler', DS18B20.sample, 5, publish_temperatures)
+    rt.add_periodic('UV Sensor Sampler', uv_sensor.sample, 5, lambda result: publish_uv(*result))
+    rt.add_periodic('Ultrasonic Sensor Sampler', distance_sensor.sample, 5, lambda result: publish_distance(*result))
+    rt.add_periodic('DataStore Service', ds.service, lambda: min(ds.service_timeout, data_store.SAMPLE_PERIOD))
+    logging.info('Turtle Monitor started')
+    rt.run()
+    DS18B20.close()
+    inky_service.close()
+  else:
+    # The sensors are sampling while the display is set up
+    with profile.step('sensors start'):
+      DS18B20.subscribe(publish_temperature)
+      DS18B20.start(period=5)
+
+      uv_sensor.subscribe(publish_uv)
+      uv_sensor.start()
+
+      distance_sensor.subscribe(publish_distance)
+      distance_sensor.start()
+    with profile.step('display'):
+      inky_service = inky_display_service.InkyDisplayService()
+      inky_service.start()
+      bus.add_stage('Display', display_sample, topics=DISPLAY_TOPICS, maxsize=1)
+    logging.info('Turtle Monitor started')
+
+    try:
+      while True:
+        time.sleep(60)
+    except KeyboardInterrupt:
+      pass
+
+    # Stop the publishers first, the stages then handle what is left in their queues
+    distance_sensor.shutdown()
+    uv_sensor.shutdown()
+    DS18B20.shutdown()
+    DS18B20.unsubscribe(publish_temperature)
+    bus.shutdown()
+    inky_service.shutdown()
 
   ds.close()
-  distance_sensor.shutdown()
-  inky_service.shutdown()
-  DS18B20.shutdown()
-  logging.info('Turtle Monitor stopped')
+  ring.close()
+  log_profile()
+  logging.info(f'Turtle Monitor stopped, {policy.refreshes} display refreshes, {policy.suppressed} held back')
 
 
 if __name__ == "__main__":
@@ -226,7 +373,82 @@ if __name__ == "__main__":
       type=bool,
       help='Collect temperature reading in async mode'
   )
+  parser.add_argument(
+      '--storage',
+      default=storage_backend.MySQLBackend.name,
+      choices=storage_backend.BACKENDS.keys(),
+      help='Database used to store the readings. default: mysql'
+  )
+  parser.add_argument(
+      '--sqlite-path',
+      default=storage_backend.SQLITE_PATH,
+      help=f'Database file of the sqlite storage. default: {storage_backend.SQLITE_PATH}'
+  )
+  parser.add_argument(
+      '--compress',
+      default=False,
+      type=bool,
+      help='Only store the readings needed to rebuild them within their tolerances'
+  )
+  parser.add_argument(
+      '--adaptive-resolution',
+      default=False,
+      type=bool,
+      help='Lower the temperature sensor resolution while the temperature is stable'
+  )
+  parser.add_argument(
+      '--spool-path',
+      default=data_store.SPOOL_PATH,
+      help=f'File keeping readings while the database is unavailable. default: {data_store.SPOOL_PATH}'
+  )
+  parser.add_argument(
+      '--ring-path',
+      default=sample_ring.RING_PATH,
+      help=f'Memory mapped file of the recent readings. default: {sample_ring.RING_PATH}'
+  )
+  parser.add_argument(
+      '--runtime',
+      default=THREADS,
+      choices=RUNTIMES,
+      help='Run the sensors, storage and display on threads or as coroutines of one asyncio event loop. default: threads'
+  )
+  parser.add_argument(
+      '--lamp-hours',
+      default=None,
+      type=parse_hours,
+      help='on-off local hours of the UV lamp, the UV sensor is not polled outside of them, e.g. 8-20. default: always polled'
+  )
+  parser.add_argument(
+      '--min-refresh-interval',
+      default=refresh_policy.MIN_INTERVAL,
+      type=float,
+      help=f'Seconds between two refreshes of the e-ink display. default: {refresh_policy.MIN_INTERVAL}'
+  )
+  parser.add_argument(
+      startup_profile.FLAG,
+      action='store_true',
+      help='Log the time spent in every import and init step until the first display refresh'
+  )
+  parser.add_argument(
+      '--simulate',
+      default=False,
+      type=bool,
+      help='Run with simulated sensors and display instead of the Raspberry Pi hardware'
+  )
   args = parser.parse_args()
   logging.basicConfig(level=args.log_level)
 
-  main()
+  if args.simulate:
+    import simulation
+    hal.use(simulation.Simulation())
+
+  profile = None
+  if args.profile_startup:
+    # Started before the imports, unless the flag was abbreviated
+    profile = startup_profile.profile() or startup_profile.StartupProfile()
+
+  main(storage=args.storage, sqlite_path=args.sqlite_path, compress=args.compress,
+       adaptive_resolution=args.adaptive_resolution, spool_path=args.spool_path, ring_path=args.ring_path,
+       runtime=args.runtime, lamp_hours=args.lamp_hours, min_refresh_interval=args.min_refresh_interval,
+       profile=profile)
+  hal.backend().close()
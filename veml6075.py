@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import datetime
+import hal
+import logging
+import threading
+import time
+
+MEASURE_PERIOD = 5  # 5s between readings
+
+# Integration times supported by the VEML6075, in ms. The counts grow with the integration time,
+# readings are scaled back to REFERENCE_INTEGRATION_TIME so they do not depend on it.
+INTEGRATION_TIMES = (50, 100, 200, 400, 800)
+REFERENCE_INTEGRATION_TIME = 100
+
+# Adaptive integration time: shorter before the 16 bit counts saturate under the UVB lamp,
+# longer for a better resolution in the dark. Doubling from LOW_COUNTS stays under HIGH_COUNTS.
+MAX_COUNTS = 65535
+HIGH_COUNTS = int(MAX_COUNTS * 0.7)
+LOW_COUNTS = HIGH_COUNTS // 4
+
+
+def parse_hours(hours):
+  # '8-20' -> (8, 20)
+  on, off = (int(hour) for hour in hours.split('-'))
+  if not (0 <= on < 24 and 0 <= off < 24):
+    raise ValueError(f'Invalid hours {hours}, expected on-off between 0 and 23')
+  return on, off
+
+
+class UVSensor:
+  def __init__(self, integration_time=REFERENCE_INTEGRATION_TIME, measure_period=MEASURE_PERIOD, adaptive=True, lamp_hours=None,
+               sensor=None):
+    if integration_time not in INTEGRATION_TIMES:
+      raise ValueError(f'Unsupported integration time {integration_time}, expected one of {INTEGRATION_TIMES}')
+    self._measure_period = measure_period
+    self._adaptive = adaptive
+    # (on, off) local hours of the UV lamp, the sensor is not polled outside of them. None polls all the time.
+    self._lamp_hours = lamp_hours
+    self._sensor = sensor if sensor is not None else hal.uv_sensor(integration_time=integration_time)
+    self._integration_time = integration_time
+    self._uv_data = (0.0, 0.0, 0.0)
+    self._timestamp = None
+    self._lamp_off = False
+    self._async_mode = False
+    self._service_thread = None
+    self._stop_event = threading.Event()
+    self._subscribers = []
+    self._subscribers_lock = threading.Lock()
+
+  @property
+  def integration_time(self):
+    return self._integration_time
+
+  @property
+  def lamp_hours(self):
+    return self._lamp_hours
+
+  @property
+  def timestamp(self):
+    return self._timestamp
+
+  @property
+  def uv_data(self):
+    # (uva, uvb, uv_index) at the reference integration time
+    if not self._async_mode:
+      self.sample()
+    return self._uv_data
+
+  def lamp_off(self, now=None):
+    if self._lamp_hours is None:
+      return False
+    on, off = self._lamp_hours
+    hour = (now or datetime.datetime.now()).hour
+    if on <= off:
+      return not on <= hour < off
+    return off <= hour < on
+
+  def _set_integration_time(self, integration_time):
+    try:
+      self._sensor.integration_time = integration_time
+    except (OSError, ValueError) as ex:
+      logging.warning(f'Could not set the VEML6075 integration time to {integration_time}ms, stop adapting it: {ex}')
+      self._adaptive = False
+      return
+    logging.debug(f'VEML6075 integration time {self._integration_time}ms -> {integration_time}ms')
+    self._integration_time = integration_time
+
+  def _adapt_integration_time(self, counts):
+    # The new integration time applies from the next reading, a period later
+    index = INTEGRATION_TIMES.index(self._integration_time)
+    if counts > HIGH_COUNTS and index > 0:
+      self._set_integration_time(INTEGRATION_TIMES[index - 1])
+    elif counts < LOW_COUNTS and index < len(INTEGRATION_TIMES) - 1:
+      self._set_integration_time(INTEGRATION_TIMES[index + 1])
+
+  def sample(self):
+    # One reading, returns (uva, uvb, uv_index, timestamp).
+    # Blocks for the I2C transaction, the service calls it on its thread, an event loop in an executor.
+    # Outside of the lamp hours the sensor is left alone and the reading is 0.
+    if self.lamp_off():
+      if not self._lamp_off:
+        logging.info('UV lamp off, stop polling the VEML6075')
+        self._lamp_off = True
+      self._uv_data = (0.0, 0.0, 0.0)
+    else:
+      if self._lamp_off:
+        logging.info('UV lamp on, polling the VEML6075')
+        self._lamp_off = False
+      integration_time = self._integration_time
+      uva, uvb, uv_index = self._sensor.uv_data
+      scale = REFERENCE_INTEGRATION_TIME / integration_time
+      self._uv_data = (uva * scale, uvb * scale, uv_index * scale)
+      if self._adaptive:
+        self._adapt_integration_time(max(uva, uvb))
+    self._timestamp = time.time()
+    return self._uv_data + (self._timestamp,)
+
+  def subscribe(self, callback):
+    # callback(uva, uvb, uv_index, timestamp) after every reading of the service
+    with self._subscribers_lock:
+      self._subscribers = self._subscribers + [callback]
+
+  def unsubscribe(self, callback):
+    with self._subscribers_lock:
+      self._subscribers = [subscriber for subscriber in self._subscribers if subscriber != callback]
+
+  def _notify(self, uva, uvb, uv_index, timestamp):
+    for callback in self._subscribers:
+      try:
+        callback(uva, uvb, uv_index, timestamp)
+      except Exception:
+        logging.exception(f'UV Sensor subscriber {callback} failed')
+
+  def _measure_loop(self):
+    logging.info('UV Sensor measure_loop started')
+    while self._async_mode:
+      begin = time.monotonic()
+      try:
+        self._notify(*self.sample())
+      except OSError as ex:
+        logging.error(f'Could not read the VEML6075: {ex}')
+      elapsed = time.monotonic() - begin
+      wait_period = self._measure_period - elapsed
+      if wait_period > 0:
+        self._stop_event.wait(wait_period)
+    logging.info('UV Sensor measure_loop stopped')
+
+  def start(self):
+    if not self._async_mode:
+      self._stop_event.clear()
+      self._async_mode = True
+      self._service_thread = threading.Thread(target=self._measure_loop, name='UV Sensor Measure Service')
+      self._service_thread.start()
+    else:
+      logging.warning('UV Sensor Measure Service already started')
+
+  def shutdown(self):
+    if self._async_mode:
+      self._async_mode = False
+      self._stop_event.set()
+      self._service_thread.join()
+    else:
+      logging.warning('UV Sensor Measure Service not started')
+
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--log-level',
+      default=logging.INFO,
+      type=lambda x: getattr(logging, x),
+      help='Configure the logging level. default: INFO'
+  )
+  parser.add_argument(
+      '--async-mode',
+      default=False,
+      type=bool,
+      help='Collect UV reading in async mode'
+  )
+  parser.add_argument(
+      '--adaptive-integration',
+      default=True,
+      type=bool,
+      help='Adapt the integration time to the light level. default: True'
+  )
+  parser.add_argument(
+      '--lamp-hours',
+      default=None,
+      type=parse_hours,
+      help='on-off local hours of the UV lamp, the sensor is not polled outside of them, e.g. 8-20. default: always polled'
+  )
+  parser.add_argument(
+      '--simulate',
+      default=False,
+      type=bool,
+      help='Use a simulated sensor instead of the I2C bus'
+  )
+  args = parser.parse_args()
+  logging.basicConfig(level=args.log_level)
+
+  if args.simulate:
+    import simulation
+    hal.use(simulation.Simulation())
+
+  uv_sensor = UVSensor(measure_period=1, adaptive=args.adaptive_integration, lamp_hours=args.lamp_hours)
+  if args.async_mode:
+    uv_sensor.start()
+    time.sleep(1)
+
+  try:
+    while True:
+      uva, uvb, uv_index = uv_sensor.uv_data
+      print(f'uva={uva}, uvb={uvb}, uv_index={uv_index}, integration time {uv_sensor.integration_time}ms')
+      time.sleep(1)
+  except KeyboardInterrupt:
+    if args.async_mode:
+      uv_sensor.shutdown()
+    hal.backend().close()